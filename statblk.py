@@ -9,21 +9,71 @@ Run embedded doctests::
 
     python -m doctest statblk.py -v
 """
-import argparse
+import array
+import math
 import os
+import queue
 import re
 import shutil
 import stat
 import sys
+import threading
 import time
-import traceback
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
+
+# (directory, file name, code object) of an embedded multiCMD compile that save_multicmd_cache() should keep
+_MULTICMD_CACHE = None
+
+def _multicmd_cache_dir():
+	"""Directory of the embedded multiCMD bytecode cache, None where it must not be used.
+
+	Root never uses it: with sudo -E (or a sudo keeping HOME) it would run code
+	the invoking user can write.
+	"""
+	if not hasattr(os, 'geteuid') or os.geteuid() == 0:
+		return None
+	return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'statblk')
+
+def _private_to_user(st, is_type):
+	"""True when st is of the is_type kind, owned by the effective user and not group / world writable."""
+	return is_type(st.st_mode) and st.st_uid == os.geteuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def save_multicmd_cache():
+	"""Write the embedded multiCMD code object compiled at import to the cache (CLI runs only).
+
+	Only this interpreter's stale entries (same cache tag) are removed, so
+	several Python versions can share the directory.
+	"""
+	global _MULTICMD_CACHE
+	if _MULTICMD_CACHE is None:
+		return
+	import marshal
+	cache_dir, cache_name, code = _MULTICMD_CACHE
+	_MULTICMD_CACHE = None
+	tmp_path = os.path.join(cache_dir, f'{cache_name}.{os.getpid()}.tmp')
+	try:
+		os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+		if not _private_to_user(os.lstat(cache_dir), stat.S_ISDIR):
+			return
+		tag_prefix = f'multiCMD-{sys.implementation.cache_tag}-'
+		for stale in os.listdir(cache_dir):
+			if stale.startswith(tag_prefix) and stale.endswith('.bin') and stale != cache_name:
+				os.remove(os.path.join(cache_dir, stale))
+		fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+		with os.fdopen(fd, 'wb') as f:
+			marshal.dump(code, f)
+		os.replace(tmp_path, os.path.join(cache_dir, cache_name))
+	except Exception:
+		try:
+			os.unlink(tmp_path)
+		except Exception:
+			pass
 
 try:
 	import multiCMD  # type: ignore
 	assert float(multiCMD.version) >= 1.47
 except (ImportError, AssertionError):
-	import sys,types,base64,lzma   # noqa: E401
+	import sys,types,marshal,zlib   # noqa: E401
 	multiCMD = types.ModuleType("multiCMD")
 	sys.modules["multiCMD"] = multiCMD
 	_SRC_B85=r'''
@@ -104,16 +154,37 @@ YN1T,,0D"MF*:(U`S\<N;7gK$l%&lq]o5glY&r-37nSAISQ>\h6]c1%SWEm;'-$bGQS!!8Cq5ik:rR,<
 N*I0[aMNKA7KNHu-`DXr=/WgYKNF(5D"%3*ks4Wr!j-3[@s2"8PM/5?eUJt;PV&T:u![O[Y[A'!8[2O>]rF,1j/G=#f_XBB$@5g!/Nq"m8P@-Doa%WoE
 J%qnMk3G%Ki=s>n[1@,^@>j\8FEhN0`om\)D0qE:R`HqPJ4V2sGJQF,mfou/XJaY?rc[UV'\!tti]K/e%3;p7@SNFf[s'7\]4L4kbgc8r$2#b)fj<"rX
 3o1Z^c;DqS!6qW$2SYp!!/0?QbEJ#:7ZhqZ,C;P!WW3#!!HG.'''
-	exec(lzma.decompress(base64.a85decode(_SRC_B85)).decode("utf-8"), multiCMD.__dict__)
+	def _load_embedded_multicmd():
+		# Decompressing and compiling the blob dominates startup; reuse the code object main() saved in ~/.cache/statblk
+		global _MULTICMD_CACHE
+		cache_dir = _multicmd_cache_dir()
+		cache_name = f'multiCMD-{sys.implementation.cache_tag}-{zlib.crc32(_SRC_B85.encode()):08x}.bin'
+		if cache_dir is not None:
+			try:
+				if _private_to_user(os.lstat(cache_dir), stat.S_ISDIR):
+					fd = os.open(os.path.join(cache_dir, cache_name), os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+					with os.fdopen(fd, 'rb') as f:
+						if _private_to_user(os.fstat(f.fileno()), stat.S_ISREG):
+							code = marshal.load(f)
+							if isinstance(code, types.CodeType):
+								return code
+			except Exception:
+				pass
+		import base64,lzma   # noqa: E401
+		code = compile(lzma.decompress(base64.a85decode(_SRC_B85)).decode("utf-8"), "<multiCMD>", "exec")
+		if cache_dir is not None:
+			_MULTICMD_CACHE = (cache_dir, cache_name, code)
+		return code
+	exec(_load_embedded_multicmd(), multiCMD.__dict__)
 
 try:
 	import functools
-	import typing
+	from collections.abc import Mapping
 	# Check if functiools.cache is available
 	# cache_decorator = functools.cache
 	def cache_decorator(user_function):
 		def _make_hashable(item):
-			if isinstance(item, typing.Mapping):
+			if isinstance(item, Mapping):
 				# Sort items so that {'a':1, 'b':2} and {'b':2, 'a':1} hash the same
 				return tuple(
 					( _make_hashable(k), _make_hashable(v) )
@@ -124,20 +195,38 @@ try:
 			# Fallback: assume item is already hashable
 			return item
 		def decorating_function(user_function):
-			# Create the real cached function
-			cached_func = functools.lru_cache(maxsize=None)(user_function)
+			# Plain dict instead of lru_cache so single entries can be invalidated
+			cache = {}
+			stats = [0, 0]
 			@functools.wraps(user_function)
 			def wrapper(*args, **kwargs):
 				# Convert all args/kwargs to hashable equivalents
 				hashable_args = tuple(_make_hashable(a) for a in args)
-				hashable_kwargs = {
-					k: _make_hashable(v) for k, v in kwargs.items()
-				}
-				# Call the lru-cached version
-				return cached_func(*hashable_args, **hashable_kwargs)
-			# Expose cache statistics and clear method
-			wrapper.cache_info = cached_func.cache_info
-			wrapper.cache_clear = cached_func.cache_clear
+				key = (hashable_args, tuple(sorted((k, _make_hashable(v)) for k, v in kwargs.items())))
+				try:
+					result = cache[key]
+					stats[0] += 1
+					return result
+				except KeyError:
+					pass
+				stats[1] += 1
+				result = user_function(*args, **kwargs)
+				cache[key] = result
+				return result
+			def cache_discard(predicate):
+				# Drop every entry whose positional args satisfy predicate(args)
+				stale_keys = [key for key in list(cache) if predicate(key[0])]
+				for key in stale_keys:
+					cache.pop(key, None)
+				return len(stale_keys)
+			def cache_clear():
+				# Like lru_cache, clearing also resets the hit / miss counts
+				cache.clear()
+				stats[:] = [0, 0]
+			# Expose cache statistics and clear / discard methods
+			wrapper.cache_info = lambda: functools._CacheInfo(stats[0], stats[1], None, len(cache))
+			wrapper.cache_clear = cache_clear
+			wrapper.cache_discard = cache_discard
 			return wrapper
 		return decorating_function(user_function)
 except Exception:
@@ -156,14 +245,48 @@ SMARTCTL_PATH = shutil.which("smartctl")
 DISKUTIL_PATH = shutil.which("diskutil")
 IS_DARWIN = (sys.platform == "darwin")
 _DEBUG_MODE = False
+# Prefix for every /sys, /proc, /dev and /run path; empty for the live system (see set_root)
+_ROOT = ''
+# Capture archive being replayed (see start_replay); answers probe commands, statvfs and diskstats
+_REPLAY = None
+SMART_CACHE_TTL = 60
+STATVFS_DEADLINE = 1.0
+STATVFS_WORKERS = 8
+STATVFS_TIMEOUT = 'TIMEOUT'
+SCRAPE_MIN_INTERVAL = 5.0
 _LSBLK_PAIRS_SUPPORTED = None
 LSBLK_PAIR_RE = re.compile(r'(\w+)="([^"]*)"')
+UDEV_DATA_DIR = '/run/udev/data'
+UDEV_ESCAPE_RE = re.compile(r'\\x([0-9a-fA-F]{2})')
 
 def debug_exc(context, exc):
 	if _DEBUG_MODE:
+		import traceback
 		print(f"DEBUG [{context}]: {exc}", file=sys.stderr)
 		traceback.print_exc()
 
+def host_path(path):
+	"""Map an absolute host path (/sys, /proc, /dev, /run) under the configured root prefix.
+
+	>>> host_path('/proc/diskstats')
+	'/proc/diskstats'
+	"""
+	return _ROOT + path if _ROOT else path
+
+def strip_root(path):
+	"""Inverse of host_path for paths that resolved inside the root prefix."""
+	if _ROOT and (path == _ROOT or path.startswith(_ROOT + os.path.sep)):
+		return path[len(_ROOT):] or os.path.sep
+	return path
+
+def resolve_dev_path(path):
+	"""realpath() of a device path, following symlinks inside the root prefix."""
+	return strip_root(os.path.realpath(host_path(path)))
+
+def block_sysfs_dir(device):
+	"""/sys/class/block entry for a device path or name."""
+	return host_path(os.path.join('/sys/class/block', os.path.basename(device)))
+
 def compile_filter_pattern(filter_patterns):
 	"""Compile CLI filter patterns into one regex.
 
@@ -181,6 +304,8 @@ def compile_filter_pattern(filter_patterns):
 
 def lsblk_supports_pairs():
 	global _LSBLK_PAIRS_SUPPORTED
+	if _REPLAY is not None:
+		return _REPLAY.lsblk_pairs
 	if _LSBLK_PAIRS_SUPPORTED is not None:
 		return _LSBLK_PAIRS_SUPPORTED
 	try:
@@ -252,7 +377,7 @@ def populate_lsblk_dicts(stdout, output_fields_set, uuid_dict, fstype_dict, labe
 			else:
 				lsblk_name, lsblk_size, lsblk_fstype, lsblk_uuid, lsblk_label = parse_lsblk_raw_line(line)
 			if lsblk_name.startswith(os.path.sep):
-				lsblk_name = os.path.realpath(lsblk_name)
+				lsblk_name = resolve_dev_path(lsblk_name)
 			if 'UUID' in output_fields_set and lsblk_uuid:
 				uuid_dict[lsblk_name] = lsblk_uuid
 			if 'FSTYPE' in output_fields_set and lsblk_fstype:
@@ -280,12 +405,80 @@ def read_int(path):
 	except Exception:
 		return 0
 
+def decode_udev_string(value):
+	"""Decode \\xNN escapes used by udev *_ENC properties.
+
+	>>> decode_udev_string('my\\\\x20label')
+	'my label'
+	>>> decode_udev_string('plain')
+	'plain'
+	"""
+	if '\\x' not in value:
+		return value
+	try:
+		return UDEV_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)), value).encode('latin-1').decode('utf-8', 'replace')
+	except Exception:
+		return value
+
+def parse_udev_db(text):
+	"""Extract the E: properties from one /run/udev/data/b<major>:<minor> file.
+
+	>>> props = parse_udev_db('S:disk/by-uuid/abc\\nE:ID_FS_TYPE=ext4\\nE:ID_FS_UUID=abc\\nG:systemd')
+	>>> props['ID_FS_TYPE'], props['ID_FS_UUID']
+	('ext4', 'abc')
+	"""
+	props = {}
+	for line in text.splitlines():
+		if line.startswith('E:'):
+			key, _, value = line[2:].partition('=')
+			props[key] = value
+	return props
+
+def udev_database_available():
+	return not IS_DARWIN and os.path.isdir(host_path(UDEV_DATA_DIR))
+
+def populate_udev_dicts(block_devices, output_fields_set, uuid_dict, fstype_dict, label_dict, size_dict):
+	"""Populate the same dicts as populate_lsblk_dicts from sysfs and the udev database.
+
+	Returns False when the udev database is missing so the caller can fall back to lsblk.
+	"""
+	if not udev_database_available():
+		return False
+	want_udev = bool({'FSTYPE', 'UUID', 'LABEL'}.intersection(output_fields_set))
+	for block_device in block_devices:
+		sysfs_block_path = block_sysfs_dir(block_device)
+		if 'SIZE' in output_fields_set:
+			size_dict[block_device] = read_size(sysfs_block_path)
+		if not want_udev:
+			continue
+		devnum = read_text(os.path.join(sysfs_block_path, 'dev'))
+		if not devnum:
+			continue
+		udev_text = read_text(host_path(os.path.join(UDEV_DATA_DIR, f'b{devnum}')))
+		if not udev_text:
+			continue
+		props = parse_udev_db(udev_text)
+		fs_uuid = props.get('ID_FS_UUID', '')
+		fs_type = props.get('ID_FS_TYPE', '')
+		if 'ID_FS_LABEL_ENC' in props:
+			fs_label = decode_udev_string(props['ID_FS_LABEL_ENC'])
+		else:
+			fs_label = props.get('ID_FS_LABEL', '')
+		if 'UUID' in output_fields_set and fs_uuid:
+			uuid_dict[block_device] = fs_uuid
+		if 'FSTYPE' in output_fields_set and fs_type:
+			fstype_dict[block_device] = fs_type
+		if 'LABEL' in output_fields_set and fs_label:
+			label_dict[block_device] = fs_label
+	return True
+
 def build_symlink_dict(dir_path):
 	"""
 	Build map: devname -> token (uuid or label string) using symlinks under
 	/dev/disk/by-uuid or /dev/disk/by-label.
 	"""
 	mapping = {}
+	dir_path = host_path(dir_path)
 	if not os.path.isdir(dir_path):
 		return mapping
 	try:
@@ -293,7 +486,7 @@ def build_symlink_dict(dir_path):
 			p = os.path.join(dir_path, entry)
 			try:
 				if os.path.islink(p):
-					tgt = os.path.realpath(p)
+					tgt = strip_root(os.path.realpath(p))
 					mapping.setdefault(tgt, entry)
 			except Exception:
 				continue
@@ -374,8 +567,10 @@ def get_macos_diskutil_info(timeout=4):
 	return info_map
 
 def get_statvfs_use_size(mountpoint):
+	if _REPLAY is not None:
+		return _REPLAY.statvfs.get(mountpoint, (0, 0))
 	try:
-		st = os.statvfs(mountpoint)
+		st = os.statvfs(host_path(mountpoint))
 		block_size = st.f_frsize if st.f_frsize > 0 else st.f_bsize
 		total = st.f_blocks * block_size
 		avail = st.f_bavail * block_size
@@ -384,6 +579,133 @@ def get_statvfs_use_size(mountpoint):
 	except Exception:
 		return 0, 0
 
+class StatvfsProber:
+	"""Run os.statvfs on a bounded pool of daemon threads with a per-mount deadline.
+
+	Each mount's deadline starts when a worker picks up its job, so mounts
+	queued behind slow ones are not charged for the wait. A mount that misses
+	its deadline reports TIMEOUT and is quarantined: it is not probed again
+	until its backoff (doubling up to max_backoff) has expired, and never while
+	an earlier probe of it is still stuck in the kernel. The stuck worker is
+	replaced (up to max_threads threads in all), so dead mounts cannot starve
+	the pool; jobs that never got a worker report TIMEOUT without quarantine.
+
+	>>> prober = StatvfsProber(workers=2, deadline=2)
+	>>> prober.probe_many(['/'])['/'][0] > 0
+	True
+	>>> def fake_statvfs(mountpoint):
+	...     time.sleep({'/dead': 5, '/slow': 0.3}.get(mountpoint, 0))
+	...     return (100, 50)
+	>>> prober = StatvfsProber(workers=1, deadline=0.5, probe=fake_statvfs)
+	>>> sorted(prober.probe_many(['/dead', '/slow', '/fast']).items())
+	[('/dead', None), ('/fast', (100, 50)), ('/slow', (100, 50))]
+	>>> list(prober.quarantine)
+	['/dead']
+	"""
+	def __init__(self, workers=STATVFS_WORKERS, deadline=STATVFS_DEADLINE, base_backoff=5.0, max_backoff=300.0,
+			max_threads=None, probe=None):
+		self.workers = max(1, workers)
+		self.deadline = deadline
+		self.base_backoff = base_backoff
+		self.max_backoff = max_backoff
+		self.max_threads = max(self.workers, max_threads or self.workers * 4)
+		self.probe = probe or get_statvfs_use_size
+		self.jobs = queue.Queue()
+		self.threads = []
+		self.stuck = 0
+		self.in_flight = {}
+		self.quarantine = {}
+		self.lock = threading.Lock()
+		self.changed = threading.Condition(self.lock)
+
+	def _worker(self):
+		while True:
+			mountpoint, job = self.jobs.get()
+			with self.changed:
+				job['started'] = time.monotonic()
+				self.changed.notify_all()
+			job['result'] = self.probe(mountpoint)
+			job['elapsed'] = time.monotonic() - job['started']
+			with self.changed:
+				if self.in_flight.get(mountpoint) is job:
+					del self.in_flight[mountpoint]
+				job['done'].set()
+				self.changed.notify_all()
+				if job['stuck']:
+					self.stuck -= 1
+					# a replacement took over while this probe hung; leave the pool at its size
+					if len(self.threads) - self.stuck > self.workers:
+						self.threads.remove(threading.current_thread())
+						return
+
+	def _start_workers(self):
+		"""Keep workers threads that are not stuck, within max_threads. Call with the lock held."""
+		while len(self.threads) - self.stuck < self.workers and len(self.threads) < self.max_threads:
+			thread = threading.Thread(target=self._worker, name='statblk-statvfs', daemon=True)
+			thread.start()
+			self.threads.append(thread)
+
+	def _submit(self, mountpoint):
+		with self.lock:
+			job = self.in_flight.get(mountpoint)
+			if job is not None:
+				return job
+			job = {'done': threading.Event(), 'result': None, 'submitted': time.monotonic(), 'started': None, 'stuck': False}
+			self.in_flight[mountpoint] = job
+			self._start_workers()
+		self.jobs.put((mountpoint, job))
+		return job
+
+	def _quarantined(self, mountpoint, now):
+		entry = self.quarantine.get(mountpoint)
+		return entry is not None and (now < entry[0] or mountpoint in self.in_flight)
+
+	def _mark_timeout(self, mountpoint, now):
+		previous = self.quarantine.get(mountpoint)
+		backoff = min(previous[1] * 2, self.max_backoff) if previous else self.base_backoff
+		self.quarantine[mountpoint] = (now + backoff, backoff)
+
+	def probe_many(self, mountpoints):
+		"""Return {mountpoint: (total, used)}, with None for mounts that timed out or are quarantined."""
+		results = {}
+		pending = {}
+		now = time.monotonic()
+		for mountpoint in set(mountpoints):
+			if self._quarantined(mountpoint, now):
+				results[mountpoint] = None
+			else:
+				pending[mountpoint] = self._submit(mountpoint)
+		with self.changed:
+			while pending:
+				now = time.monotonic()
+				for mountpoint, job in list(pending.items()):
+					if job['done'].is_set():
+						results[mountpoint] = job['result']
+						self.quarantine.pop(mountpoint, None)
+						profile_item('statvfs', mountpoint, job['elapsed'])
+					elif job['started'] is not None and now - job['started'] >= self.deadline:
+						results[mountpoint] = None
+						self._mark_timeout(mountpoint, now)
+						profile_item('statvfs', mountpoint, now - job['started'])
+						if not job['stuck']:
+							job['stuck'] = True
+							self.stuck += 1
+							self._start_workers()
+					else:
+						continue
+					del pending[mountpoint]
+				if not pending:
+					break
+				if len(self.threads) <= self.stuck and all(job['started'] is None for job in pending.values()):
+					# every worker hangs on a dead mount and no more may be started
+					results.update((mountpoint, None) for mountpoint in pending)
+					break
+				deadlines = [job['started'] + self.deadline for job in pending.values() if job['started'] is not None]
+				self.changed.wait(max(0.0, min(deadlines) - now) if deadlines else self.deadline)
+		return results
+
+_STATVFS_PROBER = None
+
 @cache_decorator
 def read_discard_support(sysfs_block_path):
 	if not sysfs_block_path or not os.path.isdir(sysfs_block_path):
@@ -428,12 +750,236 @@ def read_model_and_serial(sysfs_block_path):
 		serial = ''
 	return model, serial
 
+@cache_decorator
+def find_hwmon_temp_input(sysfs_block_path):
+	"""Path of the drive's temp1_input hwmon sensor, None when it has none.
+
+	NVMe controllers carry hwmonN directly (/sys/class/nvme/nvme0/hwmon2),
+	SATA disks with the drivetemp driver under device/hwmon/ and multipath
+	NVMe namespaces through the controllers of their subsystem.
+	"""
+	if not sysfs_block_path or not os.path.isdir(sysfs_block_path):
+		return None
+	import glob
+	device_path = glob.escape(get_real_sysfs_device_path(sysfs_block_path))
+	for pattern in ('hwmon*/temp1_input', 'hwmon/hwmon*/temp1_input', 'nvme*/hwmon*/temp1_input'):
+		matches = sorted(glob.glob(os.path.join(device_path, pattern)))
+		if matches:
+			return matches[0]
+	return None
+
+def read_hwmon_temperature(parent_name):
+	"""Drive temperature in whole degrees Celsius from hwmon, None without a sensor."""
+	if IS_DARWIN:
+		return None
+	path = find_hwmon_temp_input(os.path.realpath(block_sysfs_dir(parent_name)))
+	if not path:
+		return None
+	try:
+		return int(round(int(read_text(path)) / 1000.0))
+	except (TypeError, ValueError):
+		return None
+
 def read_size(sysfs_block_path):# -> tuple[int | None, Any] | Literal['']:
 	if not sysfs_block_path or not os.path.isdir(sysfs_block_path):
 		return 0
 	sectors = read_int(os.path.join(sysfs_block_path, "size"))
 	return sectors * 512 # linux kernel uses 512 byte sectors
 
+def parse_smartctl_health(lines):
+	"""Extract the overall health from `smartctl -H` output lines.
+
+	>>> parse_smartctl_health(['smartctl 7.2', 'SMART overall-health self-assessment test result: PASSED'])
+	'OK'
+	>>> parse_smartctl_health(['Smartctl open device: /dev/sda failed: Permission denied'])
+	'DENIED'
+	>>> parse_smartctl_health([])
+	''
+	"""
+	for line in lines:
+		line = line.lower()
+		if "health" in line:
+			smartinfo = line.rpartition(':')[2].strip().upper()
+			return smartinfo.replace('PASSED', 'OK')
+		elif "denied" in line:
+			return 'DENIED'
+	return ''
+
+SmartDetails = namedtuple("SmartDetails", ["HEALTH", "TEMP", "WEAR_PCT", "MEDIA_ERR", "POWER_ON_HRS"])
+# ATA attributes whose normalized value counts down from 100 as the flash wears out
+SMART_WEAR_ATTRIBUTES = ('Wear_Leveling_Count', 'SSD_Life_Left', 'Media_Wearout_Indicator', 'Percent_Lifetime_Remain')
+# ATA attributes counting unrecoverable media errors, in order of preference
+SMART_MEDIA_ERROR_ATTRIBUTES = ('Reported_Uncorrect', 'Offline_Uncorrectable')
+
+def parse_smartctl_json(lines):
+	"""Extract health, temperature, wear, media errors and power-on hours from `smartctl --json -H -A` output.
+
+	Reads the NVMe health log, the ATA attribute table or the SCSI counters,
+	whichever the drive reports. Returns None for output that is not JSON:
+	smartctl before 7.0 rejects --json, and callers fall back to `smartctl -H`.
+
+	>>> parse_smartctl_json(['{"smart_status": {"passed": true}, "temperature": {"current": 41},',
+	...     '"nvme_smart_health_information_log": {"percentage_used": 3, "media_errors": 0, "power_on_hours": 8812}}'])
+	SmartDetails(HEALTH='OK', TEMP=41, WEAR_PCT=3, MEDIA_ERR=0, POWER_ON_HRS=8812)
+	>>> parse_smartctl_json(['{"smart_status": {"passed": false}, "power_on_time": {"hours": 20101}, "ata_smart_attributes": {"table": [',
+	...     '{"name": "Wear_Leveling_Count", "value": 93, "raw": {"value": 211}}, {"name": "Reported_Uncorrect", "value": 100, "raw": {"value": 2}}]}}'])
+	SmartDetails(HEALTH='FAILED!', TEMP=None, WEAR_PCT=7, MEDIA_ERR=2, POWER_ON_HRS=20101)
+	>>> parse_smartctl_json(['{"smartctl": {"messages": [{"string": "Smartctl open device: /dev/sda failed: Permission denied"}]}}'])
+	SmartDetails(HEALTH='DENIED', TEMP=None, WEAR_PCT=None, MEDIA_ERR=None, POWER_ON_HRS=None)
+	>>> parse_smartctl_json(['smartctl 6.6', '=======> UNRECOGNIZED OPTION: json']) is None
+	True
+	"""
+	import json
+	try:
+		data = json.loads('\n'.join(lines))
+	except ValueError:
+		return None
+	if not isinstance(data, dict):
+		return None
+	def _int(value):
+		return value if isinstance(value, int) and not isinstance(value, bool) else None
+	status = data.get('smart_status')
+	if isinstance(status, dict) and 'passed' in status:
+		health = 'OK' if status['passed'] else 'FAILED!'
+	else:
+		messages = (data.get('smartctl') or {}).get('messages') or []
+		health = parse_smartctl_health([message.get('string', '') for message in messages if isinstance(message, dict)])
+	temp = _int((data.get('temperature') or {}).get('current'))
+	power_on_hours = _int((data.get('power_on_time') or {}).get('hours'))
+	wear = _int((data.get('endurance_used') or {}).get('current_percent'))
+	if wear is None:
+		wear = _int(data.get('scsi_percentage_used_endurance_indicator'))
+	media_errors = None
+	nvme_log = data.get('nvme_smart_health_information_log')
+	if isinstance(nvme_log, dict):
+		wear = _int(nvme_log.get('percentage_used'))
+		media_errors = _int(nvme_log.get('media_errors'))
+		if power_on_hours is None:
+			power_on_hours = _int(nvme_log.get('power_on_hours'))
+		if temp is None:
+			temp = _int(nvme_log.get('temperature'))
+	attributes = {}
+	for attribute in (data.get('ata_smart_attributes') or {}).get('table') or []:
+		if isinstance(attribute, dict) and attribute.get('name'):
+			attributes[attribute['name']] = attribute
+	if wear is None:
+		for name in SMART_WEAR_ATTRIBUTES:
+			value = _int(attributes.get(name, {}).get('value'))
+			if value is not None:
+				wear = max(0, 100 - value)
+				break
+	if media_errors is None:
+		for name in SMART_MEDIA_ERROR_ATTRIBUTES:
+			value = _int((attributes.get(name, {}).get('raw') or {}).get('value'))
+			if value is not None:
+				media_errors = value
+				break
+	error_log = data.get('scsi_error_counter_log')
+	if media_errors is None and isinstance(error_log, dict):
+		counts = [_int((error_log.get(direction) or {}).get('total_uncorrected_errors')) for direction in ('read', 'write', 'verify')]
+		if any(count is not None for count in counts):
+			media_errors = sum(count for count in counts if count is not None)
+	return SmartDetails(health, temp, wear, media_errors, power_on_hours)
+
+def get_smart_identity(parent_name):
+	"""Cache key for a drive: model and serial/WWID, or the device path if it has neither."""
+	if IS_DARWIN or not parent_name:
+		return f'dev:{parent_name}'
+	model, serial = read_model_and_serial(os.path.realpath(block_sysfs_dir(parent_name)))
+	if not serial:
+		return f'dev:{parent_name}'
+	return f'{model}|{serial}'
+
+def smart_details_identity(identity):
+	return f'{identity}|json'
+
+class SmartCache:
+	"""SMART results keyed by drive identity and reused until ttl seconds pass.
+
+	Health strings are stored under the drive identity and SmartDetails from
+	`smartctl --json` under smart_details_identity(). Lives in memory for watch mode; when path is set, entries are loaded from and
+	saved to that JSON file so one-shot runs can share results.
+
+	>>> cache = SmartCache(ttl=60)
+	>>> cache.put('m|s1', '/dev/sda', 'OK', now=1000)
+	>>> cache.get('m|s1', '/dev/sda', now=1030)
+	'OK'
+	>>> cache.get('m|s1', '/dev/sda', now=1061) is None
+	True
+	>>> cache.get('m|s1', '/dev/sdb', now=1030) is None
+	True
+	>>> cache.put('m|s2', '/dev/sdb', 'DENIED', now=1000)
+	>>> cache.get('m|s2', '/dev/sdb', now=1030) is None
+	True
+	"""
+	def __init__(self, ttl=SMART_CACHE_TTL, path=None):
+		self.ttl = ttl
+		self.path = path
+		self.entries = {}
+		self.dirty = False
+		if path:
+			self.load()
+
+	def get(self, identity, device, now=None):
+		if self.ttl <= 0:
+			return None
+		entry = self.entries.get(identity)
+		if not entry:
+			return None
+		timestamp, cached_device, health = entry
+		if cached_device != device or (now if now is not None else time.time()) - timestamp > self.ttl:
+			return None
+		return health
+
+	def put(self, identity, device, health, now=None):
+		"""Store a health string or SmartDetails; DENIED and empty results are not kept.
+
+		DENIED only says this run lacked the privileges, so caching it would hide
+		SMART from later --sudo runs sharing the --smart_cache file.
+		"""
+		if isinstance(health, tuple):
+			if health[0] == 'DENIED' or not any(value not in (None, '') for value in health):
+				return
+		elif not health or health == 'DENIED':
+			return
+		if self.ttl <= 0:
+			return
+		self.entries[identity] = (now if now is not None else time.time(), device, health)
+		self.dirty = True
+
+	def load(self):
+		import json
+		try:
+			with open(self.path, 'r', encoding='utf-8') as f:
+				data = json.load(f)
+			self.entries = {k: tuple(v) for k, v in data.items() if isinstance(v, list) and len(v) == 3}
+		except FileNotFoundError:
+			pass
+		except Exception as e:
+			debug_exc('smart cache load', e)
+
+	def save(self):
+		if not self.path or not self.dirty:
+			return
+		import json
+		now = time.time()
+		live = {k: list(v) for k, v in self.entries.items() if now - v[0] <= self.ttl}
+		tmp_path = f'{self.path}.{os.getpid()}.tmp'
+		try:
+			os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+			with open(tmp_path, 'w', encoding='utf-8') as f:
+				json.dump(live, f)
+			os.replace(tmp_path, self.path)
+			self.dirty = False
+		except Exception as e:
+			debug_exc('smart cache save', e)
+			try:
+				os.unlink(tmp_path)
+			except Exception:
+				pass
+
+_SMART_CACHE = SmartCache()
+
 MountEntry = namedtuple("MountEntry", ["MOUNTPOINT", "FSTYPE", "OPTIONS"])
 
 def parse_mountinfo_line(line):
@@ -459,7 +1005,7 @@ def parse_mountinfo_line(line):
 	fstype = parts[dash_idx + 1]
 	device_name = _decode_proc_path(parts[dash_idx + 2])
 	if device_name.startswith(os.path.sep):
-		device_name = os.path.realpath(device_name)
+		device_name = resolve_dev_path(device_name)
 	options = [x.strip() for x in mount_options_str.split(',') if x.strip()]
 	return device_name, MountEntry(mount_point, fstype, options)
 
@@ -477,7 +1023,7 @@ def parse_darwin_mount_line(line):
 		return None
 	device_name = match.group(1)
 	if device_name.startswith(os.path.sep):
-		device_name = os.path.realpath(device_name)
+		device_name = resolve_dev_path(device_name)
 	mount_point = match.group(2)
 	options = [x.strip() for x in match.group(3).split(",") if x.strip()]
 	fstype = options[0] if options else ""
@@ -495,7 +1041,7 @@ def parseMount():
 				mount_table[device_name].append(entry)
 		return mount_table
 	try:
-		with open('/proc/self/mountinfo', 'r', encoding='utf-8', errors='ignore') as f:
+		with open(host_path('/proc/self/mountinfo'), 'r', encoding='utf-8', errors='ignore') as f:
 			for line in f:
 				parsed = parse_mountinfo_line(line)
 				if parsed:
@@ -505,29 +1051,194 @@ def parseMount():
 		debug_exc('parseMount', e)
 	return mount_table
 
+def scan_block_devices():
+	"""Linux: list /dev paths for the entries in /sys/class/block."""
+	block_devices = []
+	try:
+		sys_class_block = host_path("/sys/class/block")
+		for entry in os.listdir(sys_class_block):
+			if os.path.isdir(os.path.join(sys_class_block, entry)):
+				block_devices.append(f'/dev/{entry}')
+	except Exception as e:
+		debug_exc('get_blocks linux', e)
+	return block_devices
+
+NETLINK_KOBJECT_UEVENT = 15
+
+def parse_uevent(data):
+	"""Parse one kernel uevent datagram into a property dict.
+
+	>>> props = parse_uevent(b'add@/devices/virtual/block/loop9\\x00ACTION=add\\x00DEVPATH=/devices/virtual/block/loop9\\x00SUBSYSTEM=block\\x00DEVNAME=loop9\\x00')
+	>>> props['ACTION'], props['SUBSYSTEM'], props['DEVPATH']
+	('add', 'block', '/devices/virtual/block/loop9')
+	>>> parse_uevent(b'libudev\\x00\\xfe\\xed')
+	{}
+	"""
+	header, _, payload = data.partition(b'\0')
+	if b'@' not in header:
+		# udev daemon re-broadcasts use a binary header; only kernel events are handled
+		return {}
+	props = {}
+	for item in payload.split(b'\0'):
+		key, sep, value = item.partition(b'=')
+		if sep:
+			props[key.decode('utf-8', 'ignore')] = value.decode('utf-8', 'ignore')
+	return props
+
+class UeventMonitor:
+	"""Keep the block device set current from NETLINK_KOBJECT_UEVENT events.
+
+	The socket is bound before the initial directory scan so no event between
+	the two is lost; later calls to poll() only drain pending datagrams.
+	"""
+	def __init__(self):
+		import socket
+		self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+		try:
+			self.sock.bind((0, 1))
+			self.sock.setblocking(False)
+		except Exception:
+			self.sock.close()
+			raise
+		self.buf = bytearray(65536)
+		self.devices = set(scan_block_devices())
+
+	def poll(self):
+		"""Apply pending add/remove/change events and invalidate caches of touched devices."""
+		touched = set()
+		while True:
+			try:
+				size = self.sock.recv_into(self.buf)
+			except (BlockingIOError, InterruptedError):
+				break
+			except OSError as e:
+				# ENOBUFS: the kernel dropped events, resynchronise from sysfs
+				debug_exc('uevent recv', e)
+				rescanned = set(scan_block_devices())
+				touched.update(rescanned.symmetric_difference(self.devices))
+				self.devices = rescanned
+				continue
+			props = parse_uevent(bytes(self.buf[:size]))
+			if props.get('SUBSYSTEM') != 'block' or not props.get('DEVPATH'):
+				continue
+			device = '/dev/' + os.path.basename(props['DEVPATH'])
+			action = props.get('ACTION')
+			if action == 'add':
+				self.devices.add(device)
+			elif action == 'remove':
+				self.devices.discard(device)
+			touched.add(device)
+		if touched:
+			invalidate_device_caches(touched)
+		return touched
+
+	def close(self):
+		self.sock.close()
+
+_UEVENT_MONITOR = None
+
+def set_root(root):
+	"""Read /sys, /proc, /dev and /run below root instead of the live system ('' or '/' to reset).
+
+	Cached probes, the diskstats reader and the change watchers are reset so
+	nothing read from the previous root leaks through.
+	"""
+	global _ROOT
+	global _DISKSTATS_READER
+	global _MOUNT_WATCHER
+	global _KNOWN_BLOCK_DEVICES
+	global _UEVENT_MONITOR
+	global _DEVICE_GRAPH
+	root = os.path.abspath(root).rstrip(os.path.sep) if root else ''
+	_ROOT = root
+	for reader in (_DISKSTATS_READER, _MOUNT_WATCHER, _UEVENT_MONITOR):
+		if reader is not None:
+			try:
+				reader.close()
+			except Exception:
+				pass
+	_DISKSTATS_READER = None
+	_MOUNT_WATCHER = None
+	_UEVENT_MONITOR = None
+	_KNOWN_BLOCK_DEVICES = None
+	_DEVICE_GRAPH = None
+	parseMount.cache_clear()
+	get_macos_diskutil_info.cache_clear()
+	for cached_function in device_scoped_caches():
+		cached_function.cache_clear()
+
+# set once smartctl answered --json with something that is not JSON (smartctl before 7.0)
+_SMARTCTL_JSON_UNSUPPORTED = False
+
+def smartctl_json_available():
+	"""smartctl --json output can be had: smartctl is runnable and understands it, or the capture recorded it."""
+	if _SMARTCTL_JSON_UNSUPPORTED:
+		return False
+	if _REPLAY is not None:
+		return _REPLAY.has_smart_json
+	return smartctl_available()
+
+def probe_commands_available():
+	"""External commands describe the live host; under a root prefix only a replay can answer them."""
+	return _REPLAY is not None or not _ROOT
+
+def smartctl_available():
+	if _REPLAY is not None:
+		return _REPLAY.has_smart
+	return bool(SMARTCTL_PATH) and not _ROOT
+
+def run_probe_command(key, command, timeout=None):
+	"""Start an external probe command without waiting; a replay answers it from the capture.
+
+	key names the probe independently of the binary path ('lsblk', 'smartctl -H /dev/sda').
+	Returns an object with thread, returncode and stdout like a multiCMD task.
+	"""
+	if _REPLAY is not None:
+		return _REPLAY.command(key)
+	return multiCMD.run_command(command, timeout=timeout, quiet=True, wait_for_return=False, return_object=True)
+
+def sample_clock():
+	"""Timestamp for counter samples: the capture offset while replaying, else time.monotonic()."""
+	if _REPLAY is not None:
+		return _REPLAY.clock()
+	return time.monotonic()
+
+def enable_uevent_monitor():
+	"""Track block devices through kernel uevents; returns False when the socket is unavailable."""
+	global _UEVENT_MONITOR
+	if IS_DARWIN or _ROOT:
+		return False
+	if _UEVENT_MONITOR is not None:
+		return True
+	try:
+		_UEVENT_MONITOR = UeventMonitor()
+		return True
+	except Exception as e:
+		debug_exc('uevent monitor', e)
+		return False
+
 def get_blocks():
 	if IS_DARWIN:
 		# On macOS, enumerate /dev/disk* and /dev/disk*s* nodes.
 		block_devices = []
 		try:
-			for entry in os.listdir("/dev"):
+			for entry in os.listdir(host_path("/dev")):
 				if re.match(r"^disk\d+(s\d+)?$", entry):
 					block_devices.append(f"/dev/{entry}")
 		except Exception:
 			pass
 		return sorted(block_devices)
-	# Linux: get entries in /sys/class/block
-	block_devices = []
-	try:
-		for entry in os.listdir("/sys/class/block"):
-			if os.path.isdir(os.path.join("/sys/class/block", entry)):
-				block_devices.append(f'/dev/{entry}')
-	except Exception as e:
-		debug_exc('get_blocks linux', e)
-	return block_devices
+	# Linux: use the uevent-maintained set when available, otherwise scan /sys/class/block
+	if _UEVENT_MONITOR is not None:
+		_UEVENT_MONITOR.poll()
+		return list(_UEVENT_MONITOR.devices)
+	return scan_block_devices()
 
 @cache_decorator
 def is_block_device(devpath):
+	if _ROOT:
+		# Device nodes under a root prefix are plain files; trust sysfs instead
+		return os.path.exists(host_path(devpath)) and os.path.isdir(block_sysfs_dir(devpath))
 	try:
 		st_mode = os.stat(devpath).st_mode
 		return stat.S_ISBLK(st_mode)
@@ -551,7 +1262,7 @@ def get_partition_parent_name(name):
 			return parent if is_block_device(parent) else None
 		dev = os.path.join("/dev", name)
 		return dev if is_block_device(dev) else None
-	sysfs_block_path = os.path.realpath(os.path.join('/sys/class/block', name))
+	sysfs_block_path = os.path.realpath(block_sysfs_dir(name))
 	if not sysfs_block_path or not os.path.isdir(sysfs_block_path):
 		return None
 	part_file = os.path.join(sysfs_block_path, "partition")
@@ -567,165 +1278,1387 @@ def get_sector_size(sysfs_block_path):
 	if not sysfs_block_path or not os.path.isdir(sysfs_block_path):
 		return 512
 	if get_partition_parent_name(sysfs_block_path):
-		sysfs_block_path = os.path.join('/sys/class/block', os.path.basename(get_partition_parent_name(sysfs_block_path)))
+		sysfs_block_path = block_sysfs_dir(get_partition_parent_name(sysfs_block_path))
 	sector_size = read_int(os.path.join(sysfs_block_path, "queue", "hw_sector_size"))
 	if sector_size == 0:
 		sector_size = read_int(os.path.join(sysfs_block_path, "queue", "logical_block_size"))
 	return sector_size if sector_size else 512
 
-def get_read_write_rate_throughput_iter(sysfs_block_path):
-	if IS_DARWIN:
-		# Per-device throughput is Linux /sys stat based; return zeros on macOS.
-		while True:
-			yield 0, 0
-	if not sysfs_block_path or not os.path.isdir(sysfs_block_path):
-		while True:
-			yield 0, 0
-	rx_path = os.path.join(sysfs_block_path, "stat")
-	start_time = time.monotonic()
-	sector_size = get_sector_size(sysfs_block_path)
-	previous_bytes_read = 0
-	previous_bytes_written = 0
-	try:
-		with open(rx_path, "r", encoding="utf-8", errors="ignore") as f:
-			fields = f.read().strip().split()
-		if len(fields) < 8:
-			yield 0, 0
-		else:
-			sectors_read = int(fields[2])
-			read_time = int(fields[3]) / 1000.0
-			sectors_written = int(fields[6])
-			write_time = int(fields[7]) / 1000.0
-			read_throughput = (sectors_read * sector_size) / read_time if read_time > 0 else 0
-			write_throughput = (sectors_written * sector_size) / write_time if write_time > 0 else 0
-			previous_bytes_read = sectors_read * sector_size
-			previous_bytes_written = sectors_written * sector_size
-			yield int(read_throughput), int(write_throughput)
-	except Exception as e:
-		debug_exc('throughput initial', e)
-		yield 0, 0
-	while True:
+class MountTableWatcher:
+	"""Detect mount table changes through POLLPRI on /proc/self/mountinfo.
+
+	The kernel flags the open file with POLLERR|POLLPRI whenever the mount
+	namespace changes and clears it again on the next poll.
+	"""
+	def __init__(self, path='/proc/self/mountinfo'):
+		import select
+		self.file = open(host_path(path), 'rb')
+		self.poller = select.poll()
+		self.poller.register(self.file.fileno(), select.POLLPRI | select.POLLERR)
+
+	def changed(self):
 		try:
-			with open(rx_path, "r", encoding="utf-8", errors="ignore") as f:
-				fields = f.read().strip().split()
-			if len(fields) < 7:
-				yield 0, 0
-			# fields: https://www.kernel.org/doc/html/latest/block/stat.html
-			# 0 - reads completed successfully
-			# 1 - reads merged
-			# 2 - sectors read
-			# 3 - time spent reading (ms)
-			# 4 - writes completed
-			# 5 - writes merged
-			# 6 - sectors written
-			# 7 - time spent writing (ms)
-			# 8 - I/Os currently in progress
-			# 9 - time spent doing I/Os (ms)
-			# 10 - weighted time spent doing I/Os (ms)
-			sectors_read = int(fields[2])
-			sectors_written = int(fields[6])
-			bytes_read = sectors_read * sector_size
-			bytes_written = sectors_written * sector_size
-			end_time = time.monotonic()
-			elapsed_time = end_time - start_time
-			start_time = end_time
-			read_throughput = (bytes_read - previous_bytes_read) / elapsed_time if elapsed_time > 0 else 0
-			write_throughput = (bytes_written - previous_bytes_written) / elapsed_time if elapsed_time > 0 else 0
-			previous_bytes_read = bytes_read
-			previous_bytes_written = bytes_written
-			yield int(read_throughput), int(write_throughput)
+			return bool(self.poller.poll(0))
 		except Exception as e:
-			debug_exc('throughput poll', e)
-			yield 0, 0
+			debug_exc('mountinfo poll', e)
+			return True
 
-ALL_OUTPUT_FIELDS = ["NAME", "FSTYPE", "SIZE", "FSUSE%", "MOUNTPOINT", "SMART", "LABEL", "UUID", "MODEL", "SERIAL", "DISCARD", "READ", "WRITE"]
+	def close(self):
+		self.file.close()
 
-# DRIVE_INFO = namedtuple("DRIVE_INFO", 
-# 	["NAME", "FSTYPE", "SIZE", "FSUSEPCT", "MOUNTPOINT", "SMART","RTPT",'WTPT', "LABEL", "UUID", "MODEL", "SERIAL", "DISCARD"])
-def get_drives_info(print_bytes = False, use_1024 = False, mounted_only=False, best_only=False, 
-					formated_only=False, show_zero_size_devices=False,pseudo=False,tptDict=None,
-					full=False,active_only=False,output="all",exclude="",
-					filter_patterns=None,invert_match=False,match_devname_only=False,timeout=None,
-					debug=False):
-	global SMARTCTL_PATH
-	global ALL_OUTPUT_FIELDS
-	global _DEBUG_MODE
-	if debug:
-		_DEBUG_MODE = True
-	if tptDict is None:
-		tptDict = {}
-	if output == "all":
-		output_fields = ALL_OUTPUT_FIELDS
-	else:
-		output_fields = [x.strip().upper() for x in output.split(',')]
-		for field in output_fields:
-			if field not in ALL_OUTPUT_FIELDS:
-				print(f"Ignoring invalid output field: {field}.", file=sys.stderr)
-		output_fields = [f for f in output_fields if f in ALL_OUTPUT_FIELDS]
-	if exclude:
-		exclude_fields = [x.strip().upper() for x in exclude.split(',')]
-		for field in exclude_fields:
-			if field in output_fields:
-				output_fields.remove(field)
-	if not output_fields:
-		print("No valid output fields specified.", file=sys.stderr)
-		return []
-	output_list = [output_fields]
-	output_fields_set = set(output_fields)
-	macos_info = {}
-	if IS_DARWIN and {'SIZE','FSTYPE','UUID','LABEL','MODEL','SERIAL','DISCARD'}.intersection(output_fields_set):
-		macos_info = get_macos_diskutil_info(timeout=timeout if timeout else 4)
-	if (not IS_DARWIN) and {'SIZE','FSTYPE','UUID','LABEL'}.intersection(output_fields_set):
-		if lsblk_supports_pairs():
-			lsblk_cmd = 'lsblk -b -n -p -o NAME,SIZE,FSTYPE,UUID,LABEL -P'
-			lsblk_pairs_format = True
-		else:
-			lsblk_cmd = 'lsblk -brnp -o NAME,SIZE,FSTYPE,UUID,LABEL'
-			lsblk_pairs_format = False
-		lsblk_result = multiCMD.run_command(lsblk_cmd, timeout=timeout, quiet=True, wait_for_return=False, return_object=True)
-	block_devices = get_blocks()
-	for stale_device in [k for k in tptDict if k not in block_devices]:
-		del tptDict[stale_device]
-	smart_infos = {}
-	for block_device in block_devices:
-		if 'SMART' in output_fields_set and SMARTCTL_PATH:
-			parent_name = get_partition_parent_name(block_device)
-			if parent_name:
-				if parent_name not in smart_infos:
-					smart_infos[parent_name] = multiCMD.run_command(f'{SMARTCTL_PATH} -H {parent_name}',timeout=timeout,quiet=True,wait_for_return=False,return_object=True)
-		if block_device not in tptDict:
+_MOUNT_WATCHER = None
+_KNOWN_BLOCK_DEVICES = None
+_DEVICE_GRAPH = None
+
+def device_scoped_caches():
+	return (is_block_device, get_partition_parent_name, get_real_sysfs_device_path,
+		read_model_and_serial, read_discard_support, get_sector_size, find_hwmon_temp_input)
+
+def invalidate_device_caches(devices):
+	"""Drop cached probe results whose first argument refers to one of devices.
+
+	>>> is_block_device('/dev/statblk-doctest-missing')
+	False
+	>>> invalidate_device_caches(['/dev/statblk-doctest-missing'])
+	1
+	"""
+	global _DEVICE_GRAPH
+	names = {os.path.basename(device) for device in devices}
+	if not names:
+		return 0
+	# a touched device may have gained or lost slaves without the device set changing
+	_DEVICE_GRAPH = None
+	def _refers_to_device(args):
+		return bool(args) and isinstance(args[0], str) and os.path.basename(args[0]) in names
+	dropped = 0
+	for cached_function in device_scoped_caches():
+		cache_discard = getattr(cached_function, 'cache_discard', None)
+		if cache_discard:
+			dropped += cache_discard(_refers_to_device)
+	return dropped
+
+def refresh_probe_caches(block_devices):
+	"""Invalidate cached probes that no longer match the system.
+
+	parseMount is re-parsed only after the mount table changed (or every call when
+	change notification is unavailable); device-scoped entries are dropped for
+	devices that appeared or disappeared since the previous call.
+	"""
+	global _MOUNT_WATCHER
+	global _KNOWN_BLOCK_DEVICES
+	mounts_changed = True
+	if not IS_DARWIN:
+		try:
+			if _MOUNT_WATCHER is None:
+				_MOUNT_WATCHER = MountTableWatcher()
+			else:
+				mounts_changed = _MOUNT_WATCHER.changed()
+		except Exception as e:
+			debug_exc('mount watcher', e)
+	if mounts_changed:
+		parseMount.cache_clear()
+	current_devices = set(block_devices)
+	if _KNOWN_BLOCK_DEVICES is not None:
+		invalidate_device_caches(current_devices.symmetric_difference(_KNOWN_BLOCK_DEVICES))
+	_KNOWN_BLOCK_DEVICES = current_devices
+
+def max_known(values):
+	"""Largest of the values that are not None, None when there is none.
+
+	>>> max_known([None, 41, 38]), max_known([None])
+	(41, None)
+	"""
+	known = [value for value in values if value is not None]
+	return max(known) if known else None
+
+def join_distinct(values):
+	"""Comma-join the non-empty values in first-seen order.
+
+	>>> join_distinct(['OK', '', 'OK', 'FAILED'])
+	'OK,FAILED'
+	"""
+	return ','.join(dict.fromkeys(value for value in values if value))
+
+class DeviceGraph:
+	"""Stacking of block devices: partitions on their disk, dm / md devices on their slaves.
+
+	lowers maps each device path to the devices it is built on and uppers is the
+	reverse (holders/ is the kernel's mirror of slaves/, so slaves/ alone gives
+	every edge). Devices without lowers are the physical disks; mapper_names
+	holds the dm/name of device-mapper nodes.
+	"""
+	def __init__(self, block_devices):
+		self.devices = frozenset(block_devices)
+		self.lowers = {}
+		self.uppers = defaultdict(list)
+		self.partitions = set()
+		self.mapper_names = {}
+		self._disks = {}
+		self._tops = {}
+		for device in sorted(self.devices):
+			lowers = []
 			if IS_DARWIN:
-				tptDict[block_device] = get_read_write_rate_throughput_iter(block_device)
+				parent = get_partition_parent_name(device)
+				if parent and parent != device:
+					lowers.append(parent)
+					self.partitions.add(device)
 			else:
-				sysfs_block_path = os.path.join('/sys/class/block', os.path.basename(block_device))
-				tptDict[block_device] = get_read_write_rate_throughput_iter(sysfs_block_path)
-	mount_table = parseMount()
-	target_devices = set(block_devices)
-	if pseudo:
-		target_devices.update(mount_table.keys())
-	if filter_patterns and match_devname_only:
-		pattern = compile_filter_pattern(filter_patterns)
-		filtered_devices = set()
-		for device in target_devices:
-			match = pattern.search(device)
-			if (match and not invert_match) or (not match and invert_match):
-				filtered_devices.add(device)
-		target_devices = filtered_devices
-	target_devices = sorted(target_devices)
-	uuid_dict = {}
-	if 'UUID' in output_fields_set:
-		uuid_dict = build_symlink_dict("/dev/disk/by-uuid")
-	label_dict = {}
-	if 'LABEL' in output_fields_set:
-		label_dict = build_symlink_dict("/dev/disk/by-label")
-	fstype_dict = {}
-	size_dict = {}
-	if (not IS_DARWIN) and {'SIZE','FSTYPE','UUID','LABEL'}.intersection(output_fields_set):
-		lsblk_result.thread.join(1)
-		if lsblk_result.returncode == 0:
-			populate_lsblk_dicts(lsblk_result.stdout, output_fields_set, uuid_dict, fstype_dict, label_dict, size_dict, lsblk_pairs_format)
-	if IS_DARWIN:
-		for devname, info in macos_info.items():
+				sysfs_dir = block_sysfs_dir(device)
+				real_path = os.path.realpath(sysfs_dir)
+				if os.path.exists(os.path.join(real_path, 'partition')):
+					# partitions never have slaves
+					lowers.append(os.path.join('/dev', os.path.basename(os.path.dirname(real_path))))
+					self.partitions.add(device)
+				else:
+					try:
+						lowers.extend(os.path.join('/dev', slave) for slave in sorted(os.listdir(os.path.join(sysfs_dir, 'slaves'))))
+					except OSError:
+						pass
+				if os.path.basename(device).startswith('dm-'):
+					mapper_name = read_text(os.path.join(sysfs_dir, 'dm', 'name'))
+					if mapper_name:
+						self.mapper_names[device] = mapper_name
+			lowers = [lower for lower in lowers if lower in self.devices and lower != device]
+			self.lowers[device] = lowers
+			for lower in lowers:
+				self.uppers[lower].append(device)
+
+	def is_physical(self, device):
+		return device in self.lowers and not self.lowers[device]
+
+	def is_volume(self, device):
+		"""True for a stacked device (dm, md, ...) that nothing else is built on."""
+		return bool(self.lowers.get(device)) and device not in self.partitions and not self.uppers.get(device)
+
+	def physical_disks(self, device):
+		"""Physical disks under device, itself for a disk and [] for devices outside the graph."""
+		if device not in self._disks:
+			if device not in self.lowers:
+				return []
+			self._disks[device] = [device]
+			if self.lowers[device]:
+				self._disks[device] = list(dict.fromkeys(disk for lower in self.lowers[device] for disk in self.physical_disks(lower)))
+		return self._disks[device]
+
+	def top_holders(self, device):
+		"""Topmost dm / md devices stacked on device; bare partitions do not count."""
+		if device not in self._tops:
+			self._tops[device] = []
+			tops = []
+			for upper in self.uppers.get(device, ()):
+				tops.extend(self.top_holders(upper) or ([] if upper in self.partitions else [upper]))
+			self._tops[device] = list(dict.fromkeys(tops))
+		return self._tops[device]
+
+	def display_name(self, device):
+		return self.mapper_names.get(device) or os.path.basename(device)
+
+def get_device_graph(block_devices=None):
+	"""The DeviceGraph of block_devices, rebuilt only when the set or a device changed.
+
+	Without block_devices the graph of the last call is returned.
+	"""
+	global _DEVICE_GRAPH
+	if block_devices is None:
+		if _DEVICE_GRAPH is None:
+			_DEVICE_GRAPH = DeviceGraph(get_blocks())
+		return _DEVICE_GRAPH
+	if _DEVICE_GRAPH is None or _DEVICE_GRAPH.devices != frozenset(block_devices):
+		_DEVICE_GRAPH = DeviceGraph(block_devices)
+	return _DEVICE_GRAPH
+
+DISKSTATS_PATH = '/proc/diskstats'
+STAT_SECTOR_SIZE = 512 # block stat counters are always in 512 byte units
+# fields: https://www.kernel.org/doc/html/latest/block/stat.html
+DiskStat = namedtuple("DiskStat", ["reads", "reads_merged", "sectors_read", "read_ms",
+	"writes", "writes_merged", "sectors_written", "write_ms", "in_flight", "io_ms", "weighted_ms"])
+DiskRates = namedtuple("DiskRates", ["READ", "WRITE", "R_IOPS", "W_IOPS", "R_AWAIT", "W_AWAIT", "UTIL_PCT", "AQU_SZ"])
+ZERO_RATES = DiskRates(0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+def parse_stat_fields(fields):
+	"""Build a DiskStat from the counter fields of a sysfs stat or diskstats line.
+
+	>>> parse_stat_fields('5822 3641 1072898 6659 968 848 26056 593 0 1480 7305'.split()).sectors_written
+	26056
+	>>> parse_stat_fields(['1', '2']) is None
+	True
+	"""
+	if len(fields) < 11:
+		return None
+	return DiskStat(*(int(x) for x in fields[:11]))
+
+def parse_diskstats(data):
+	"""Parse /proc/diskstats content into {'/dev/name': DiskStat} in one pass.
+
+	>>> stats = parse_diskstats(b' 254 0 vda 5822 3641 1072898 6659 968 848 26056 593 0 1480 7305 113 0 1584 48\\n'
+	...                         b'   7 0 loop0 0 0 0 0 0 0 0 0 0 0 0\\n')
+	>>> sorted(stats)
+	['/dev/loop0', '/dev/vda']
+	>>> stats['/dev/vda'].sectors_read, stats['/dev/vda'].io_ms
+	(1072898, 1480)
+	"""
+	stats = {}
+	for line in data.split(b'\n'):
+		parts = line.split()
+		if len(parts) < 14:
+			continue
+		try:
+			stats['/dev/' + parts[2].decode('utf-8', 'ignore')] = DiskStat(*(int(x) for x in parts[3:14]))
+		except ValueError:
+			continue
+	return stats
+
+def read_sysfs_stat(sysfs_block_path):
+	"""Read one sysfs block stat file into a DiskStat (None if unavailable)."""
+	s = read_text(os.path.join(sysfs_block_path, "stat"))
+	if not s:
+		return None
+	try:
+		return parse_stat_fields(s.split())
+	except ValueError:
+		return None
+
+def compute_rates(previous, current, elapsed):
+	"""Compute iostat-style rates between two DiskStat samples taken elapsed seconds apart.
+
+	READ / WRITE are bytes and R_IOPS / W_IOPS operations per second, R_AWAIT /
+	W_AWAIT the mean milliseconds per completed request, UTIL_PCT the share of
+	time the device was busy and AQU_SZ the average queue depth. Without a previous
+	sample, throughput is the lifetime average over the busy time, awaits are
+	lifetime means and R_IOPS / W_IOPS / UTIL_PCT / AQU_SZ are unknown (None):
+	operations per second of busy time would only be 1000 / await.
+
+	>>> r = compute_rates(DiskStat(4, 0, 10, 8, 0, 0, 20, 0, 0, 100, 120), DiskStat(14, 0, 30, 28, 0, 0, 20, 0, 1, 600, 1120), 2.0)
+	>>> r.READ, r.WRITE, r.R_IOPS, r.R_AWAIT, r.W_AWAIT, r.UTIL_PCT, r.AQU_SZ
+	(5120, 0, 5.0, 2.0, 0.0, 25.0, 0.5)
+	>>> r = compute_rates(None, DiskStat(10, 0, 2000, 1000, 0, 0, 0, 0, 0, 0, 0), 0)
+	>>> r.READ, r.R_IOPS, r.R_AWAIT, r.UTIL_PCT
+	(1024000, None, 100.0, None)
+	"""
+	if previous is None:
+		read_time = current.read_ms / 1000.0
+		write_time = current.write_ms / 1000.0
+		return DiskRates(
+			int(current.sectors_read * STAT_SECTOR_SIZE / read_time) if read_time > 0 else 0,
+			int(current.sectors_written * STAT_SECTOR_SIZE / write_time) if write_time > 0 else 0,
+			None,
+			None,
+			current.read_ms / current.reads if current.reads > 0 else 0.0,
+			current.write_ms / current.writes if current.writes > 0 else 0.0,
+			None,
+			None,
+		)
+	if elapsed <= 0:
+		return ZERO_RATES
+	reads = max(0, current.reads - previous.reads)
+	writes = max(0, current.writes - previous.writes)
+	elapsed_ms = elapsed * 1000.0
+	return DiskRates(
+		int(max(0, current.sectors_read - previous.sectors_read) * STAT_SECTOR_SIZE / elapsed),
+		int(max(0, current.sectors_written - previous.sectors_written) * STAT_SECTOR_SIZE / elapsed),
+		reads / elapsed,
+		writes / elapsed,
+		max(0, current.read_ms - previous.read_ms) / reads if reads else 0.0,
+		max(0, current.write_ms - previous.write_ms) / writes if writes else 0.0,
+		min(100.0, 100.0 * max(0, current.io_ms - previous.io_ms) / elapsed_ms),
+		max(0, current.weighted_ms - previous.weighted_ms) / elapsed_ms,
+	)
+
+class DiskStatsReader:
+	"""Read /proc/diskstats through one kept-open fd into a reused buffer."""
+	def __init__(self, path=DISKSTATS_PATH, bufsize=65536):
+		self.path = host_path(path)
+		self.fd = None
+		self.buf = bytearray(bufsize)
+
+	def read(self):
+		return parse_diskstats(self.read_raw())
+
+	def read_raw(self):
+		if self.fd is None:
+			self.fd = os.open(self.path, os.O_RDONLY)
+		os.lseek(self.fd, 0, os.SEEK_SET)
+		size = 0
+		while True:
+			if size == len(self.buf):
+				self.buf.extend(bytes(len(self.buf)))
+			view = memoryview(self.buf)
+			try:
+				got = os.readv(self.fd, [view[size:]])
+			finally:
+				view.release()
+			if got == 0:
+				break
+			size += got
+		return bytes(self.buf[:size])
+
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+_DISKSTATS_READER = None
+
+def read_block_stats(block_devices):
+	"""Return {device: DiskStat} for block_devices, reading /proc/diskstats once.
+
+	Devices missing from /proc/diskstats fall back to their sysfs stat file.
+	"""
+	global _DISKSTATS_READER
+	stats = {}
+	if IS_DARWIN:
+		return stats
+	try:
+		if _REPLAY is not None:
+			stats = _REPLAY.read_diskstats()
+		else:
+			if _DISKSTATS_READER is None:
+				_DISKSTATS_READER = DiskStatsReader()
+			stats = _DISKSTATS_READER.read()
+	except Exception as e:
+		debug_exc('read diskstats', e)
+	for block_device in block_devices:
+		if block_device not in stats:
+			stat_sample = read_sysfs_stat(block_sysfs_dir(block_device))
+			if stat_sample is not None:
+				stats[block_device] = stat_sample
+	return stats
+
+class CounterEntry:
+	"""Last counter sample and computed rates for one device in the shared counter table."""
+	__slots__ = ('stat', 'timestamp', 'rates')
+
+	def __init__(self, stat, timestamp, rates):
+		self.stat = stat
+		self.timestamp = timestamp
+		self.rates = rates
+
+def update_throughput_table(tptDict, block_devices):
+	"""Sample counters for all block_devices at once and refresh their rates in tptDict.
+
+	tptDict maps device -> CounterEntry; devices no longer present are dropped.
+	"""
+	block_devices = set(block_devices)
+	for stale_device in [k for k in tptDict if k not in block_devices]:
+		del tptDict[stale_device]
+	stats = read_block_stats(block_devices)
+	now = sample_clock()
+	for block_device in block_devices:
+		current = stats.get(block_device)
+		entry = tptDict.get(block_device)
+		if current is None:
+			if entry is None:
+				tptDict[block_device] = CounterEntry(None, now, ZERO_RATES)
+			else:
+				entry.rates = ZERO_RATES
+			continue
+		if entry is None:
+			tptDict[block_device] = CounterEntry(current, now, compute_rates(None, current, 0))
+			continue
+		entry.rates = compute_rates(entry.stat, current, now - entry.timestamp) if entry.stat is not None else compute_rates(None, current, 0)
+		entry.stat = current
+		entry.timestamp = now
+	return tptDict
+
+def get_read_write_rate_throughput_iter(sysfs_block_path):
+	"""Per-device throughput generator over one sysfs stat file.
+
+	Kept for single-device callers; get_drives_info samples all devices at once
+	through update_throughput_table.
+	"""
+	if IS_DARWIN or not sysfs_block_path or not os.path.isdir(sysfs_block_path):
+		# Per-device throughput is Linux /sys stat based; return zeros on macOS.
+		while True:
+			yield 0, 0
+	previous = None
+	start_time = time.monotonic()
+	while True:
+		try:
+			current = read_sysfs_stat(sysfs_block_path)
+			end_time = time.monotonic()
+			if current is None:
+				yield 0, 0
+				continue
+			rates = compute_rates(previous, current, end_time - start_time)
+			previous = current
+			start_time = end_time
+			yield rates.READ, rates.WRITE
+		except Exception as e:
+			debug_exc('throughput poll', e)
+			yield 0, 0
+
+WindowStats = namedtuple("WindowStats", ["MIN", "MAX", "AVG", "P95", "P99"])
+
+def window_stats(values):
+	"""Summarise a window of rate samples (nearest-rank percentiles).
+
+	>>> window_stats([float(x) for x in range(1, 101)])
+	WindowStats(MIN=1, MAX=100, AVG=50, P95=95, P99=99)
+	>>> window_stats([]) is None
+	True
+	"""
+	if not values:
+		return None
+	ordered = sorted(values)
+	count = len(ordered)
+	def _rank(pct):
+		return int(ordered[min(count - 1, max(0, int(-(-pct * count // 100)) - 1))])
+	return WindowStats(int(ordered[0]), int(ordered[-1]), int(sum(ordered) / count), _rank(95), _rank(99))
+
+# rings hold this many display windows, so a refresh running late does not lose samples
+RATE_RING_HEADROOM = 4
+
+class RateRing:
+	"""Fixed-size ring of read/write rate samples for one device (preallocated, no per-sample allocation).
+
+	Samples pushed while the ring is full overwrite the oldest ones and are counted in dropped.
+
+	>>> ring = RateRing(3, 0, 0)
+	>>> for rate in (1.0, 2.0, 3.0, 4.0):
+	...     ring.push(rate, 0.0)
+	>>> ring.drain()[0], ring.dropped
+	([2.0, 3.0, 4.0], 1)
+	"""
+	__slots__ = ('read', 'write', 'index', 'pending', 'dropped', 'last_read', 'last_written')
+
+	def __init__(self, capacity, sectors_read, sectors_written):
+		self.read = array.array('d', bytes(8 * capacity))
+		self.write = array.array('d', bytes(8 * capacity))
+		self.index = 0
+		self.pending = 0
+		self.dropped = 0
+		self.last_read = sectors_read
+		self.last_written = sectors_written
+
+	def push(self, read_rate, write_rate):
+		self.read[self.index] = read_rate
+		self.write[self.index] = write_rate
+		self.index = (self.index + 1) % len(self.read)
+		if self.pending < len(self.read):
+			self.pending += 1
+		else:
+			self.dropped += 1
+
+	def drain(self):
+		"""Return (read samples, write samples) pushed since the last drain."""
+		capacity = len(self.read)
+		start = (self.index - self.pending) % capacity
+		positions = [(start + i) % capacity for i in range(self.pending)]
+		self.pending = 0
+		return [self.read[i] for i in positions], [self.write[i] for i in positions]
+
+class HighFrequencySampler:
+	"""Sample /proc/diskstats every interval seconds on a background thread.
+
+	Each device gets a RateRing holding RATE_RING_HEADROOM display windows;
+	snapshot() summarises and clears the samples gathered since the previous
+	snapshot and adds any overwritten ones to dropped. A /proc/diskstats line
+	identical to the same line of the previous sample is an idle device and
+	pushes zero rates without being split or parsed.
+	"""
+	def __init__(self, interval=0.1, window=1.0):
+		self.interval = max(0.01, interval)
+		self.capacity = max(2, int(math.ceil(window / self.interval)) * RATE_RING_HEADROOM + 1)
+		self.reader = DiskStatsReader()
+		self.rings = {}
+		# previous sample's lines and the (name, ring) parsed from each
+		self.lines = []
+		self.line_rings = []
+		self.dropped = 0
+		self.lock = threading.Lock()
+		self.stop_event = threading.Event()
+		self.thread = None
+		self.last_time = None
+
+	def sample(self):
+		"""Take one sample of every device and push its rates into the rings."""
+		data = self.reader.read_raw()
+		now = time.monotonic()
+		elapsed = now - self.last_time if self.last_time is not None else 0.0
+		self.last_time = now
+		lines = data.split(b'\n')
+		same_layout = len(lines) == len(self.lines)
+		previous_lines = self.lines
+		line_rings = self.line_rings if same_layout else [None] * len(lines)
+		renamed = not same_layout
+		with self.lock:
+			for position, line in enumerate(lines):
+				entry = line_rings[position]
+				if same_layout and entry is not None and line == previous_lines[position]:
+					if elapsed > 0:
+						entry[1].push(0.0, 0.0)
+					continue
+				parts = line.split(None, 10)
+				if len(parts) < 10:
+					continue
+				try:
+					sectors_read = int(parts[5])
+					sectors_written = int(parts[9])
+				except ValueError:
+					continue
+				name = parts[2]
+				if entry is None or entry[0] != name:
+					renamed = True
+				ring = self.rings.get(name)
+				if ring is None:
+					ring = self.rings[name] = RateRing(self.capacity, sectors_read, sectors_written)
+					line_rings[position] = (name, ring)
+					continue
+				line_rings[position] = (name, ring)
+				if elapsed > 0:
+					ring.push(max(0, sectors_read - ring.last_read) * STAT_SECTOR_SIZE / elapsed,
+						max(0, sectors_written - ring.last_written) * STAT_SECTOR_SIZE / elapsed)
+				ring.last_read = sectors_read
+				ring.last_written = sectors_written
+			if renamed:
+				seen = set(entry[0] for entry in line_rings if entry is not None)
+				for name in [name for name in self.rings if name not in seen]:
+					del self.rings[name]
+		self.lines = lines
+		self.line_rings = line_rings
+
+	def _run(self):
+		deadline = time.monotonic()
+		while not self.stop_event.is_set():
+			try:
+				self.sample()
+			except Exception as e:
+				debug_exc('high frequency sample', e)
+			deadline += self.interval
+			now = time.monotonic()
+			if deadline < now:
+				# fell behind; skip the missed samples instead of bursting
+				deadline = now + self.interval - ((now - deadline) % self.interval)
+			self.stop_event.wait(deadline - now)
+
+	def start(self):
+		if self.thread is None:
+			self.thread = threading.Thread(target=self._run, name='statblk-sampler', daemon=True)
+			self.thread.start()
+		return self
+
+	def stop(self):
+		self.stop_event.set()
+		if self.thread is not None:
+			self.thread.join(1)
+		self.reader.close()
+
+	def snapshot(self):
+		"""Return {device: (read WindowStats, write WindowStats)} for samples since the last snapshot."""
+		result = {}
+		with self.lock:
+			drained = {name: ring.drain() for name, ring in self.rings.items()}
+			for ring in self.rings.values():
+				self.dropped += ring.dropped
+				ring.dropped = 0
+		for name, (read_values, write_values) in drained.items():
+			if read_values:
+				result['/dev/' + name.decode('utf-8', 'ignore')] = (window_stats(read_values), window_stats(write_values))
+		return result
+
+_HF_SAMPLER = None
+
+def start_high_frequency_sampler(interval, window):
+	"""Start the module-wide sampler used by collect(); returns None on macOS or on failure."""
+	global _HF_SAMPLER
+	if IS_DARWIN or _REPLAY is not None:
+		return None
+	if _HF_SAMPLER is None:
+		try:
+			_HF_SAMPLER = HighFrequencySampler(interval=interval, window=window).start()
+		except Exception as e:
+			debug_exc('high frequency sampler', e)
+	return _HF_SAMPLER
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+CGROUP_SAMPLE_SECONDS = 1.0 # gap between the two io.stat samples of a one-shot --cgroups run
+CGROUP_OUTPUT_FIELDS = ["CGROUP", "NAME", "READ", "WRITE", "R_IOPS", "W_IOPS"]
+
+def parse_cgroup_io_stat(data):
+	"""Parse cgroup v2 io.stat content into {'major:minor': DiskStat}.
+
+	Byte counters become 512-byte sectors so compute_rates() applies unchanged;
+	the time based fields stay zero.
+
+	>>> stats = parse_cgroup_io_stat(b'259:0 rbytes=4096 wbytes=1024 rios=2 wios=1 dbytes=0 dios=0\\n8:0 rbytes=0 wbytes=0 rios=0 wios=0 dbytes=0 dios=0\\n')
+	>>> stats['259:0'].sectors_read, stats['259:0'].writes, sorted(stats)
+	(8, 1, ['259:0', '8:0'])
+	"""
+	stats = {}
+	for line in data.split(b'\n'):
+		parts = line.split()
+		if not parts:
+			continue
+		counters = {}
+		for part in parts[1:]:
+			key, _, value = part.partition(b'=')
+			try:
+				counters[key] = int(value)
+			except ValueError:
+				continue
+		stats[parts[0].decode('ascii', 'ignore')] = DiskStat(
+			counters.get(b'rios', 0), 0, counters.get(b'rbytes', 0) // STAT_SECTOR_SIZE, 0,
+			counters.get(b'wios', 0), 0, counters.get(b'wbytes', 0) // STAT_SECTOR_SIZE, 0, 0, 0, 0)
+	return stats
+
+class CgroupIOScanner:
+	"""Per-cgroup read / write rates for each device from the cgroup v2 io.stat files.
+
+	cgroup v2 io.stat counters include all descendants, so scan() walks the
+	hierarchy top down and skips the subtree of every cgroup whose io.stat did
+	not change since the previous scan: with thousands of idle cgroups only the
+	active branches are listed and re-read. Files are read into one reused
+	buffer and compared as raw bytes before any parsing. Rates come from
+	compute_rates() over the time since the previous scan.
+	"""
+	def __init__(self, root=CGROUP_ROOT, bufsize=4096):
+		self.root = host_path(root)
+		self.buf = bytearray(bufsize)
+		self.raw = {}
+		self.stats = {}
+		self.children = {}
+		self.last_scan = None
+		self.files_read = 0
+
+	def available(self):
+		"""True when root is a cgroup v2 (unified) mount."""
+		return os.path.exists(os.path.join(self.root, 'cgroup.controllers'))
+
+	def read_io_stat(self, cgroup):
+		"""Raw io.stat bytes of cgroup (None when it has none or is gone)."""
+		try:
+			fd = os.open(self.root + cgroup + '/io.stat', os.O_RDONLY)
+		except OSError:
+			return None
+		try:
+			size = 0
+			while True:
+				if size == len(self.buf):
+					self.buf.extend(bytes(len(self.buf)))
+				view = memoryview(self.buf)
+				try:
+					got = os.readv(fd, [view[size:]])
+				finally:
+					view.release()
+				if got == 0:
+					break
+				size += got
+		except OSError:
+			return None
+		finally:
+			os.close(fd)
+		self.files_read += 1
+		return bytes(self.buf[:size])
+
+	def list_children(self, cgroup):
+		try:
+			with os.scandir(self.root + cgroup) as entries:
+				return sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+		except OSError:
+			return []
+
+	def forget(self, cgroup):
+		"""Drop cached state of a removed cgroup and its subtree."""
+		self.raw.pop(cgroup, None)
+		self.stats.pop(cgroup, None)
+		for child in self.children.pop(cgroup, ()):
+			self.forget(f'{cgroup}/{child}')
+
+	def scan(self, devices=None, time_now=None):
+		"""Return [(cgroup, device, DiskRates)] for every cgroup and device with I/O since the last scan.
+
+		cgroup is the path below the cgroup mount ('/' for the root) and device
+		the /dev path from devices (default: get_blocks()), or 'major:minor' for
+		numbers that match no listed device. The first scan only records counters.
+		"""
+		now = sample_clock() if time_now is None else time_now
+		elapsed = None if self.last_scan is None else now - self.last_scan
+		self.last_scan = now
+		self.files_read = 0
+		if devices is None:
+			devices = get_blocks()
+		names = {}
+		for device in devices:
+			devnum = read_text(os.path.join(block_sysfs_dir(device), 'dev'))
+			if devnum:
+				names[devnum] = device
+		results = []
+		stack = ['']
+		while stack:
+			cgroup = stack.pop()
+			raw = self.read_io_stat(cgroup)
+			if raw is None and cgroup:
+				self.forget(cgroup)
+				continue
+			if raw is not None and cgroup in self.children and raw == self.raw.get(cgroup):
+				# nothing below changed either
+				continue
+			if raw is not None:
+				current = parse_cgroup_io_stat(raw)
+				previous = self.stats.get(cgroup)
+				if previous is not None and elapsed:
+					for devnum, stat in current.items():
+						if devnum in previous and stat != previous[devnum]:
+							results.append((cgroup or '/', names.get(devnum, devnum), compute_rates(previous[devnum], stat, elapsed)))
+				self.raw[cgroup] = raw
+				self.stats[cgroup] = current
+			children = self.list_children(cgroup)
+			for gone in set(self.children.get(cgroup, ())).difference(children):
+				self.forget(f'{cgroup}/{gone}')
+			self.children[cgroup] = children
+			stack.extend(f'{cgroup}/{child}' for child in reversed(children))
+		results.sort(key=lambda result: (result[0], result[1]))
+		return results
+
+def cgroup_io_rows(results, print_bytes=False, use_1024=False, full=False, filter_patterns=None, invert_match=False):
+	"""Format scan() results as table rows (header first), busiest first, filtered like the device rows."""
+	pattern = compile_filter_pattern(filter_patterns) if filter_patterns else None
+	rows = [list(CGROUP_OUTPUT_FIELDS)]
+	for cgroup, device, rates in sorted(results, key=lambda result: -(result[2].READ + result[2].WRITE)):
+		record = DeviceRecord(NAME=device, **rates._asdict())
+		row = [cgroup] + [format_field(record, field, print_bytes=print_bytes, use_1024=use_1024, full=full) for field in CGROUP_OUTPUT_FIELDS[1:]]
+		if pattern is not None and any(pattern.search(field) for field in row) == invert_match:
+			continue
+		rows.append(row)
+	return rows
+
+def parse_period(value):
+	"""Parse a refresh period in seconds; None if value is not a plain non-negative number.
+
+	>>> parse_period('2'), parse_period('0.25'), parse_period('sda'), parse_period('inf')
+	(2.0, 0.25, None, None)
+	"""
+	if not re.match(r'^\d+(\.\d*)?$|^\.\d+$', str(value).strip()):
+		return None
+	return float(value)
+
+PROFILE_HISTORY = 120
+PROFILE_OUTLIERS = 3
+
+class _NullPhase:
+	"""Shared no-op context manager returned by profile_phase() while profiling is off."""
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		return False
+
+_NULL_PHASE = _NullPhase()
+
+class _ProfilePhase:
+	__slots__ = ('profiler', 'name', 'item', 'start')
+
+	def __init__(self, profiler, name, item):
+		self.profiler = profiler
+		self.name = name
+		self.item = item
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.profiler.add(self.name, time.perf_counter() - self.start, self.item)
+		return False
+
+class PhaseProfiler:
+	"""Wall time, call counts and slowest items per phase for one run, with percentiles across runs.
+
+	>>> profiler = PhaseProfiler()
+	>>> with profiler.phase('statvfs'):
+	...     profiler.add_item('statvfs', '/mnt/nfs', 0.25)
+	>>> profiler.add('smart_wait', 0.5, '/dev/sda')
+	>>> report = profiler.end()
+	>>> report['phases']['smart_wait']['calls'], report['phases']['smart_wait']['slowest']
+	(1, [['/dev/sda', 500.0]])
+	>>> report['phases']['statvfs']['slowest']
+	[['/mnt/nfs', 250.0]]
+	"""
+	def __init__(self, outliers=PROFILE_OUTLIERS, history=PROFILE_HISTORY):
+		self.outliers = outliers
+		self.history_size = history
+		self.history = {}
+		self.runs = 0
+		self.begin()
+
+	def begin(self):
+		self.start = time.perf_counter()
+		self.totals = {}
+		self.calls = {}
+		self.items = {}
+
+	def phase(self, name, item=None):
+		return _ProfilePhase(self, name, item)
+
+	def add(self, name, seconds, item=None):
+		self.totals[name] = self.totals.get(name, 0.0) + seconds
+		self.calls[name] = self.calls.get(name, 0) + 1
+		if item is not None:
+			self.add_item(name, item, seconds)
+
+	def add_item(self, name, item, seconds):
+		"""Attribute time to one device or mount without counting it as a phase call."""
+		items = self.items.setdefault(name, {})
+		items[item] = items.get(item, 0.0) + seconds
+
+	def end(self):
+		"""Close the current run and return its report; the next run starts immediately."""
+		total = time.perf_counter() - self.start
+		self.runs += 1
+		for name in set(self.totals) | set(self.history):
+			if name not in self.history:
+				self.history[name] = deque(maxlen=self.history_size)
+			# percentiles are kept in microseconds since window_stats rounds to integers
+			self.history[name].append(self.totals.get(name, 0.0) * 1e6)
+		phases = {}
+		for name in sorted(self.history, key=lambda n: -self.totals.get(n, 0.0)):
+			seconds = self.totals.get(name, 0.0)
+			items = self.items.get(name, {})
+			slowest = sorted(items.items(), key=lambda kv: -kv[1])[:self.outliers]
+			stats = window_stats(list(self.history[name]))
+			phases[name] = {
+				'calls': self.calls.get(name, 0),
+				'wall_ms': round(seconds * 1000, 3),
+				'share': round(100.0 * seconds / total, 1) if total > 0 else 0.0,
+				'slowest': [[item, round(item_seconds * 1000, 3)] for item, item_seconds in slowest],
+				'avg_ms': stats.AVG / 1000,
+				'p95_ms': stats.P95 / 1000,
+				'p99_ms': stats.P99 / 1000,
+				'max_ms': stats.MAX / 1000,
+			}
+		report = {
+			'run': self.runs,
+			'total_ms': round(total * 1000, 3),
+			'other_ms': round(max(0.0, total - sum(self.totals.values())) * 1000, 3),
+			'phases': phases,
+		}
+		self.begin()
+		return report
+
+def format_profile_report(report):
+	"""Render a PhaseProfiler.end() report as a table; percentile columns appear after the first run.
+
+	>>> print(format_profile_report({'run': 1, 'total_ms': 2.0, 'other_ms': 0.5, 'phases': {'statvfs':  # doctest: +NORMALIZE_WHITESPACE
+	...     {'calls': 1, 'wall_ms': 1.5, 'share': 75.0, 'slowest': [['/mnt/a', 1.5]], 'avg_ms': 1.5, 'p95_ms': 1.5, 'p99_ms': 1.5, 'max_ms': 1.5}}}))
+	profile run 1: 2.0 ms (0.5 ms outside phases)
+	PHASE   | CALLS | WALL_MS | SHARE | SLOWEST
+	--------+-------+---------+-------+--------------
+	statvfs | 1     | 1.500   | 75.0% | /mnt/a 1.5 ms
+	"""
+	watch = report['run'] > 1
+	header = ['PHASE', 'CALLS', 'WALL_MS', 'SHARE']
+	if watch:
+		header += ['AVG_MS', 'P95_MS', 'P99_MS', 'MAX_MS']
+	rows = [header + ['SLOWEST']]
+	for name, phase in report['phases'].items():
+		row = [name, str(phase['calls']), f"{phase['wall_ms']:.3f}", f"{phase['share']:.1f}%"]
+		if watch:
+			row += [f"{phase[key]:.3f}" for key in ('avg_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+		rows.append(row + [', '.join(f'{item} {ms:g} ms' for item, ms in phase['slowest'])])
+	title = f"profile run {report['run']}: {report['total_ms']:.1f} ms ({report['other_ms']:.1f} ms outside phases)"
+	return title + '\n' + multiCMD.pretty_format_table(rows).rstrip('\n')
+
+_PROFILER = None
+
+def profile_phase(name, item=None):
+	"""Time a block as one call of phase name (optionally attributed to a device or mount)."""
+	if _PROFILER is None:
+		return _NULL_PHASE
+	return _PROFILER.phase(name, item)
+
+def profile_item(name, item, seconds):
+	if _PROFILER is not None:
+		_PROFILER.add_item(name, item, seconds)
+
+ColumnProvider = namedtuple("ColumnProvider", ["field", "sources", "scope", "cost", "group", "text", "read"])
+# Output columns by name in display order, filled by register_column
+COLUMN_PROVIDERS = {}
+# Column names per group ('default' columns are shown without -o)
+OUTPUT_FIELD_GROUPS = defaultdict(list)
+ALL_OUTPUT_FIELDS = []
+# Raw record attributes; USED has no column of its own but backs FSUSE%
+RECORD_FIELDS = ["USED"]
+STRING_RECORD_FIELDS = set()
+# Probe sources collect() runs before the costly ones, so FilterPlan can use their columns
+PUSHDOWN_SOURCES = frozenset(('mounts', 'lsblk', 'by-uuid', 'by-label', 'sysfs', 'graph'))
+# Column readers up to this cost run inline; costlier ones (subprocesses) are batched across devices
+PUSHDOWN_COST = 1
+COSTLY_READER_THREADS = 8
+ProbeContext = namedtuple("ProbeContext", ["graph", "macos_info"])
+
+def field_attr(field):
+	"""Map an output column name to its DeviceRecord attribute.
+
+	>>> field_attr('FSUSE%'), field_attr('NAME')
+	('FSUSE_PCT', 'NAME')
+	"""
+	return field.replace('%', '_PCT').replace('-', '_')
+
+def register_column(field, sources=(), scope='partition', cost=0, group='extra', text=False, read=None):
+	"""Register an output column with the probes it needs; returns its ColumnProvider.
+
+	sources are the probe batches collect() must run for the column: 'mounts'
+	(mount table), 'lsblk' (udev database, lsblk or diskutil), 'by-uuid' /
+	'by-label' (/dev/disk links), 'sysfs', 'graph' (DeviceGraph), 'smartctl'
+	(-H), 'smartctl-json', 'hwmon', 'statvfs', 'diskstats' and 'sampler'
+	(--sample_interval). scope is 'device'
+	for a value of the whole block device or the disks under it and
+	'partition' for a value of each row. cost is relative: 0 in memory, 1 a
+	cached or single file read, 5 a statvfs per mount, 10 a subprocess per
+	disk. A device column may give read(device, probe) returning the raw value;
+	collect() calls it once per block device with its ProbeContext. Readers
+	of cost at most PUSHDOWN_COST run inline and can feed the filter
+	pushdown; costlier ones run after it, for the devices still shown, on up
+	to COSTLY_READER_THREADS devices at once. text
+	columns default to '' instead of None. Columns registered after import
+	live in the record's extra mapping instead of a slot.
+
+	>>> provider = COLUMN_PROVIDERS['ROTA']
+	>>> sorted(provider.sources), provider.scope, provider.cost, provider.group
+	(['sysfs'], 'device', 1, 'queue')
+	"""
+	provider = ColumnProvider(field, frozenset(sources), scope, cost, group, text, read)
+	if field not in COLUMN_PROVIDERS:
+		ALL_OUTPUT_FIELDS.append(field)
+		OUTPUT_FIELD_GROUPS[group].append(field)
+		RECORD_FIELDS.append(field_attr(field))
+	COLUMN_PROVIDERS[field] = provider
+	if text:
+		STRING_RECORD_FIELDS.add(field_attr(field))
+	return provider
+
+def probe_sources(output_fields):
+	"""The probe sources needed for output_fields.
+
+	>>> sorted(probe_sources(['NAME', 'MOUNTPOINT', 'ROTA']))
+	['mounts', 'sysfs']
+	"""
+	sources = set()
+	for field in output_fields:
+		sources.update(COLUMN_PROVIDERS[field].sources)
+	return sources
+
+def read_columns_concurrently(records, readers, probe, threads=COSTLY_READER_THREADS):
+	"""Set the readers' (attr, read) columns on every record of {device: record}, up to threads devices at once.
+
+	The first exception a reader raises is re-raised once every device is done.
+
+	>>> records = {name: DeviceRecord(NAME=name) for name in ('/dev/sda', '/dev/sdb')}
+	>>> read_columns_concurrently(records, [('MODEL', lambda device, probe: device[-1])], None)
+	>>> [record.MODEL for record in records.values()]
+	['a', 'b']
+	"""
+	pending = queue.Queue()
+	for item in records.items():
+		pending.put(item)
+	errors = []
+
+	def _worker():
+		while True:
+			try:
+				device, record = pending.get_nowait()
+			except queue.Empty:
+				return
+			try:
+				for attr, read in readers:
+					record.set_field(attr, read(device, probe))
+			except Exception as e:
+				errors.append(e)
+
+	workers = [threading.Thread(target=_worker, name='statblk-readers', daemon=True) for _ in range(min(threads, len(records)))]
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	if errors:
+		raise errors[0]
+
+def read_model_column(device, probe):
+	if IS_DARWIN:
+		return probe.macos_info.get(get_partition_parent_name(device) or device, {}).get('MODEL', '')
+	return join_distinct(read_model_and_serial(os.path.realpath(block_sysfs_dir(disk)))[0] for disk in probe.graph.physical_disks(device))
+
+def read_serial_column(device, probe):
+	if IS_DARWIN:
+		return probe.macos_info.get(get_partition_parent_name(device) or device, {}).get('SERIAL', '')
+	return join_distinct(read_model_and_serial(os.path.realpath(block_sysfs_dir(disk)))[1] for disk in probe.graph.physical_disks(device))
+
+def read_discard_column(device, probe):
+	parent_name = get_partition_parent_name(device)
+	if IS_DARWIN:
+		return probe.macos_info.get(parent_name or device, {}).get('DISCARD', 'N/A')
+	return read_discard_support(os.path.realpath(block_sysfs_dir(parent_name)) if parent_name else None)
+
+def read_queue_attribute(device, name):
+	"""Text of queue/<name> for the request queue of device (its disk's for a partition), None if absent."""
+	parent_name = get_partition_parent_name(device)
+	return read_text(os.path.join(block_sysfs_dir(parent_name or device), 'queue', name))
+
+def read_queue_int(device, name):
+	value = read_queue_attribute(device, name)
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		return None
+
+def read_scheduler_column(device, probe):
+	"""Active I/O scheduler: the bracketed entry of queue/scheduler."""
+	value = read_queue_attribute(device, 'scheduler')
+	if value is None:
+		return ''
+	match = re.search(r'\[([^\]]+)\]', value)
+	return match.group(1) if match else value
+
+register_column("NAME", group='default', text=True)
+register_column("FSTYPE", ('mounts', 'lsblk'), cost=1, group='default', text=True)
+register_column("SIZE", ('statvfs', 'lsblk', 'sysfs'), cost=5, group='default')
+register_column("FSUSE%", ('statvfs',), cost=5, group='default')
+register_column("MOUNTPOINT", ('mounts',), group='default', text=True)
+register_column("SMART", ('smartctl', 'graph'), scope='device', cost=10, group='default', text=True)
+register_column("LABEL", ('lsblk', 'by-label'), cost=1, group='default', text=True)
+register_column("UUID", ('lsblk', 'by-uuid'), cost=1, group='default', text=True)
+register_column("MODEL", ('sysfs', 'graph'), scope='device', cost=1, group='default', text=True, read=read_model_column)
+register_column("SERIAL", ('sysfs', 'graph'), scope='device', cost=1, group='default', text=True, read=read_serial_column)
+register_column("DISCARD", ('sysfs',), scope='device', cost=1, group='default', text=True, read=read_discard_column)
+register_column("READ", ('diskstats',), cost=1, group='default')
+register_column("WRITE", ('diskstats',), cost=1, group='default')
+# iostat -x style columns from the same counter samples
+for _field in ("R_IOPS", "W_IOPS", "R_AWAIT", "W_AWAIT", "UTIL%", "AQU-SZ"):
+	register_column(_field, ('diskstats',), cost=1, group='iostat')
+# Filled by the --sample_interval sampler: throughput over the samples of one display period
+for _field in (f"{direction}_{stat}" for direction in ("READ", "WRITE") for stat in WindowStats._fields):
+	register_column(_field, ('sampler',), cost=1, group='window')
+# From the DeviceGraph: physical disks below, topmost devices above, device-mapper name
+# and the summed throughput of the physical disks below
+register_column("DISKS", ('graph',), scope='device', group='graph', text=True,
+	read=lambda device, probe: ','.join(os.path.basename(disk) for disk in probe.graph.physical_disks(device)))
+register_column("HOLDERS", ('graph',), scope='device', group='graph', text=True,
+	read=lambda device, probe: ','.join(probe.graph.display_name(holder) for holder in probe.graph.top_holders(device)))
+register_column("MAPPER", ('graph',), scope='device', group='graph', text=True,
+	read=lambda device, probe: probe.graph.mapper_names.get(device, ''))
+register_column("DISK_READ", ('graph', 'diskstats'), scope='device', cost=1, group='graph')
+register_column("DISK_WRITE", ('graph', 'diskstats'), scope='device', cost=1, group='graph')
+# Request queue settings for tuning; partitions show their disk's queue
+register_column("ROTA", ('sysfs',), scope='device', cost=1, group='queue', read=lambda device, probe: read_queue_int(device, 'rotational'))
+register_column("SCHED", ('sysfs',), scope='device', cost=1, group='queue', text=True, read=read_scheduler_column)
+register_column("NR_REQUESTS", ('sysfs',), scope='device', cost=1, group='queue', read=lambda device, probe: read_queue_int(device, 'nr_requests'))
+register_column("READ_AHEAD_KB", ('sysfs',), scope='device', cost=1, group='queue', read=lambda device, probe: read_queue_int(device, 'read_ahead_kb'))
+register_column("LOG_SEC", ('sysfs',), scope='device', cost=1, group='queue', read=lambda device, probe: read_queue_int(device, 'logical_block_size'))
+register_column("PHY_SEC", ('sysfs',), scope='device', cost=1, group='queue', read=lambda device, probe: read_queue_int(device, 'physical_block_size'))
+# SMART details from `smartctl --json` run once per physical disk through the SmartCache;
+# TEMP reads the hwmon sensor instead where the drive has one. Stacked devices show the
+# hottest and most worn disk below them and the sum of their media errors.
+register_column("TEMP", ('hwmon', 'smartctl-json', 'graph'), scope='device', cost=1, group='smart')
+register_column("WEAR%", ('smartctl-json', 'graph'), scope='device', cost=10, group='smart')
+register_column("MEDIA_ERR", ('smartctl-json', 'graph'), scope='device', cost=10, group='smart')
+register_column("POWER_ON_HRS", ('smartctl-json', 'graph'), scope='device', cost=10, group='smart')
+DEFAULT_OUTPUT_FIELDS = OUTPUT_FIELD_GROUPS['default']
+IOSTAT_OUTPUT_FIELDS = OUTPUT_FIELD_GROUPS['iostat']
+WINDOW_OUTPUT_FIELDS = OUTPUT_FIELD_GROUPS['window']
+GRAPH_OUTPUT_FIELDS = OUTPUT_FIELD_GROUPS['graph']
+QUEUE_OUTPUT_FIELDS = OUTPUT_FIELD_GROUPS['queue']
+SMART_OUTPUT_FIELDS = OUTPUT_FIELD_GROUPS['smart']
+# --rollup disk: one row per physical disk; --rollup lv: one row per topmost dm / md device
+ROLLUP_OUTPUT_FIELDS = {
+	'disk': ["NAME", "SIZE", "MODEL", "SERIAL", "SMART", "READ", "WRITE", "R_IOPS", "W_IOPS", "UTIL%", "HOLDERS"],
+	'lv': ["NAME", "MAPPER", "FSTYPE", "SIZE", "MOUNTPOINT", "READ", "WRITE", "R_IOPS", "W_IOPS", "DISKS", "DISK_READ", "DISK_WRITE"],
+}
+
+# Record attributes that are slots; anything registered later goes to DeviceRecord.extra
+SLOT_RECORD_FIELDS = tuple(RECORD_FIELDS)
+
+class DeviceRecord:
+	"""One output row with raw values.
+
+	NAME is the full device path, SIZE / USED are bytes, READ / WRITE are bytes
+	per second (None when the entry has no block counters) and FSUSE_PCT is a
+	float percentage (None when not mounted or the size is unknown). The
+	columns in place at import are slots; columns registered later and
+	values with no column (HOST of a fleet row, FROM / TO of a history row)
+	live in the extra mapping and read like attributes.
+
+	>>> r = DeviceRecord(NAME='/dev/sda1', SIZE=2048, USED=512, FSUSE_PCT=25.0, MOUNTPOINT='/boot', extra={'HOST': 'n1'})
+	>>> r.SIZE, r.FSTYPE, r.HOST
+	(2048, '', 'n1')
+	>>> r._replace(MOUNTPOINT='/efi').MOUNTPOINT, r.MOUNTPOINT
+	('/efi', '/boot')
+	>>> r.MOUNTPIONT = '/'
+	Traceback (most recent call last):
+	...
+	AttributeError: 'DeviceRecord' object has no attribute 'MOUNTPIONT'
+	"""
+	__slots__ = SLOT_RECORD_FIELDS + ('extra',)
+
+	def __init__(self, extra=None, **kwargs):
+		for field in SLOT_RECORD_FIELDS:
+			setattr(self, field, kwargs.get(field, '' if field in STRING_RECORD_FIELDS else None))
+		self.extra = dict(extra) if extra else {}
+		for field in RECORD_FIELDS[len(SLOT_RECORD_FIELDS):]:
+			self.extra[field] = kwargs.get(field, '' if field in STRING_RECORD_FIELDS else None)
+
+	def __getattr__(self, name):
+		# only reached for names that are not slots
+		try:
+			return object.__getattribute__(self, 'extra')[name]
+		except (AttributeError, KeyError):
+			raise AttributeError(f"'DeviceRecord' object has no attribute {name!r}") from None
+
+	def set_field(self, attr, value):
+		"""Set attr, a column registered after import included."""
+		if attr in self.extra:
+			self.extra[attr] = value
+		else:
+			setattr(self, attr, value)
+
+	def _replace(self, **kwargs):
+		values = self._asdict()
+		values.update(kwargs)
+		return DeviceRecord(extra=self.extra, **values)
+
+	def _asdict(self):
+		return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+	def __repr__(self):
+		return 'DeviceRecord(' + ', '.join(f'{field}={getattr(self, field)!r}' for field in RECORD_FIELDS) + ')'
+
+def resolve_output_fields(output="default", exclude="", rollup=None):
+	"""Turn the -o / -x column specs into the ordered list of output fields.
+
+	"default" selects DEFAULT_OUTPUT_FIELDS (ROLLUP_OUTPUT_FIELDS[rollup] with
+	a rollup) and "all" every column.
+
+	>>> resolve_output_fields('name,size', '')
+	['NAME', 'SIZE']
+	>>> resolve_output_fields('default', 'UUID,LABEL,MODEL,SERIAL,DISCARD,READ,WRITE,SMART')
+	['NAME', 'FSTYPE', 'SIZE', 'FSUSE%', 'MOUNTPOINT']
+	>>> resolve_output_fields('all') == ALL_OUTPUT_FIELDS
+	True
+	>>> resolve_output_fields('default', 'MODEL,SERIAL,SMART', rollup='disk')
+	['NAME', 'SIZE', 'READ', 'WRITE', 'R_IOPS', 'W_IOPS', 'UTIL%', 'HOLDERS']
+	"""
+	if output == "default" and rollup:
+		output_fields = list(ROLLUP_OUTPUT_FIELDS[rollup])
+	elif output == "default":
+		output_fields = list(DEFAULT_OUTPUT_FIELDS)
+	elif output == "all":
+		output_fields = list(ALL_OUTPUT_FIELDS)
+	else:
+		output_fields = [x.strip().upper() for x in output.split(',')]
+		for field in output_fields:
+			if field not in ALL_OUTPUT_FIELDS:
+				print(f"Ignoring invalid output field: {field}.", file=sys.stderr)
+		output_fields = [f for f in output_fields if f in ALL_OUTPUT_FIELDS]
+	if exclude:
+		exclude_fields = [x.strip().upper() for x in exclude.split(',')]
+		for field in exclude_fields:
+			if field in output_fields:
+				output_fields.remove(field)
+	return output_fields
+
+def format_field(record, field, print_bytes=False, use_1024=False, full=False):
+	"""Format one column of a DeviceRecord for display.
+
+	>>> r = DeviceRecord(NAME='/dev/sda1', SIZE=1024, FSUSE_PCT=24.6, MOUNTPOINT='/', READ=0)
+	>>> [format_field(r, f, print_bytes=True) for f in ('NAME', 'SIZE', 'FSUSE%', 'READ', 'WRITE')]
+	['sda1', '1024', '25%', '0', '']
+	>>> format_field(r._replace(FSUSE_PCT=None), 'FSUSE%')
+	'N/A'
+	"""
+	value = getattr(record, field_attr(field), '')
+	if field == 'NAME':
+		return value if full else value.replace('/dev/', '')
+	if field == 'SIZE':
+		if value is None:
+			return ''
+		return str(value) if print_bytes else multiCMD.format_bytes(value, use_1024_bytes=use_1024, to_str=True) + 'B'
+	if field in ('READ', 'WRITE', 'DISK_READ', 'DISK_WRITE') or field in WINDOW_OUTPUT_FIELDS:
+		if value is None:
+			return ''
+		return str(value) if print_bytes else multiCMD.format_bytes(value, use_1024_bytes=use_1024, to_str=True,str_format='.0f') + 'B/s'
+	if field in ('R_IOPS', 'W_IOPS'):
+		return '' if value is None else f"{value:.0f}"
+	if field in ('R_AWAIT', 'W_AWAIT', 'AQU-SZ'):
+		return '' if value is None else f"{value:.2f}"
+	if field == 'UTIL%':
+		return '' if value is None else f"{value:.1f}%"
+	if field == 'WEAR%':
+		return '' if value is None else f"{value}%"
+	if field == 'FSUSE%':
+		if value is None:
+			return 'N/A' if record.MOUNTPOINT else ''
+		if isinstance(value, str):
+			return value
+		return f"{int(round(value))}%"
+	if value is None:
+		return ''
+	return str(value)
+
+def format_record(record, output_fields, print_bytes=False, use_1024=False, full=False):
+	"""Format a DeviceRecord into the display row used for the table and JSON output."""
+	return [format_field(record, field, print_bytes=print_bytes, use_1024=use_1024, full=full) for field in output_fields]
+
+# DRIVE_INFO = namedtuple("DRIVE_INFO", 
+# 	["NAME", "FSTYPE", "SIZE", "FSUSEPCT", "MOUNTPOINT", "SMART","RTPT",'WTPT', "LABEL", "UUID", "MODEL", "SERIAL", "DISCARD"])
+# Columns FilterPlan can evaluate before SMART, statvfs and counters: names, mounts,
+# udev / symlink data and cached sysfs reads
+CHEAP_FILTER_FIELDS = frozenset(field for field, provider in COLUMN_PROVIDERS.items()
+	if provider.sources <= PUSHDOWN_SOURCES and provider.cost <= PUSHDOWN_COST)
+_NUMBER_CHARS = '0123456789.'
+_BYTES_CHARS = _NUMBER_CHARS + ' KMGTPEZYiB'
+# Every character the remaining columns can contain once formatted
+COSTLY_FIELD_CHARS = dict(
+	[('SIZE', _BYTES_CHARS), ('FSUSE%', _NUMBER_CHARS + '%N/A' + STATVFS_TIMEOUT),
+	('SMART', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' + _NUMBER_CHARS + ' !"#$%&\'()*+,-/:;<=>?@[\\]^_`{|}~'),
+	('R_IOPS', _NUMBER_CHARS), ('W_IOPS', _NUMBER_CHARS), ('R_AWAIT', _NUMBER_CHARS), ('W_AWAIT', _NUMBER_CHARS),
+	('AQU-SZ', _NUMBER_CHARS), ('UTIL%', _NUMBER_CHARS + '%'), ('TEMP', _NUMBER_CHARS + '-'), ('WEAR%', _NUMBER_CHARS + '%'),
+	('MEDIA_ERR', _NUMBER_CHARS), ('POWER_ON_HRS', _NUMBER_CHARS)]
+	+ [(field, _BYTES_CHARS + '/s') for field in ['READ', 'WRITE', 'DISK_READ', 'DISK_WRITE'] + WINDOW_OUTPUT_FIELDS])
+
+def pattern_literal(pattern):
+	"""The text a filter pattern matches literally, or None when it uses regex syntax.
+
+	>>> pattern_literal('nvme3'), pattern_literal('/mnt/data\\.1'), pattern_literal('sd[ab]')
+	('nvme3', '/mnt/data.1', None)
+	"""
+	if not re.fullmatch(r'(?:[^\\.^$*+?{}\[\]|()]|\\[^0-9A-Za-z])*', pattern):
+		return None
+	return re.sub(r'\\(.)', r'\1', pattern)
+
+class FilterPlan:
+	"""Decide full-row filter matching from the cheap columns of a row.
+
+	A row is kept when any pattern matches any formatted column (none with
+	invert_match). A cheap column match decides the row outright. Without one,
+	the row can only be dropped when every pattern is a plain literal with a
+	character the costly columns in output_fields never contain, as with
+	device, mount or label names against sizes, rates and SMART words.
+
+	>>> plan = FilterPlan(['nvme3'], DEFAULT_OUTPUT_FIELDS)
+	>>> plan.may_keep(DeviceRecord(NAME='/dev/nvme3n1')), plan.may_keep(DeviceRecord(NAME='/dev/sda1'), 'ext4', '/data')
+	(True, False)
+	>>> FilterPlan(['TiB'], DEFAULT_OUTPUT_FIELDS).may_keep(DeviceRecord(NAME='/dev/sda1'))
+	True
+	>>> FilterPlan(['sda'], DEFAULT_OUTPUT_FIELDS, invert_match=True).may_keep(DeviceRecord(NAME='/dev/sda1'))
+	False
+	>>> [field for field in ALL_OUTPUT_FIELDS if field not in CHEAP_FILTER_FIELDS and field not in COSTLY_FIELD_CHARS]
+	[]
+	"""
+	def __init__(self, filter_patterns, output_fields, invert_match=False, full=False):
+		self.pattern = compile_filter_pattern(filter_patterns)
+		self.invert_match = invert_match
+		self.full = full
+		self.cheap_fields = [field for field in output_fields if field in CHEAP_FILTER_FIELDS]
+		costly_chars = set()
+		# a column of unknown content could match anything
+		self.costly_may_match = any(field not in CHEAP_FILTER_FIELDS and field not in COSTLY_FIELD_CHARS for field in output_fields)
+		for field in output_fields:
+			costly_chars.update(COSTLY_FIELD_CHARS.get(field, ''))
+		for filter_pattern in filter_patterns:
+			literal = pattern_literal(filter_pattern)
+			if literal is None or set(literal) <= costly_chars:
+				self.costly_may_match = True
+
+	def may_keep(self, record, fstype='', mountpoint=''):
+		"""False when the row of record with fstype and mountpoint is certain to be filtered out whatever its costly columns hold."""
+		for field in self.cheap_fields:
+			if field == 'FSTYPE':
+				value = fstype
+			elif field == 'MOUNTPOINT':
+				value = mountpoint
+			else:
+				value = format_field(record, field, full=self.full)
+			if self.pattern.search(value):
+				return not self.invert_match
+		return self.invert_match or self.costly_may_match
+
+def collect(mounted_only=False, best_only=False, formated_only=False, show_zero_size_devices=False,
+			pseudo=False, tptDict=None, active_only=False, output_fields=None,
+			filter_patterns=None, invert_match=False, match_devname_only=False, timeout=None,
+			smart_cache=None, statvfs_prober=None, hf_sampler=None, full=False):
+	"""Yield one DeviceRecord per output row with raw (unformatted) values.
+
+	output_fields limits which probes run (default: all columns). With
+	match_devname_only the filter patterns select devices here; otherwise a
+	FilterPlan drops the rows they already decide from the cheap columns (full
+	as passed to format_field) before SMART, statvfs and counters run, and the
+	exact full-row matching is left to iter_drives_info. Mounts whose statvfs misses
+	the prober deadline are yielded with FSUSE_PCT set to STATVFS_TIMEOUT. The
+	READ_* / WRITE_* window columns come from hf_sampler (default: the sampler
+	started by start_high_frequency_sampler) and stay None without one.
+	"""
+	global _STATVFS_PROBER, _SMARTCTL_JSON_UNSUPPORTED
+	if tptDict is None:
+		tptDict = {}
+	if smart_cache is None:
+		smart_cache = _SMART_CACHE
+	if statvfs_prober is None:
+		if _STATVFS_PROBER is None:
+			_STATVFS_PROBER = StatvfsProber()
+		statvfs_prober = _STATVFS_PROBER
+	if hf_sampler is None:
+		hf_sampler = _HF_SAMPLER
+	output_fields_set = set(output_fields if output_fields is not None else ALL_OUTPUT_FIELDS)
+	# only the probe batches the requested columns declare are run
+	sources = probe_sources(output_fields_set)
+	macos_info = {}
+	if IS_DARWIN and sources.intersection(('lsblk', 'sysfs')):
+		macos_info = get_macos_diskutil_info(timeout=timeout if timeout else 4)
+	# external commands would describe the live host, not the tree under a root prefix
+	use_lsblk = (not IS_DARWIN) and probe_commands_available() and (not udev_database_available()) and 'lsblk' in sources
+	if use_lsblk:
+		if lsblk_supports_pairs():
+			lsblk_cmd = 'lsblk -b -n -p -o NAME,SIZE,FSTYPE,UUID,LABEL -P'
+			lsblk_pairs_format = True
+		else:
+			lsblk_cmd = 'lsblk -brnp -o NAME,SIZE,FSTYPE,UUID,LABEL'
+			lsblk_pairs_format = False
+		lsblk_result = run_probe_command('lsblk', lsblk_cmd, timeout=timeout)
+	with profile_phase('get_blocks'):
+		block_devices = get_blocks()
+		refresh_probe_caches(block_devices)
+	with profile_phase('graph'):
+		graph = get_device_graph(block_devices)
+	with profile_phase('parseMount'):
+		mount_table = parseMount()
+	target_devices = set(block_devices)
+	if pseudo:
+		target_devices.update(mount_table.keys())
+	if filter_patterns and match_devname_only:
+		pattern = compile_filter_pattern(filter_patterns)
+		filtered_devices = set()
+		for device in target_devices:
+			match = pattern.search(device)
+			if (match and not invert_match) or (not match and invert_match):
+				filtered_devices.add(device)
+		target_devices = filtered_devices
+	target_devices = sorted(target_devices)
+	device_mounts = {}
+	for device_name in target_devices:
+		mount_points = mount_table.get(device_name, [])
+		if best_only and mount_points:
+			mount_points = [sorted(mount_points, key=lambda x: len(x.MOUNTPOINT))[0]]
+		device_mounts[device_name] = mount_points
+	uuid_dict = {}
+	label_dict = {}
+	with profile_phase('symlinks'):
+		if 'by-uuid' in sources:
+			uuid_dict = build_symlink_dict("/dev/disk/by-uuid")
+		if 'by-label' in sources:
+			label_dict = build_symlink_dict("/dev/disk/by-label")
+	fstype_dict = {}
+	size_dict = {}
+	if use_lsblk:
+		with profile_phase('lsblk_wait'):
+			lsblk_result.thread.join(1)
+			if lsblk_result.returncode == 0:
+				populate_lsblk_dicts(lsblk_result.stdout, output_fields_set, uuid_dict, fstype_dict, label_dict, size_dict, lsblk_pairs_format)
+	elif (not IS_DARWIN) and 'lsblk' in sources:
+		with profile_phase('udev'):
+			populate_udev_dicts(block_devices, output_fields_set, uuid_dict, fstype_dict, label_dict, size_dict)
+	if IS_DARWIN:
+		for devname, info in macos_info.items():
 			if 'UUID' in output_fields_set and info.get('UUID'):
 				uuid_dict[devname] = info['UUID']
 			if 'FSTYPE' in output_fields_set and info.get('FSTYPE'):
@@ -734,118 +2667,2113 @@ def get_drives_info(print_bytes = False, use_1024 = False, mounted_only=False, b
 				label_dict[devname] = info['LABEL']
 			if 'SIZE' in output_fields_set and info.get('SIZE_BYTES'):
 				size_dict[devname] = info['SIZE_BYTES']
-	for device_name in target_devices:
-		if mounted_only and device_name not in mount_table:
+	probe = ProbeContext(graph, macos_info)
+	readers = [(COLUMN_PROVIDERS[field].cost, field_attr(field), COLUMN_PROVIDERS[field].read) for field in ALL_OUTPUT_FIELDS
+		if field in output_fields_set and COLUMN_PROVIDERS[field].read is not None]
+	cheap_readers = [(attr, read) for cost, attr, read in readers if cost <= PUSHDOWN_COST]
+	costly_readers = [(attr, read) for cost, attr, read in readers if cost > PUSHDOWN_COST]
+	descriptions = {}
+
+	def _describe(device_name):
+		# the device-level columns that need no SMART, statvfs or counter probe
+		record = descriptions.get(device_name)
+		if record is not None:
+			return record
+		record = DeviceRecord(NAME=device_name)
+		# fstype, size, fsuse%, mountpoint, rtpt, wtpt, lable, uuid are partition specific
+		# smart, model, serial, discard are device specific, and only for block devices
+		# fstype, size, fsuse%, mountpoint does not require block device and can have multiple values per device
+		if cheap_readers and is_block_device(device_name):
+			with profile_phase('sysfs', device_name):
+				for attr, read in cheap_readers:
+					record.set_field(attr, read(device_name, probe))
+		if device_name in label_dict:
+			record.LABEL = label_dict[device_name]
+		if device_name in uuid_dict:
+			record.UUID = uuid_dict[device_name]
+		descriptions[device_name] = record
+		return record
+
+	if filter_patterns and not match_devname_only:
+		# prune rows the patterns already decide before paying for SMART, statvfs and counters
+		with profile_phase('pushdown'):
+			plan = FilterPlan(filter_patterns, output_fields if output_fields is not None else ALL_OUTPUT_FIELDS, invert_match=invert_match, full=full)
+			kept_devices = []
+			for device_name in target_devices:
+				record = _describe(device_name)
+				if device_mounts[device_name]:
+					device_mounts[device_name] = [mount_entry for mount_entry in device_mounts[device_name]
+						if plan.may_keep(record, mount_entry.FSTYPE, mount_entry.MOUNTPOINT)]
+					if device_mounts[device_name]:
+						kept_devices.append(device_name)
+				elif plan.may_keep(record, fstype_dict.get(device_name, '')):
+					kept_devices.append(device_name)
+			target_devices = kept_devices
+	block_device_set = set(block_devices)
+	probe_devices = [device_name for device_name in target_devices if device_name in block_device_set]
+	if 'diskstats' in sources or active_only:
+		with profile_phase('diskstats'):
+			counter_devices = set(probe_devices)
+			for device_name in probe_devices:
+				counter_devices.update(graph.physical_disks(device_name))
+			update_throughput_table(tptDict, counter_devices)
+	if costly_readers:
+		with profile_phase('readers'):
+			read_columns_concurrently({device_name: _describe(device_name) for device_name in probe_devices
+				if not (mounted_only and device_name not in mount_table) and not (active_only and device_name not in tptDict)},
+				costly_readers, probe)
+	window_rates = {}
+	if hf_sampler is not None and 'sampler' in sources:
+		window_rates = hf_sampler.snapshot()
+	smart_infos = {}
+	smart_health = {}
+	smart_details = {}
+	disk_temps = {}
+	# dm / md / LVM devices report the SMART data of the disks they are built on
+	smart_disks = {}
+	if sources.intersection(('smartctl', 'smartctl-json', 'hwmon')):
+		for block_device in probe_devices:
+			smart_disks.update(dict.fromkeys(graph.physical_disks(block_device)))
+	if 'hwmon' in sources:
+		with profile_phase('hwmon'):
+			for parent_name in smart_disks:
+				disk_temps[parent_name] = read_hwmon_temperature(parent_name)
+	# smartctl --json also answers the health check; TEMP alone needs it only without hwmon
+	json_fields = {field for field in output_fields_set if 'smartctl-json' in COLUMN_PROVIDERS[field].sources}
+	if not smartctl_json_available():
+		json_fields = set()
+	if (json_fields or 'smartctl' in sources) and smartctl_available():
+		with profile_phase('smart_start'):
+			for parent_name in smart_disks:
+				identity = get_smart_identity(parent_name)
+				if json_fields and not (json_fields <= {'TEMP'} and disk_temps.get(parent_name) is not None):
+					cached_details = smart_cache.get(smart_details_identity(identity), parent_name)
+					if cached_details is not None:
+						smart_details[parent_name] = SmartDetails(*cached_details)
+						smart_health[parent_name] = smart_details[parent_name].HEALTH
+					else:
+						key = f'smartctl --json -H -A {parent_name}'
+						smart_infos[parent_name] = (run_probe_command(key, f'{SMARTCTL_PATH} --json -H -A {parent_name}', timeout=timeout), True)
+				elif 'smartctl' in sources:
+					cached_health = smart_cache.get(identity, parent_name)
+					if cached_health is not None:
+						smart_health[parent_name] = cached_health
+					else:
+						smart_infos[parent_name] = (run_probe_command(f'smartctl -H {parent_name}', f'{SMARTCTL_PATH} -H {parent_name}', timeout=timeout), False)
+	# filesystem sizes also drive the zero-size filter when no statvfs column is shown
+	probe_statvfs = 'statvfs' in sources or not show_zero_size_devices
+	mount_usage = {}
+	if probe_statvfs:
+		with profile_phase('statvfs'):
+			mount_usage = statvfs_prober.probe_many(
+				mount_entry.MOUNTPOINT
+				for device_name in target_devices
+				for mount_entry in device_mounts[device_name]
+			)
+	try:
+		for device_name in target_devices:
+			if mounted_only and device_name not in mount_table:
+				continue
+			if active_only and device_name not in tptDict:
+				continue
+			record = _describe(device_name)
+			# empty for devices outside the graph (pseudo file systems)
+			disks = graph.physical_disks(device_name)
+			for parent_name in disks:
+				if parent_name in smart_infos:
+					with profile_phase('smart_wait', parent_name):
+						smart_info_obj, is_json = smart_infos.pop(parent_name)
+						smart_info_obj.thread.join(1)
+						identity = get_smart_identity(parent_name)
+						details = parse_smartctl_json(smart_info_obj.stdout) if is_json else None
+						if is_json and details is None:
+							# smartctl before 7.0: ask this and every other pending disk for the health alone
+							_SMARTCTL_JSON_UNSUPPORTED = True
+							for pending_name in [parent_name] + [name for name, (_, pending_json) in smart_infos.items() if pending_json]:
+								smart_infos[pending_name] = (run_probe_command(f'smartctl -H {pending_name}', f'{SMARTCTL_PATH} -H {pending_name}', timeout=timeout), False)
+							smart_info_obj, is_json = smart_infos.pop(parent_name)
+							smart_info_obj.thread.join(1)
+						if is_json:
+							smart_details[parent_name] = details
+							smart_health[parent_name] = details.HEALTH
+							smart_cache.put(smart_details_identity(identity), parent_name, details)
+						else:
+							smart_health[parent_name] = parse_smartctl_health(smart_info_obj.stdout)
+						smart_cache.put(identity, parent_name, smart_health[parent_name])
+			record.SMART = join_distinct(smart_health.get(parent_name) for parent_name in disks)
+			if smart_details or disk_temps:
+				details = [smart_details[parent_name] for parent_name in disks if parent_name in smart_details]
+				record.TEMP = max_known(disk_temps.get(parent_name) if disk_temps.get(parent_name) is not None
+					else getattr(smart_details.get(parent_name), 'TEMP', None) for parent_name in disks)
+				record.WEAR_PCT = max_known(detail.WEAR_PCT for detail in details)
+				record.POWER_ON_HRS = max_known(detail.POWER_ON_HRS for detail in details)
+				media_errors = [detail.MEDIA_ERR for detail in details if detail.MEDIA_ERR is not None]
+				record.MEDIA_ERR = sum(media_errors) if media_errors else None
+			disk_rates = [tptDict[disk].rates for disk in disks if disk in tptDict]
+			if disk_rates:
+				record.DISK_READ = sum(rates.READ for rates in disk_rates)
+				record.DISK_WRITE = sum(rates.WRITE for rates in disk_rates)
+			if device_name in tptDict:
+				rates = tptDict[device_name].rates
+				for rate_field in DiskRates._fields:
+					setattr(record, rate_field, getattr(rates, rate_field))
+				if device_name in window_rates:
+					for direction, stats in zip(("READ", "WRITE"), window_rates[device_name]):
+						for stat_name, value in zip(WindowStats._fields, stats):
+							setattr(record, f"{direction}_{stat_name}", value)
+				if active_only and record.READ == 0 and record.WRITE == 0:
+					continue
+			mount_points = device_mounts[device_name]
+			if mount_points:
+				for mount_entry in mount_points:
+					if formated_only and not mount_entry.FSTYPE:
+						continue
+					if not probe_statvfs:
+						yield record._replace(FSTYPE=mount_entry.FSTYPE, MOUNTPOINT=mount_entry.MOUNTPOINT)
+						continue
+					usage = mount_usage.get(mount_entry.MOUNTPOINT)
+					if usage is None:
+						yield record._replace(FSTYPE=mount_entry.FSTYPE, MOUNTPOINT=mount_entry.MOUNTPOINT, FSUSE_PCT=STATVFS_TIMEOUT)
+						continue
+					size_bytes, used_bytes = usage
+					if size_bytes == 0 and not show_zero_size_devices:
+						continue
+					yield record._replace(
+						FSTYPE=mount_entry.FSTYPE,
+						MOUNTPOINT=mount_entry.MOUNTPOINT,
+						SIZE=size_bytes,
+						USED=used_bytes,
+						FSUSE_PCT=100.0 * used_bytes / size_bytes if size_bytes > 0 else None,
+					)
+			else:
+				if formated_only and device_name not in fstype_dict:
+					continue
+				record.FSTYPE = fstype_dict.get(device_name, '')
+				if IS_DARWIN:
+					size_bytes = size_dict.get(device_name, macos_info.get(device_name, {}).get('SIZE_BYTES', 0))
+				else:
+					size_bytes = size_dict.get(device_name, read_size(block_sysfs_dir(device_name)))
+				if size_bytes == 0 and not show_zero_size_devices:
+					continue
+				record.SIZE = size_bytes
+				yield record
+			with profile_phase('join_threads'):
+				multiCMD.join_threads(timeout=timeout)
+	finally:
+		smart_cache.save()
+
+def select_records(records, block_devices, mounted_only=False, best_only=False, formated_only=False,
+					show_zero_size_devices=False, pseudo=False, active_only=False):
+	"""Apply collect()'s row options to records collected with all of them relaxed.
+
+	records must come from collect(pseudo=True, show_zero_size_devices=True) with
+	the other options off; block_devices is the get_blocks() set of that run.
+
+	>>> records = [DeviceRecord(NAME='/dev/sda', SIZE=0), DeviceRecord(NAME='/dev/sda1', FSTYPE='ext4', SIZE=9, MOUNTPOINT='/boot/efi'),
+	...     DeviceRecord(NAME='/dev/sda1', FSTYPE='ext4', SIZE=9, MOUNTPOINT='/boot'), DeviceRecord(NAME='tmpfs', FSTYPE='tmpfs', SIZE=5, MOUNTPOINT='/tmp')]
+	>>> [r.MOUNTPOINT for r in select_records(records + records[2:3], {'/dev/sda', '/dev/sda1'}, best_only=True)]
+	['/boot']
+	>>> [r.NAME for r in select_records(records, {'/dev/sda', '/dev/sda1'}, pseudo=True, show_zero_size_devices=True, mounted_only=True)]
+	['/dev/sda1', '/dev/sda1', 'tmpfs']
+	"""
+	best_mounts = {}
+	best_taken = set()
+	if best_only:
+		# collect() picks the shortest mount point before any other row filter
+		for record in records:
+			if record.MOUNTPOINT and (record.NAME not in best_mounts or len(record.MOUNTPOINT) < len(best_mounts[record.NAME])):
+				best_mounts[record.NAME] = record.MOUNTPOINT
+	for record in records:
+		if not pseudo and record.NAME not in block_devices:
+			continue
+		if mounted_only and not record.MOUNTPOINT:
+			continue
+		if active_only and not (record.READ or record.WRITE):
+			continue
+		if best_only and record.MOUNTPOINT:
+			if record.MOUNTPOINT != best_mounts.get(record.NAME) or record.NAME in best_taken:
+				continue
+			best_taken.add(record.NAME)
+		if formated_only and not record.FSTYPE:
+			continue
+		if record.SIZE == 0 and not show_zero_size_devices:
+			continue
+		yield record
+
+def select_rows(records, output_fields, print_bytes=False, use_1024=False, full=False,
+				filter_patterns=None, invert_match=False, match_devname_only=False):
+	"""Format records and yield the (record, row) pairs that pass the filter patterns.
+
+	Patterns match any formatted column, or only the device name with match_devname_only.
+	"""
+	pattern = compile_filter_pattern(filter_patterns) if filter_patterns else None
+	if pattern is None and invert_match and not match_devname_only:
+		# if no patterns but invert_match is set, return only header
+		return
+	for record in records:
+		if pattern is not None and match_devname_only:
+			if bool(pattern.search(record.NAME)) == invert_match:
+				continue
+		with profile_phase('format'):
+			row = format_record(record, output_fields, print_bytes=print_bytes, use_1024=use_1024, full=full)
+			keep = True
+			if pattern is not None and not match_devname_only:
+				match = any(pattern.search(field) for field in row)
+				keep = not ((match and invert_match) or (not match and not invert_match))
+		if keep:
+			yield record, row
+
+def select_rollup(records, rollup, graph=None):
+	"""Keep the first row of every physical disk (rollup 'disk') or topmost dm / md device ('lv').
+
+	A disk's own counters already include all I/O of the partitions and volumes
+	stacked on it, so its READ / WRITE are the rolled-up totals; volume rows carry
+	their physical disks in DISKS and the disks' summed rates in DISK_READ / DISK_WRITE.
+	graph defaults to the DeviceGraph of the collect() run producing records.
+	"""
+	seen = set()
+	for record in records:
+		if graph is None:
+			graph = get_device_graph()
+		if record.NAME in seen:
+			continue
+		if not (graph.is_physical(record.NAME) if rollup == 'disk' else graph.is_volume(record.NAME)):
 			continue
-		if active_only and device_name not in tptDict:
+		seen.add(record.NAME)
+		yield record
+
+TREE_BRANCH = '├─'
+TREE_LAST = '└─'
+TREE_PIPE = '│ '
+TREE_SPACE = '  '
+
+def tree_rows(pairs, output_fields, graph=None):
+	"""Order (record, row) pairs as a device tree and indent NAME with branch glyphs.
+
+	Every disk is followed by its partitions and the devices stacked on them;
+	a device built on several others (md, LVM over two disks) appears under
+	each, as in lsblk. Rows outside the graph (pseudo file systems) stay roots.
+	"""
+	rows_by_device = {}
+	for record, row in pairs:
+		rows_by_device.setdefault(record.NAME, []).append(row)
+	if graph is None:
+		graph = get_device_graph()
+	children = {}
+
+	def _children(device):
+		# skip over hidden (filtered out) devices to the next shown ones
+		if device not in children:
+			children[device] = []
+			found = []
+			for upper in graph.uppers.get(device, ()):
+				found.extend([upper] if upper in rows_by_device else _children(upper))
+			children[device] = list(dict.fromkeys(found))
+		return children[device]
+
+	def _has_shown_lower(device):
+		return any(lower in rows_by_device or _has_shown_lower(lower) for lower in graph.lowers.get(device, ()))
+
+	name_index = output_fields.index('NAME') if 'NAME' in output_fields else None
+	result = []
+
+	def _emit(device, lead, branch):
+		for row in rows_by_device[device]:
+			if name_index is not None:
+				row = list(row)
+				row[name_index] = lead + branch + row[name_index]
+			result.append(row)
+		if branch:
+			lead += TREE_SPACE if branch == TREE_LAST else TREE_PIPE
+		shown = _children(device)
+		for index, child in enumerate(shown):
+			_emit(child, lead, TREE_LAST if index == len(shown) - 1 else TREE_BRANCH)
+
+	for device in rows_by_device:
+		if not _has_shown_lower(device):
+			_emit(device, '', '')
+	return result
+
+def iter_drives_info(print_bytes = False, use_1024 = False, mounted_only=False, best_only=False,
+					formated_only=False, show_zero_size_devices=False,pseudo=False,tptDict=None,
+					full=False,active_only=False,output_fields=None,
+					filter_patterns=None,invert_match=False,match_devname_only=False,timeout=None,
+					smart_cache=None,statvfs_prober=None,rollup=None):
+	"""Yield (DeviceRecord, formatted row) pairs that pass the filter patterns.
+
+	rollup ('disk' or 'lv') keeps only the rows described by select_rollup.
+	"""
+	if output_fields is None:
+		output_fields = list(DEFAULT_OUTPUT_FIELDS)
+	records = collect(mounted_only=mounted_only, best_only=best_only, formated_only=formated_only,
+						show_zero_size_devices=show_zero_size_devices, pseudo=pseudo, tptDict=tptDict,
+						active_only=active_only, output_fields=output_fields, filter_patterns=filter_patterns,
+						invert_match=invert_match, match_devname_only=match_devname_only, timeout=timeout,
+						smart_cache=smart_cache, statvfs_prober=statvfs_prober, full=full)
+	if rollup:
+		records = select_rollup(records, rollup)
+	yield from select_rows(records, output_fields, print_bytes=print_bytes, use_1024=use_1024, full=full,
+						filter_patterns=filter_patterns, invert_match=invert_match, match_devname_only=match_devname_only)
+
+def get_drives_info(print_bytes = False, use_1024 = False, mounted_only=False, best_only=False, 
+					formated_only=False, show_zero_size_devices=False,pseudo=False,tptDict=None,
+					full=False,active_only=False,output="default",exclude="",
+					filter_patterns=None,invert_match=False,match_devname_only=False,timeout=None,
+					debug=False,smart_cache=None,statvfs_prober=None,tree=False,rollup=None):
+	global _DEBUG_MODE
+	if debug:
+		_DEBUG_MODE = True
+	output_fields = resolve_output_fields(output, exclude, rollup=rollup)
+	if not output_fields:
+		print("No valid output fields specified.", file=sys.stderr)
+		return []
+	pairs = iter_drives_info(print_bytes=print_bytes, use_1024=use_1024, mounted_only=mounted_only,
+								best_only=best_only, formated_only=formated_only,
+								show_zero_size_devices=show_zero_size_devices, pseudo=pseudo, tptDict=tptDict,
+								full=full, active_only=active_only, output_fields=output_fields,
+								filter_patterns=filter_patterns, invert_match=invert_match,
+								match_devname_only=match_devname_only, timeout=timeout, smart_cache=smart_cache,
+								statvfs_prober=statvfs_prober, rollup=rollup)
+	if tree:
+		return [output_fields] + tree_rows(pairs, output_fields)
+	output_list = [output_fields]
+	for _, row in pairs:
+		output_list.append(row)
+	return output_list
+
+
+TickReport = namedtuple("TickReport", ["tick", "elapsed", "overrun", "skipped"])
+
+class WatchScheduler:
+	"""Fixed-rate watch ticks on time.monotonic() deadlines.
+
+	Ticks are due at start + n * period regardless of how long each one took; a
+	tick that overruns skips the deadlines it missed instead of running late
+	ticks back to back.
+
+	>>> now = [100.0]
+	>>> scheduler = WatchScheduler(2.0, clock=lambda: now[0])
+	>>> scheduler.start_tick(); now[0] += 0.5
+	>>> scheduler.finish_tick(), scheduler.remaining()
+	(TickReport(tick=1, elapsed=0.5, overrun=0.0, skipped=0), 1.5)
+	>>> now[0] = 102.0; scheduler.start_tick(); now[0] = 106.5
+	>>> scheduler.finish_tick(), scheduler.remaining()
+	(TickReport(tick=2, elapsed=4.5, overrun=2.5, skipped=2), 1.5)
+	"""
+	def __init__(self, period, clock=time.monotonic):
+		self.period = period
+		self.clock = clock
+		self.deadline = None
+		self.tick = 0
+		self.tick_start = None
+
+	def start_tick(self):
+		now = self.clock()
+		if self.deadline is None:
+			self.deadline = now
+		self.tick += 1
+		self.tick_start = now
+
+	def finish_tick(self):
+		"""Schedule the next deadline and report how this tick went."""
+		now = self.clock()
+		self.deadline += self.period
+		overrun = max(0.0, now - self.deadline)
+		skipped = 0
+		if now > self.deadline:
+			skipped = int((now - self.deadline) // self.period) + 1
+			self.deadline += skipped * self.period
+		return TickReport(self.tick, now - self.tick_start, overrun, skipped)
+
+	def remaining(self):
+		return max(0.0, self.deadline - self.clock())
+
+def format_tick_report(report, period):
+	"""One-line summary of a watch tick.
+
+	>>> format_tick_report(TickReport(3, 0.0123, 0.0, 0), 2.0)
+	'tick 3: collected in 12.3 ms'
+	>>> format_tick_report(TickReport(4, 2.5, 0.5, 1), 2.0)
+	'tick 4: collected in 2500.0 ms, overran the 2 s period by 0.500 s, skipped 1 tick'
+	"""
+	text = f"tick {report.tick}: collected in {report.elapsed * 1000:.1f} ms"
+	if report.skipped:
+		text += f", overran the {period:g} s period by {report.overrun:.3f} s, skipped {report.skipped} tick{'s' if report.skipped > 1 else ''}"
+	return text
+
+def ndjson_object(record, output_fields, **extra):
+	"""Build the NDJSON object for one DeviceRecord: extra keys first, then the raw column values.
+
+	>>> ndjson_object(DeviceRecord(NAME='/dev/sda1', SIZE=100, USED=25, FSUSE_PCT=25.0, MOUNTPOINT='/'), ['NAME', 'FSUSE%'], host='h1')
+	{'host': 'h1', 'NAME': '/dev/sda1', 'FSUSE%': 25.0, 'USED': 25}
+	"""
+	obj = dict(extra)
+	for field in output_fields:
+		obj[field] = getattr(record, field_attr(field))
+	if 'FSUSE%' in output_fields:
+		obj['USED'] = record.USED
+	return obj
+
+def write_ndjson(pairs, output_fields, stream=None, hostname=None):
+	"""Write one compact JSON line per (record, row) pair as it arrives, then flush.
+
+	Every line carries the same monotonic timestamp (ts), wall clock time and
+	hostname so a log shipper can group a tick without extra state.
+	"""
+	import json
+	if stream is None:
+		stream = sys.stdout
+	if hostname is None:
+		import socket
+		hostname = socket.gethostname()
+	ts = time.monotonic()
+	wall_time = time.time()
+	count = 0
+	for record, _ in pairs:
+		stream.write(json.dumps(ndjson_object(record, output_fields, ts=ts, time=wall_time, host=hostname), separators=(',', ':')))
+		stream.write('\n')
+		count += 1
+	stream.flush()
+	return count
+
+def parse_listen_address(value):
+	"""Split an ADDR:PORT listen spec; an empty address listens on all interfaces.
+
+	>>> parse_listen_address(':9101')
+	('', 9101)
+	>>> parse_listen_address('127.0.0.1:8000')
+	('127.0.0.1', 8000)
+	>>> parse_listen_address('[::1]:9101')
+	('::1', 9101)
+	"""
+	host, _, port = value.rpartition(':')
+	return host.strip('[]'), int(port)
+
+def _metric_labels(**labels):
+	"""Render a Prometheus label set, escaping values.
+
+	>>> _metric_labels(device='/dev/sda', mountpoint='/mnt/"x"')
+	'{device="/dev/sda",mountpoint="/mnt/\\\\"x\\\\""}'
+	"""
+	escaped = []
+	for key, value in labels.items():
+		value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+		escaped.append(f'{key}="{value}"')
+	return '{' + ','.join(escaped) + '}'
+
+METRIC_HELP = (
+	('statblk_device_size_bytes', 'gauge', 'Size of the block device or filesystem in bytes.'),
+	('statblk_filesystem_used_bytes', 'gauge', 'Bytes used on the mounted filesystem.'),
+	('statblk_filesystem_timeout', 'gauge', '1 if the filesystem usage query missed its deadline.'),
+	('statblk_read_bytes_total', 'counter', 'Bytes read from the block device.'),
+	('statblk_written_bytes_total', 'counter', 'Bytes written to the block device.'),
+	('statblk_reads_completed_total', 'counter', 'Read requests completed by the block device.'),
+	('statblk_writes_completed_total', 'counter', 'Write requests completed by the block device.'),
+	('statblk_io_time_seconds_total', 'counter', 'Seconds the block device had I/O in flight.'),
+	('statblk_smart_healthy', 'gauge', '1 if the SMART overall health check passed, 0 otherwise.'),
+	('statblk_smart_temperature_celsius', 'gauge', 'Drive temperature in degrees Celsius.'),
+	('statblk_smart_percentage_used', 'gauge', 'Vendor estimate of the drive endurance used, in percent.'),
+	('statblk_smart_media_errors', 'gauge', 'Unrecovered media errors reported by the drive.'),
+	('statblk_smart_power_on_hours', 'gauge', 'Hours the drive has been powered on.'),
+	('statblk_collect_duration_seconds', 'gauge', 'Time taken by the last collection.'),
+)
+
+def format_metrics(records, tptDict, collect_seconds=0.0):
+	"""Render DeviceRecords and the counter table in the Prometheus text exposition format.
+
+	Counters are only exported for devices that appear in records, so the CLI
+	filters apply to them as well.
+
+	>>> text = format_metrics([DeviceRecord(NAME='/dev/sda', SIZE=100, SMART='OK', TEMP=41)],
+	...     {'/dev/sda': CounterEntry(DiskStat(1, 0, 4, 0, 2, 0, 8, 0, 0, 1500, 0), 0, ZERO_RATES)})
+	>>> [line for line in text.splitlines() if line.startswith('statblk_') and 'sda' in line][:4]
+	['statblk_device_size_bytes{device="/dev/sda",mountpoint="",fstype=""} 100', 'statblk_read_bytes_total{device="/dev/sda"} 2048', 'statblk_written_bytes_total{device="/dev/sda"} 4096', 'statblk_reads_completed_total{device="/dev/sda"} 1']
+	>>> [line for line in text.splitlines() if line.startswith('statblk_smart_temperature')]
+	['statblk_smart_temperature_celsius{device="/dev/sda"} 41']
+	"""
+	samples = defaultdict(list)
+	smart_seen = set()
+	for record in records:
+		row_labels = _metric_labels(device=record.NAME, mountpoint=record.MOUNTPOINT, fstype=record.FSTYPE)
+		if record.FSUSE_PCT == STATVFS_TIMEOUT:
+			samples['statblk_filesystem_timeout'].append(f'{row_labels} 1')
+		elif record.SIZE is not None:
+			samples['statblk_device_size_bytes'].append(f'{row_labels} {record.SIZE}')
+			if record.USED is not None:
+				samples['statblk_filesystem_used_bytes'].append(f'{row_labels} {record.USED}')
+				samples['statblk_filesystem_timeout'].append(f'{row_labels} 0')
+		if record.NAME in smart_seen:
+			continue
+		smart_seen.add(record.NAME)
+		if record.SMART:
+			healthy = 1 if record.SMART == 'OK' else 0
+			samples['statblk_smart_healthy'].append(f'{_metric_labels(device=record.NAME, model=record.MODEL, serial=record.SERIAL, status=record.SMART)} {healthy}')
+		for metric_name, value in (('statblk_smart_temperature_celsius', record.TEMP), ('statblk_smart_percentage_used', record.WEAR_PCT),
+				('statblk_smart_media_errors', record.MEDIA_ERR), ('statblk_smart_power_on_hours', record.POWER_ON_HRS)):
+			if value is not None:
+				samples[metric_name].append(f'{_metric_labels(device=record.NAME)} {value}')
+	for device_name in sorted({record.NAME for record in records}):
+		entry = tptDict.get(device_name)
+		if entry is None or entry.stat is None:
+			continue
+		stat_sample = entry.stat
+		device_labels = _metric_labels(device=device_name)
+		samples['statblk_read_bytes_total'].append(f'{device_labels} {stat_sample.sectors_read * STAT_SECTOR_SIZE}')
+		samples['statblk_written_bytes_total'].append(f'{device_labels} {stat_sample.sectors_written * STAT_SECTOR_SIZE}')
+		samples['statblk_reads_completed_total'].append(f'{device_labels} {stat_sample.reads}')
+		samples['statblk_writes_completed_total'].append(f'{device_labels} {stat_sample.writes}')
+		samples['statblk_io_time_seconds_total'].append(f'{device_labels} {stat_sample.io_ms / 1000.0}')
+	samples['statblk_collect_duration_seconds'].append(f' {collect_seconds:.6f}')
+	lines = []
+	for name, metric_type, help_text in METRIC_HELP:
+		if not samples.get(name):
+			continue
+		lines.append(f'# HELP {name} {help_text}')
+		lines.append(f'# TYPE {name} {metric_type}')
+		lines.extend(name + sample for sample in samples[name])
+	return '\n'.join(lines) + '\n'
+
+class MetricsExporter:
+	"""Keep one counter table and the probe caches warm for /metrics scrapes.
+
+	A scrape arriving within min_interval of the previous collection is answered
+	from the cached snapshot; SMART is refreshed on the SmartCache TTL instead.
+	"""
+	def __init__(self, min_interval=SCRAPE_MIN_INTERVAL, **collect_kwargs):
+		self.min_interval = min_interval
+		self.collect_kwargs = collect_kwargs
+		self.tptDict = {}
+		self.lock = threading.Lock()
+		self.snapshot = None
+		self.snapshot_time = 0.0
+
+	def refresh(self):
+		start_time = time.monotonic()
+		records = [record for record, _ in iter_drives_info(tptDict=self.tptDict, output_fields=ALL_OUTPUT_FIELDS, **self.collect_kwargs)]
+		self.snapshot = format_metrics(records, self.tptDict, time.monotonic() - start_time)
+		self.snapshot_time = time.monotonic()
+
+	def render(self):
+		with self.lock:
+			if self.snapshot is None or time.monotonic() - self.snapshot_time >= self.min_interval:
+				self.refresh()
+			return self.snapshot
+
+def serve_metrics(listen, exporter):
+	"""Serve exporter.render() on http://listen/metrics until interrupted."""
+	import socket
+	import socketserver
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+
+	class MetricsHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path.split('?', 1)[0] != '/metrics':
+				self.send_error(404)
+				return
+			try:
+				body = exporter.render().encode('utf-8')
+			except Exception as e:
+				debug_exc('metrics render', e)
+				self.send_error(500)
+				return
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			if _DEBUG_MODE:
+				super().log_message(format, *args)
+
+	class MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+		daemon_threads = True
+		allow_reuse_address = True
+
+	host, port = parse_listen_address(listen)
+	if ':' in host:
+		MetricsServer.address_family = socket.AF_INET6
+	server = MetricsServer((host, port), MetricsHandler)
+	print(f"Serving metrics on http://{listen}/metrics", file=sys.stderr, flush=True)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+DAEMON_INTERVAL = 2.0
+DAEMON_REQUEST_LIMIT = 65536
+# Options a --client request carries to the daemon (argparse destinations)
+CLIENT_OPTIONS = ('output', 'exclude', 'bytes', 'si', 'full', 'mounted_only', 'best_only', 'formated_only',
+	'show_zero_size_devices', 'pseudo', 'active_only', 'filter_patterns', 'invert_match', 'match_devname_only', 'tree', 'rollup')
+
+def fallback_socket_dir():
+	"""Private per-user directory in /tmp holding the socket when there is no XDG_RUNTIME_DIR."""
+	return os.path.join('/tmp', f'statblk-{os.getuid()}')
+
+def default_socket_path():
+	"""$XDG_RUNTIME_DIR/statblk.sock, or statblk.sock in the private fallback_socket_dir()."""
+	runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+	if runtime_dir and os.path.isdir(runtime_dir):
+		return os.path.join(runtime_dir, 'statblk.sock')
+	return os.path.join(fallback_socket_dir(), 'statblk.sock')
+
+def check_socket_dir(socket_path, create=False):
+	"""Refuse a socket in fallback_socket_dir() unless that is a directory only this user can enter.
+
+	/tmp is world writable and the name is predictable, so another user could
+	have created it first. With create the daemon makes it (mode 0700).
+	Sockets elsewhere are left to the directory's own permissions.
+
+	>>> import tempfile
+	>>> with tempfile.TemporaryDirectory() as tmp:
+	...     os.chmod(tmp, 0o755)
+	...     check_socket_dir(os.path.join(tmp, 'statblk.sock'))
+	"""
+	directory = os.path.dirname(os.path.abspath(socket_path))
+	if directory != fallback_socket_dir():
+		return
+	if create:
+		try:
+			os.mkdir(directory, 0o700)
+		except FileExistsError:
+			pass
+	st = os.lstat(directory)
+	if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or st.st_mode & 0o077:
+		raise OSError(f'{directory} is not a private directory owned by this user; refusing to use it')
+
+class StatblkDaemon:
+	"""One sampling loop keeping the counter table, probe caches and device set warm for many clients.
+
+	Every interval seconds all columns are collected with the row options relaxed;
+	answer() then applies each client's options to that shared snapshot.
+	"""
+	def __init__(self, interval=DAEMON_INTERVAL, timeout=2, history=None):
+		self.interval = interval
+		self.timeout = timeout
+		self.history = history
+		self.tptDict = {}
+		self.lock = threading.Lock()
+		self.records = []
+		self.block_devices = frozenset()
+		self.graph = None
+		self.tick = 0
+		self.updated = None
+		self.ready = threading.Event()
+		self.stop_event = threading.Event()
+		self.thread = None
+
+	def refresh(self):
+		records = list(collect(show_zero_size_devices=True, pseudo=True, tptDict=self.tptDict,
+							output_fields=ALL_OUTPUT_FIELDS, timeout=self.timeout))
+		block_devices = frozenset(get_blocks())
+		graph = get_device_graph(block_devices)
+		if self.history is not None:
+			self.history.append({device: entry.stat for device, entry in self.tptDict.items()})
+		with self.lock:
+			self.records = records
+			self.block_devices = block_devices
+			self.graph = graph
+			self.tick += 1
+			self.updated = time.time()
+		self.ready.set()
+
+	def run(self):
+		scheduler = WatchScheduler(self.interval)
+		while not self.stop_event.is_set():
+			scheduler.start_tick()
+			try:
+				self.refresh()
+			except Exception as e:
+				debug_exc('daemon refresh', e)
+			scheduler.finish_tick()
+			self.stop_event.wait(scheduler.remaining())
+
+	def start(self):
+		self.thread = threading.Thread(target=self.run, name='statblk-daemon', daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.stop_event.set()
+
+	def answer(self, request):
+		"""Render the current snapshot for one client request; returns (header dict, body text)."""
+		import json
+		self.ready.wait(max(30.0, 2 * self.interval))
+		with self.lock:
+			records = self.records
+			block_devices = self.block_devices
+			graph = self.graph
+			header = {'status': 'ok', 'tick': self.tick, 'updated': self.updated}
+		rollup = request.get('rollup')
+		output_fields = resolve_output_fields(request.get('output') or 'default', request.get('exclude') or '', rollup=rollup)
+		if not output_fields:
+			return {'status': 'error', 'error': 'No valid output fields specified.'}, ''
+		selected = select_records(records, block_devices, mounted_only=request.get('mounted_only', False),
+							best_only=request.get('best_only', False), formated_only=request.get('formated_only', False),
+							show_zero_size_devices=request.get('show_zero_size_devices', False),
+							pseudo=request.get('pseudo', False), active_only=request.get('active_only', False))
+		if rollup:
+			selected = select_rollup(selected, rollup, graph)
+		pairs = select_rows(selected, output_fields, print_bytes=request.get('bytes', False),
+							use_1024=not request.get('si', False), full=request.get('full', False),
+							filter_patterns=request.get('filter_patterns'), invert_match=request.get('invert_match', False),
+							match_devname_only=request.get('match_devname_only', False))
+		output_format = request.get('format', 'table')
+		if output_format == 'ndjson':
+			import io
+			stream = io.StringIO()
+			write_ndjson(pairs, output_fields, stream=stream)
+			return header, stream.getvalue()
+		if request.get('tree'):
+			results = [output_fields] + tree_rows(pairs, output_fields, graph)
+		else:
+			results = [output_fields] + [row for _, row in pairs]
+		if output_format == 'json':
+			return header, json.dumps(results, indent=1) + '\n'
+		return header, multiCMD.pretty_format_table(results, full=request.get('full', False)) + '\n'
+
+def _claim_socket_path(socket_path):
+	"""Remove a stale socket left by a dead daemon; refuse if a daemon still answers on it.
+
+	Only a socket owned by this user is ever removed; any other file is left alone.
+
+	>>> import tempfile
+	>>> with tempfile.TemporaryDirectory() as tmp:
+	...     path = os.path.join(tmp, 'victim.txt')
+	...     with open(path, 'w') as f:
+	...         _ = f.write('data')
+	...     try:
+	...         _claim_socket_path(path)
+	...     except OSError as e:
+	...         print('refused', os.path.exists(path))
+	refused True
+	"""
+	import socket
+	try:
+		st = os.lstat(socket_path)
+	except FileNotFoundError:
+		return
+	if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.geteuid():
+		raise OSError(f'{socket_path} exists and is not a socket owned by this user; refusing to replace it')
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(socket_path)
+	except OSError:
+		os.unlink(socket_path)
+		return
+	finally:
+		probe.close()
+	raise OSError(f'a statblk daemon is already listening on {socket_path}')
+
+def make_daemon_server(socket_path, daemon):
+	"""Bind a threaded Unix socket server (mode 0600) answering one JSON request line per connection."""
+	import json
+	import socketserver
+
+	class DaemonHandler(socketserver.StreamRequestHandler):
+		def handle(self):
+			line = self.rfile.readline(DAEMON_REQUEST_LIMIT)
+			if not line.strip():
+				# liveness probe from _claim_socket_path or a client that gave up
+				return
+			try:
+				header, body = daemon.answer(json.loads(line.decode('utf-8')))
+			except Exception as e:
+				debug_exc('daemon request', e)
+				header, body = {'status': 'error', 'error': str(e)}, ''
+			self.wfile.write(json.dumps(header).encode('utf-8') + b'\n' + body.encode('utf-8'))
+
+	class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+		daemon_threads = True
+
+		def handle_error(self, request, client_address):
+			debug_exc('daemon client', sys.exc_info()[1])
+
+	check_socket_dir(socket_path, create=True)
+	_claim_socket_path(socket_path)
+	previous_umask = os.umask(0o177)
+	try:
+		return DaemonServer(socket_path, DaemonHandler)
+	finally:
+		os.umask(previous_umask)
+
+def serve_daemon(socket_path, daemon):
+	"""Run daemon's sampling loop and answer --client requests on socket_path until interrupted."""
+	import signal
+	server = make_daemon_server(socket_path, daemon)
+	daemon.start()
+	# leave through the finally block (and remove the socket) on SIGTERM as well
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	print(f"statblk daemon listening on {socket_path}", file=sys.stderr, flush=True)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		daemon.stop()
+		server.server_close()
+		try:
+			os.unlink(socket_path)
+		except OSError:
+			pass
+
+def query_daemon(request, socket_path=None, timeout=5.0):
+	"""Send one request to a running daemon and return the rendered output.
+
+	Raises OSError if the daemon cannot be reached and RuntimeError if it rejects the request.
+	"""
+	import json
+	import socket
+	if socket_path is None:
+		socket_path = default_socket_path()
+	check_socket_dir(socket_path)
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.settimeout(timeout)
+	chunks = []
+	try:
+		sock.connect(socket_path)
+		sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+		while True:
+			data = sock.recv(65536)
+			if not data:
+				break
+			chunks.append(data)
+	finally:
+		sock.close()
+	header_line, _, body = b''.join(chunks).partition(b'\n')
+	header = json.loads(header_line.decode('utf-8'))
+	if header.get('status') != 'ok':
+		raise RuntimeError(header.get('error', 'daemon error'))
+	return body.decode('utf-8')
+
+# {host} is the fleet entry, {command} the statblk invocation as one shell command string
+FLEET_TRANSPORT = 'ssh -o BatchMode=yes -o ConnectTimeout=5 {host} {command}'
+FLEET_REMOTE_COMMAND = 'statblk'
+FLEET_PARALLEL = 32
+FLEET_HOST_TIMEOUT = 15.0
+# row options forwarded to every host as --<option>
+FLEET_FLAG_OPTIONS = ('mounted_only', 'best_only', 'formated_only', 'show_zero_size_devices', 'pseudo', 'active_only',
+	'invert_match', 'match_devname_only', 'sudo', 'client')
+
+FleetResult = namedtuple("FleetResult", ["host", "records", "error", "elapsed"])
+
+def parse_host_list(value):
+	"""Hosts from a comma-separated list, or one per line from @FILE ('#' starts a comment).
+
+	Raises ValueError for a host starting with '-', which ssh would take as an option.
+
+	>>> parse_host_list('db1, db2,db1,,db3')
+	['db1', 'db2', 'db3']
+	>>> parse_host_list('db1,-oProxyCommand=sh')
+	Traceback (most recent call last):
+	...
+	ValueError: invalid host '-oProxyCommand=sh'
+	"""
+	if value.startswith('@'):
+		with open(value[1:], 'r', encoding='utf-8') as f:
+			entries = [line.split('#', 1)[0] for line in f]
+	else:
+		entries = value.split(',')
+	hosts = list(dict.fromkeys(entry.strip() for entry in entries if entry.strip()))
+	for host in hosts:
+		if host.startswith('-'):
+			raise ValueError(f'invalid host {host!r}')
+	return hosts
+
+def fleet_remote_args(output_fields, filter_patterns=(), rollup=None, timeout=None, **flags):
+	"""statblk arguments asking a host for NDJSON rows of output_fields.
+
+	flags are the FLEET_FLAG_OPTIONS to pass; a trailing 0 keeps a numeric last
+	pattern from being read as the refresh period.
+
+	>>> fleet_remote_args(['NAME', 'SIZE'], ['nvme'], mounted_only=True, pseudo=False)
+	['--ndjson', '-o', 'NAME,SIZE', '--mounted_only', 'nvme', '0']
+	"""
+	args = ['--ndjson', '-o', ','.join(output_fields)]
+	for option in FLEET_FLAG_OPTIONS:
+		if flags.get(option):
+			args.append(f'--{option}')
+	if rollup:
+		args += ['--rollup', rollup]
+	if timeout is not None:
+		args += ['-t', str(timeout)]
+	if filter_patterns:
+		args += list(filter_patterns) + ['0']
+	return args
+
+def fleet_command(host, remote_args, transport=FLEET_TRANSPORT, remote_command=FLEET_REMOTE_COMMAND):
+	"""argv running remote_command with remote_args on host through the transport template.
+
+	{host} in transport and remote_command is replaced by host and {command}
+	by the shell-quoted statblk command line (appended when transport has no
+	{command}), so ssh and a local `sh -c {command}` stand-in see the same text.
+	A transport argument that is exactly {host} gets the host as is; anywhere
+	else it is shell-quoted. Hosts starting with '-' are refused.
+
+	>>> fleet_command('db1', ['--ndjson', 'sd[ab]'])
+	['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5', 'db1', "statblk --ndjson 'sd[ab]'"]
+	>>> fleet_command('n1', ['--ndjson'], transport='sh -c {command}', remote_command='statblk --root /srv/{host}')
+	['sh', '-c', 'statblk --root /srv/n1 --ndjson']
+	>>> fleet_command('n1;reboot', [], transport='sh -c {command}', remote_command='statblk --root /srv/{host}')
+	['sh', '-c', "statblk --root /srv/'n1;reboot'"]
+	"""
+	import shlex
+	if host.startswith('-'):
+		raise ValueError(f'invalid host {host!r}')
+	quoted_host = shlex.quote(host)
+	command = ' '.join([remote_command.replace('{host}', quoted_host)] + [shlex.quote(arg) for arg in remote_args])
+	tokens = shlex.split(transport)
+	if not any('{command}' in token for token in tokens):
+		tokens.append('{command}')
+	return [host if token == '{host}' else token.replace('{host}', quoted_host).replace('{command}', command) for token in tokens]
+
+def parse_fleet_output(lines, output_fields):
+	"""DeviceRecords from the NDJSON lines a host answered with.
+
+	>>> [(record.NAME, record.SIZE) for record in parse_fleet_output(['{"ts":1.0,"host":"n1","NAME":"/dev/sda","SIZE":512}', ''], ['NAME', 'SIZE'])]
+	[('/dev/sda', 512)]
+	"""
+	import json
+	records = []
+	for line in lines:
+		if not line.strip():
 			continue
-		device_properties = defaultdict(str)
-		device_properties['NAME'] = device_name if full else device_name.replace('/dev/', '')
-		# fstype, size, fsuse%, mountpoint, rtpt, wtpt, lable, uuid are partition specific
-		# smart, model, serial, discard are device specific, and only for block devices
-		# fstype, size, fsuse%, mountpoint does not require block device and can have multiple values per device
-		if is_block_device(device_name):
-			parent_name = get_partition_parent_name(device_name)
-			if 'MODEL' in output_fields_set or 'SERIAL' in output_fields_set:
-				if IS_DARWIN:
-					di = macos_info.get(parent_name or device_name, {})
-					device_properties['MODEL'] = di.get('MODEL', '')
-					device_properties['SERIAL'] = di.get('SERIAL', '')
-				else:
-					parent_sysfs_path = os.path.realpath(os.path.join('/sys/class/block', os.path.basename(parent_name))) if parent_name else None
-					device_properties['MODEL'], device_properties['SERIAL'] = read_model_and_serial(parent_sysfs_path)
-			if 'DISCARD' in output_fields_set:
-				if IS_DARWIN:
-					di = macos_info.get(parent_name or device_name, {})
-					device_properties['DISCARD'] = di.get('DISCARD', 'N/A')
-				else:
-					parent_sysfs_path = os.path.realpath(os.path.join('/sys/class/block', os.path.basename(parent_name))) if parent_name else None
-					device_properties['DISCARD'] = read_discard_support(parent_sysfs_path)
-			if parent_name in smart_infos and SMARTCTL_PATH:
-				smart_info_obj = smart_infos[parent_name]
-				smart_info_obj.thread.join(1)
-				for line in smart_info_obj.stdout:
-					line = line.lower()
-					if "health" in line:
-						smartinfo = line.rpartition(':')[2].strip().upper()
-						device_properties['SMART'] = smartinfo.replace('PASSED', 'OK')
-						break
-					elif "denied" in line:
-						device_properties['SMART'] = 'DENIED'
-						break
-			#size_bytes = read_size(os.path.join('/sys/class/block', os.path.basename(device_name)))
-		if device_name in tptDict:
+		obj = json.loads(line)
+		values = {field_attr(field): obj.get(field) for field in output_fields if field in obj}
+		if 'USED' in obj:
+			values['USED'] = obj['USED']
+		records.append(DeviceRecord(**values))
+	return records
+
+def fleet_host_result(host, task, elapsed, host_timeout, output_fields):
+	"""FleetResult for a finished multiCMD task; error says why a host gave no rows."""
+	if task.returncode != 0:
+		if elapsed >= host_timeout:
+			error = f'no answer within {host_timeout:g} s'
+		else:
+			detail = next((line.strip() for line in reversed(task.stderr or []) if line.strip()), '')
+			error = f'exit status {task.returncode}' + (f': {detail}' if detail else '')
+		return FleetResult(host, [], error, elapsed)
+	try:
+		records = parse_fleet_output(task.stdout, output_fields)
+	except ValueError as e:
+		return FleetResult(host, [], f'unreadable output: {e}', elapsed)
+	for record in records:
+		record.extra['HOST'] = host
+	return FleetResult(host, records, None, elapsed)
+
+def iter_fleet(hosts, remote_args, output_fields, transport=FLEET_TRANSPORT, remote_command=FLEET_REMOTE_COMMAND,
+			parallel=FLEET_PARALLEL, host_timeout=FLEET_HOST_TIMEOUT):
+	"""Run statblk on every host, at most parallel at once; yield a FleetResult per host as it answers.
+
+	Each host gets host_timeout seconds from the start of its command, so one
+	slow host delays only its own result. Records carry the host in HOST.
+
+	>>> results = list(iter_fleet(['n1', 'n2'], [], ['NAME'], transport='sh -c {command}',
+	...     remote_command='printf \\'{"NAME":"/dev/{host}a"}\\\\n\\'; test {host} = n1 || exit 3; true'))
+	>>> sorted((result.host, [record.NAME for record in result.records], result.error) for result in results)
+	[('n1', ['/dev/n1a'], None), ('n2', [], 'exit status 3')]
+	"""
+	pending = queue.Queue()
+	for host in hosts:
+		pending.put(host)
+	answers = queue.Queue()
+
+	def _worker():
+		while True:
 			try:
-				device_properties['READ'], device_properties['WRITE'] = next(tptDict[device_name])
-				if active_only and device_properties['READ'] == 0 and device_properties['WRITE'] == 0:
-					continue
-				if print_bytes:
-					device_properties['READ'] = str(device_properties['READ'])
-					device_properties['WRITE'] = str(device_properties['WRITE'])
+				host = pending.get_nowait()
+			except queue.Empty:
+				return
+			start = time.monotonic()
+			try:
+				# the transport runs as the invoking user (their ssh keys); --sudo only travels in remote_args
+				task = multiCMD.run_command(fleet_command(host, remote_args, transport, remote_command), timeout=host_timeout,
+									quiet=True, return_object=True, wait_for_return=False, use_sudo=False)
+				# a grandchild holding the pipe open outlives multiCMD's kill, so the deadline is enforced here
+				task.thread.join(host_timeout)
+				elapsed = time.monotonic() - start
+				if task.thread.is_alive():
+					answers.put(FleetResult(host, [], f'no answer within {host_timeout:g} s', elapsed))
 				else:
-					device_properties['READ'] = multiCMD.format_bytes(device_properties['READ'], use_1024_bytes=use_1024, to_str=True,str_format='.0f') + 'B/s'
-					device_properties['WRITE'] = multiCMD.format_bytes(device_properties['WRITE'], use_1024_bytes=use_1024, to_str=True,str_format='.0f') + 'B/s'
+					answers.put(fleet_host_result(host, task, elapsed, host_timeout, output_fields))
 			except Exception as e:
-				debug_exc('throughput format', e)
-				device_properties['READ'] = ''
-				device_properties['WRITE'] = ''
-		if device_name in label_dict:
-			device_properties['LABEL'] = label_dict[device_name]
-		if device_name in uuid_dict:
-			device_properties['UUID'] = uuid_dict[device_name]
-		mount_points = mount_table.get(device_name, [])
-		if best_only:
-			if mount_points:
-				mount_points = [sorted(mount_points, key=lambda x: len(x.MOUNTPOINT))[0]]
-		if mount_points:
-			for mount_entry in mount_points:
-				device_properties['FSTYPE'] = mount_entry.FSTYPE
-				if formated_only and not device_properties['FSTYPE']:
+				debug_exc(f'fleet {host}', e)
+				answers.put(FleetResult(host, [], str(e), time.monotonic() - start))
+
+	for _ in range(min(max(1, parallel), len(hosts))):
+		threading.Thread(target=_worker, daemon=True).start()
+	for _ in hosts:
+		yield answers.get()
+
+def fleet_rows(results, output_fields, hosts=None, print_bytes=False, use_1024=False, full=False):
+	"""Header plus display rows with a leading HOST column, hosts in the given order.
+
+	>>> fleet_rows([FleetResult('n2', [DeviceRecord(NAME='/dev/sdb')], None, 0.1),
+	...     FleetResult('n1', [DeviceRecord(NAME='/dev/sda')], None, 0.2)], ['NAME'], hosts=['n1', 'n2'])
+	[['HOST', 'NAME'], ['n1', 'sda'], ['n2', 'sdb']]
+	"""
+	order = {host: index for index, host in enumerate(hosts or ())}
+	rows = [['HOST'] + list(output_fields)]
+	for result in sorted(results, key=lambda result: order.get(result.host, len(order))):
+		for record in result.records:
+			rows.append([result.host] + format_record(record, output_fields, print_bytes=print_bytes, use_1024=use_1024, full=full))
+	return rows
+
+HISTORY_MAGIC = b'STBLKHS1'
+HISTORY_VERSION = 1
+HISTORY_RECORDS = 262144 # 14 MiB of samples: a week of 8 devices every 20 seconds
+HISTORY_MAX_DEVICES = 512
+HISTORY_NAME_BYTES = 32
+HISTORY_HEADER_BYTES = 64
+# magic, version, record size, capacity, device slots, samples written so far
+HISTORY_HEADER_FORMAT = '<8sIIIIQ'
+HISTORY_COUNT_OFFSET = 24
+# wall clock time, device index, sectors read, sectors written, reads, writes, busy ms
+HISTORY_RECORD_FORMAT = '<dH6xQQQQQ'
+HISTORY_OUTPUT_FIELDS = ["FROM", "TO", "NAME", "SAMPLES", "READ", "WRITE", "READ_MAX", "WRITE_MAX", "R_IOPS", "W_IOPS", "UTIL%"]
+HistorySample = namedtuple("HistorySample", ["time", "device", "sectors_read", "sectors_written", "reads", "writes", "io_ms"])
+
+class HistoryStore:
+	"""Fixed-size ring of raw per-device counter samples in a memory-mapped file.
+
+	The file holds a 64-byte header (magic, version, record size, capacity,
+	device slots, samples written so far), a device table of NUL-padded 32-byte
+	names and capacity 56-byte records of wall clock time, device index,
+	sectors read and written, completed reads and writes and busy milliseconds.
+	Sample n lives in slot n % capacity, so once the ring is full the oldest
+	samples are overwritten; the header count is bumped only after the records
+	it covers are written. Writers hold an exclusive flock on the file while
+	appending, so a daemon and a cron run can share it; readers take no lock.
+
+	>>> import tempfile
+	>>> with tempfile.TemporaryDirectory() as tmp:
+	...     store = HistoryStore(os.path.join(tmp, 'h'), capacity=3, writable=True)
+	...     for second in range(4):
+	...         _ = store.append({'/dev/sda': DiskStat(second, 0, 8 * second, 0, 0, 0, 0, 0, 0, 0, 0)}, timestamp=100.0 + second)
+	...     samples = list(store.samples(since=101.5))
+	...     wrapped = list(store.samples(since=103))
+	...     store.close()
+	>>> [(sample.time, sample.device, sample.sectors_read) for sample in samples]
+	[(102.0, '/dev/sda', 16), (103.0, '/dev/sda', 24)]
+	>>> [sample.time for sample in wrapped]
+	[103.0]
+	"""
+	def __init__(self, path, capacity=HISTORY_RECORDS, writable=False, max_devices=HISTORY_MAX_DEVICES):
+		import mmap
+		import struct
+		self.header = struct.Struct(HISTORY_HEADER_FORMAT)
+		self.record = struct.Struct(HISTORY_RECORD_FORMAT)
+		self.count_field = struct.Struct('<Q')
+		self.path = path
+		self.writable = writable
+		if writable and (not os.path.exists(path) or os.path.getsize(path) == 0):
+			self._create(capacity, max_devices)
+		fd = os.open(path, os.O_RDWR if writable else os.O_RDONLY)
+		try:
+			self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+		except BaseException:
+			os.close(fd)
+			raise
+		# writers keep the descriptor for flock; readers do not need it
+		self.lock_fd = fd if writable else None
+		if not writable:
+			os.close(fd)
+		magic, version, record_size, self.capacity, self.max_devices, _ = self.header.unpack_from(self.map, 0)
+		self.records_offset = HISTORY_HEADER_BYTES + self.max_devices * HISTORY_NAME_BYTES
+		if (magic != HISTORY_MAGIC or version != HISTORY_VERSION or record_size != self.record.size or not self.capacity
+				or len(self.map) < self.records_offset + self.capacity * record_size):
+			self.close()
+			raise ValueError(f'{path} is not a statblk history file')
+		self.devices = []
+		self._load_devices()
+
+	def _load_devices(self):
+		"""Pick up device names added to the table since the last look (by this or another writer)."""
+		for index in range(len(self.devices), self.max_devices):
+			offset = HISTORY_HEADER_BYTES + index * HISTORY_NAME_BYTES
+			name = bytes(self.map[offset:offset + HISTORY_NAME_BYTES]).rstrip(b'\0')
+			if not name:
+				break
+			self.devices.append(name.decode('utf-8', 'replace'))
+		self.device_index = {name: index for index, name in enumerate(self.devices)}
+
+	def _create(self, capacity, max_devices):
+		# sparse until written; linked into place so a reader never sees a partial header
+		# and a writer racing us to create the file keeps the one that won
+		tmp_path = f'{self.path}.{os.getpid()}.tmp'
+		with open(tmp_path, 'wb') as f:
+			f.write(self.header.pack(HISTORY_MAGIC, HISTORY_VERSION, self.record.size, capacity, max_devices, 0))
+			f.truncate(HISTORY_HEADER_BYTES + max_devices * HISTORY_NAME_BYTES + capacity * self.record.size)
+		try:
+			os.link(tmp_path, self.path)
+		except FileExistsError:
+			if os.path.getsize(self.path) == 0:
+				os.replace(tmp_path, self.path)
+		finally:
+			if os.path.exists(tmp_path):
+				os.unlink(tmp_path)
+
+	def count(self):
+		"""Samples written since the file was created (the ring keeps the last capacity)."""
+		return self.count_field.unpack_from(self.map, HISTORY_COUNT_OFFSET)[0]
+
+	def _add_device(self, device):
+		if len(self.devices) >= self.max_devices:
+			debug_exc('history device table', OverflowError(f'no slot left for {device}'))
+			return None
+		index = len(self.devices)
+		name = device.encode('utf-8')[:HISTORY_NAME_BYTES - 1]
+		offset = HISTORY_HEADER_BYTES + index * HISTORY_NAME_BYTES
+		self.map[offset:offset + len(name)] = name
+		self.devices.append(device)
+		self.device_index[device] = index
+		return index
+
+	def append(self, stats, timestamp=None):
+		"""Add one sample per device of stats ({device: DiskStat}); devices with no I/O yet are skipped.
+
+		Holds an exclusive flock on the file for the whole append, so concurrent
+		writers never claim the same ring slots or device table entries.
+		"""
+		import fcntl
+		if timestamp is None:
+			timestamp = time.time()
+		fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+		try:
+			return self._append_locked(stats, timestamp)
+		finally:
+			fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+	def _append_locked(self, stats, timestamp):
+		self._load_devices()
+		total = self.count()
+		written = 0
+		for device, stat in stats.items():
+			if stat is None or not (stat.reads or stat.writes):
+				continue
+			index = self.device_index.get(device)
+			if index is None:
+				index = self._add_device(device)
+				if index is None:
 					continue
-				device_properties['MOUNTPOINT'] = mount_entry.MOUNTPOINT
-				size_bytes, used_bytes = get_statvfs_use_size(device_properties['MOUNTPOINT'])
-				if size_bytes == 0 and not show_zero_size_devices:
+			slot = (total + written) % self.capacity
+			self.record.pack_into(self.map, self.records_offset + slot * self.record.size, timestamp, index,
+							stat.sectors_read, stat.sectors_written, stat.reads, stat.writes, stat.io_ms)
+			written += 1
+		if written:
+			self.count_field.pack_into(self.map, HISTORY_COUNT_OFFSET, total + written)
+		return written
+
+	def _time_at(self, first, position):
+		return self.record.unpack_from(self.map, self.records_offset + (first + position) % self.capacity * self.record.size)[0]
+
+	def _position(self, first, stored, timestamp, after=False):
+		"""First position (oldest = 0) whose sample is not older than timestamp (newer with after), by bisection."""
+		low, high = 0, stored
+		while low < high:
+			middle = (low + high) // 2
+			sample_time = self._time_at(first, middle)
+			if sample_time < timestamp or (after and sample_time == timestamp):
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	def samples(self, since=None, until=None, devices=None):
+		"""Yield HistorySamples taken between since and until (wall clock seconds), oldest first.
+
+		Only the requested range is read from the map; devices limits the
+		output to these device names.
+		"""
+		total = self.count()
+		stored = min(total, self.capacity)
+		first = (total - stored) % self.capacity
+		start = self._position(first, stored, since) if since is not None else 0
+		end = self._position(first, stored, until, after=True) if until is not None else stored
+		wanted = None
+		if devices is not None:
+			wanted = {self.device_index[device] for device in devices if device in self.device_index}
+		names = self.devices
+		# the range is at most two contiguous runs of slots: up to the end of the ring, then from its start
+		low, high = first + start, first + end
+		for run_start, run_end in ((low, min(high, self.capacity)), (max(low, self.capacity) - self.capacity, high - self.capacity)):
+			if run_start >= run_end:
+				continue
+			view = memoryview(self.map)[self.records_offset + run_start * self.record.size:self.records_offset + run_end * self.record.size]
+			try:
+				for timestamp, index, sectors_read, sectors_written, reads, writes, io_ms in self.record.iter_unpack(view):
+					if (wanted is None or index in wanted) and index < len(names):
+						yield HistorySample(timestamp, names[index], sectors_read, sectors_written, reads, writes, io_ms)
+			finally:
+				view.release()
+
+	def close(self):
+		if self.writable:
+			self.map.flush()
+		self.map.close()
+		if self.lock_fd is not None:
+			os.close(self.lock_fd)
+			self.lock_fd = None
+
+def history_rates(samples, step=None):
+	"""Aggregate HistorySamples into one DeviceRecord per device (per step seconds with step).
+
+	Rates come from consecutive samples of a device; a pair belongs to the step
+	its later sample falls in. READ / WRITE, the IOPS and UTIL% are averages
+	over the pairs, READ_MAX / WRITE_MAX the fastest pair. FROM / TO bound the
+	time covered and SAMPLES counts the pairs. Pairs across a counter reset are
+	skipped.
+
+	>>> samples = [HistorySample(t, '/dev/sda', 8 * t * t, 0, t, 0, 500 * t) for t in (0, 1, 2)]
+	>>> [(r.NAME, r.FROM, r.TO, r.SAMPLES, r.READ, r.READ_MAX, r.R_IOPS, r.UTIL_PCT) for r in history_rates(samples)]
+	[('/dev/sda', 0, 2, 2, 8192.0, 12288.0, 1.0, 50.0)]
+	>>> [(r.FROM, r.TO, r.READ) for r in history_rates(samples, step=2)]
+	[(0, 1, 4096.0), (1, 2, 12288.0)]
+	"""
+	previous = {}
+	totals = {}
+	for sample in samples:
+		last = previous.get(sample.device)
+		previous[sample.device] = sample
+		if last is None:
+			continue
+		elapsed = sample.time - last.time
+		sectors_read = sample.sectors_read - last.sectors_read
+		sectors_written = sample.sectors_written - last.sectors_written
+		reads = sample.reads - last.reads
+		writes = sample.writes - last.writes
+		io_ms = sample.io_ms - last.io_ms
+		if elapsed <= 0 or min(sectors_read, sectors_written, reads, writes, io_ms) < 0:
+			continue
+		key = (math.floor(sample.time / step) * step if step else 0, sample.device)
+		total = totals.get(key)
+		if total is None:
+			# from, to, seconds, sectors read / written, reads, writes, busy ms, fastest read / write pair, pairs
+			total = totals[key] = [last.time, 0, 0.0, 0, 0, 0, 0, 0, 0.0, 0.0, 0]
+		total[1] = sample.time
+		total[2] += elapsed
+		total[3] += sectors_read
+		total[4] += sectors_written
+		total[5] += reads
+		total[6] += writes
+		total[7] += io_ms
+		total[8] = max(total[8], sectors_read * STAT_SECTOR_SIZE / elapsed)
+		total[9] = max(total[9], sectors_written * STAT_SECTOR_SIZE / elapsed)
+		total[10] += 1
+	records = []
+	for (_, device), (start, end, elapsed, sectors_read, sectors_written, reads, writes, io_ms, read_max, write_max, pairs) in sorted(totals.items()):
+		record = DeviceRecord(NAME=device, READ=sectors_read * STAT_SECTOR_SIZE / elapsed, WRITE=sectors_written * STAT_SECTOR_SIZE / elapsed,
+			READ_MAX=read_max, WRITE_MAX=write_max, R_IOPS=reads / elapsed, W_IOPS=writes / elapsed,
+			UTIL_PCT=min(100.0, io_ms / (elapsed * 10.0)), extra={'FROM': start, 'TO': end, 'SAMPLES': pairs})
+		records.append(record)
+	return records
+
+def format_history_time(timestamp):
+	return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+def history_rows(records, print_bytes=False, use_1024=False, full=False):
+	"""Format history_rates() records as table rows, header first."""
+	rows = [list(HISTORY_OUTPUT_FIELDS)]
+	for record in records:
+		rows.append([format_history_time(record.FROM), format_history_time(record.TO)]
+			+ format_record(record, HISTORY_OUTPUT_FIELDS[2:], print_bytes=print_bytes, use_1024=use_1024, full=full))
+	return rows
+
+HISTORY_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_duration(value):
+	"""Seconds in a duration such as 90, 30s, 5m, 2h, 1d or 1w.
+
+	>>> parse_duration('5m'), parse_duration('90'), parse_duration('1.5h')
+	(300.0, 90.0, 5400.0)
+	"""
+	match = re.fullmatch(r'(\d+(?:\.\d*)?)\s*([smhdw]?)', value.strip())
+	if not match:
+		raise ValueError(f'not a duration: {value!r}')
+	return float(match.group(1)) * HISTORY_UNITS[match.group(2) or 's']
+
+def parse_history_time(value, now=None):
+	"""Wall clock seconds for --since / --until.
+
+	Accepts epoch seconds, a duration ago (2h, -30m), HH:MM[:SS] (the last
+	time the clock showed it) and YYYY-MM-DD[ HH:MM[:SS]] in local time.
+
+	>>> parse_history_time('2h', now=10000.0), parse_history_time('-30m', now=10000.0), parse_history_time('1700000000')
+	(2800.0, 8200.0, 1700000000.0)
+	"""
+	import datetime
+	value = value.strip()
+	if now is None:
+		now = time.time()
+	if re.fullmatch(r'\d{9,}(\.\d*)?', value):
+		return float(value)
+	if re.fullmatch(r'-?\d+(\.\d*)?\s*[smhdw]?', value):
+		return now - parse_duration(value.lstrip('-'))
+	clock = re.fullmatch(r'(\d{1,2}):(\d{2})(?::(\d{2}))?', value)
+	if clock:
+		today = datetime.datetime.fromtimestamp(now)
+		moment = today.replace(hour=int(clock.group(1)), minute=int(clock.group(2)), second=int(clock.group(3) or 0), microsecond=0)
+		if moment > today:
+			moment -= datetime.timedelta(days=1)
+		return time.mktime(moment.timetuple())
+	for layout in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+		try:
+			return time.mktime(datetime.datetime.strptime(value, layout).timetuple())
+		except ValueError:
+			pass
+	raise ValueError(f'not a time: {value!r}')
+
+def query_history(path, since=None, until=None, step=None, filter_patterns=None, invert_match=False):
+	"""history_rates() of the samples in a history file between since and until.
+
+	filter_patterns select devices by name before any record is decoded.
+	"""
+	store = HistoryStore(path)
+	try:
+		devices = None
+		if filter_patterns:
+			pattern = compile_filter_pattern(filter_patterns)
+			devices = [device for device in store.devices if bool(pattern.search(device.replace('/dev/', ''))) != invert_match]
+		return history_rates(store.samples(since=since, until=until, devices=devices), step=step)
+	finally:
+		store.close()
+
+TOP_INTERVAL = 1.0
+TOP_SORT_KEYS = {'r': 'READ', 'w': 'WRITE', 'f': 'FSUSE%', 'n': 'NAME'}
+# 'l' steps through these
+TOP_LATENCY_FIELDS = ('R_AWAIT', 'W_AWAIT', 'AQU-SZ', 'UTIL%')
+TOP_HELP = "q quit  r/w/f/l/n sort (again: reverse)  </> sort column  / filter  c toggle columns  e iostat columns  +/- interval  arrows/PgUp/PgDn scroll"
+
+def changed_spans(old, new, gap=3):
+	"""(column, text) spans of new that differ from old; spans less than gap apart are merged.
+
+	>>> changed_spans('sda   10 MB/s  2%', 'sda   12 MB/s  3%')
+	[(7, '2'), (15, '3')]
+	>>> changed_spans('ab', 'abcd'), changed_spans('abcd', 'ab'), changed_spans('x', 'x')
+	([(2, 'cd')], [(2, '  ')], [])
+	"""
+	width = max(len(old), len(new))
+	old = old.ljust(width)
+	new = new.ljust(width)
+	spans = []
+	start = last = None
+	for column in range(width):
+		if old[column] != new[column]:
+			if start is None:
+				start = column
+			elif column - last > gap:
+				spans.append((start, new[start:last + 1]))
+				start = column
+			last = column
+	if start is not None:
+		spans.append((start, new[start:last + 1]))
+	return spans
+
+class ScreenPainter:
+	"""Write a frame of lines to a curses window, touching only the cells that changed since the last one.
+
+	>>> class FakeWindow:
+	...     def __init__(self): self.calls = []
+	...     def addstr(self, row, column, text, attr=0): self.calls.append((row, column, text))
+	>>> painter = ScreenPainter(FakeWindow())
+	>>> painter.paint(['sda  10', 'sdb  20'])
+	14
+	>>> painter.window.calls = []
+	>>> painter.paint(['sda  10', 'sdb  25']), painter.window.calls
+	(1, [(1, 6, '5')])
+	"""
+	def __init__(self, window):
+		self.window = window
+		self.lines = []
+		self.attrs = []
+
+	def invalidate(self):
+		"""Forget the last frame (after a resize or clear) so the next paint writes everything."""
+		self.lines = []
+		self.attrs = []
+
+	def paint(self, lines, attrs=None):
+		"""Paint lines (attrs: one curses attribute per line); returns the number of cells written."""
+		if attrs is None:
+			attrs = [0] * len(lines)
+		written = 0
+		for row, line in enumerate(lines):
+			if row < len(self.lines) and self.attrs[row] == attrs[row]:
+				if self.lines[row] == line:
 					continue
-				device_properties['FSUSE%'] = f"{int(round(100.0 * used_bytes / size_bytes))}%" if size_bytes > 0 else "N/A"
-				if print_bytes:
-					device_properties['SIZE'] = str(size_bytes)
+				spans = changed_spans(self.lines[row], line)
+			else:
+				spans = [(0, line)]
+			for column, text in spans:
+				try:
+					self.window.addstr(row, column, text, attrs[row])
+				except Exception:
+					# curses refuses the bottom-right cell after writing it
+					pass
+				written += len(text)
+		self.lines = list(lines)
+		self.attrs = list(attrs)
+		return written
+
+class TopView:
+	"""Columns, sort order, filter and scroll position of the --top screen, kept apart from curses.
+
+	Keys are the characters typed or curses key names ('KEY_DOWN'). Sorting,
+	filtering and scrolling work on the last snapshot; handle_key() returns
+	'refresh' when new columns need a collection and 'quit' to leave.
+
+	>>> view = TopView(['NAME', 'READ'], sort_field='READ', print_bytes=True)
+	>>> view.set_records([DeviceRecord(NAME='/dev/sda', READ=10), DeviceRecord(NAME='/dev/sdb', READ=300), DeviceRecord(NAME='/dev/sdc')])
+	>>> [line.rstrip() for line in view.frame(40, 5)[0][1:]]
+	['NAME  READ*', 'sdb     300', 'sda      10', 'sdc']
+	>>> view.handle_key('r'), [line.split()[0] for line in view.frame(40, 5)[0][2:]]
+	(None, ['sda', 'sdb', 'sdc'])
+	>>> for key in '/sd[ab]\\n':
+	...     _ = view.handle_key(key)
+	>>> [line.split()[0] for line in view.frame(40, 5)[0][2:] if line.strip()]
+	['sda', 'sdb']
+	>>> for key in '/sd[\\n':
+	...     _ = view.handle_key(key)
+	>>> [line.split()[0] for line in view.frame(40, 5)[0][2:] if line.strip()]
+	[]
+	>>> [view.handle_key(key) for key in 'cw_a\\n'], view.output_fields
+	([None, None, None, None, 'refresh'], ['NAME', 'READ', 'W_AWAIT'])
+	"""
+	def __init__(self, output_fields, sort_field='READ', descending=True, filter_patterns=None, interval=TOP_INTERVAL,
+			print_bytes=False, use_1024=False, full=False):
+		self.output_fields = list(output_fields)
+		self.sort_field = sort_field
+		self.descending = descending
+		self.filter_patterns = list(filter_patterns or [])
+		self.interval = interval
+		self.print_bytes = print_bytes
+		self.use_1024 = use_1024
+		self.full = full
+		self.records = []
+		self.elapsed = None
+		self.updated = None
+		self.offset = 0
+		self.prompt = None
+		self.prompt_text = ''
+		self.show_help = False
+		self.widths = {}
+		self.rows = None
+
+	def fields_to_collect(self):
+		return list(dict.fromkeys(self.output_fields + [self.sort_field]))
+
+	def set_records(self, records, elapsed=None):
+		self.records = records
+		self.elapsed = elapsed
+		self.updated = time.time()
+		self.rows = None
+
+	def _pattern(self):
+		if not self.filter_patterns:
+			return None
+		# not compile_filter_pattern, which exits on a bad regex; a typo at the prompt matches literally
+		try:
+			return re.compile('|'.join(self.filter_patterns))
+		except re.error:
+			return re.compile('|'.join(re.escape(pattern) for pattern in self.filter_patterns))
+
+	def _sorted_rows(self):
+		"""Formatted rows of the snapshot, filtered and sorted; missing values always sort last."""
+		if self.rows is not None:
+			return self.rows
+		attr = field_attr(self.sort_field)
+		provider = COLUMN_PROVIDERS.get(self.sort_field)
+		text = provider is None or provider.text
+		present = []
+		missing = []
+		for record in self.records:
+			value = getattr(record, attr, None)
+			if value is None or value == '' or (not text and isinstance(value, str)):
+				missing.append(record)
+			else:
+				present.append((str(value) if text else value, record))
+		present.sort(key=lambda item: item[0], reverse=self.descending)
+		pattern = self._pattern()
+		rows = []
+		for record in [record for _, record in present] + missing:
+			row = format_record(record, self.output_fields, print_bytes=self.print_bytes, use_1024=self.use_1024, full=self.full)
+			if pattern is None or any(pattern.search(cell) for cell in row):
+				rows.append(row)
+		self.rows = rows
+		return rows
+
+	def _set_sort(self, field):
+		if field == self.sort_field:
+			self.descending = not self.descending
+		else:
+			self.sort_field = field
+			self.descending = field != 'NAME'
+		self.rows = None
+		if field not in self.output_fields:
+			self.output_fields.append(field)
+			self.widths = {}
+			return 'refresh'
+		return None
+
+	def _toggle_fields(self, fields):
+		added = False
+		for field in fields:
+			if field in self.output_fields and len(self.output_fields) > 1:
+				self.output_fields.remove(field)
+			elif field in COLUMN_PROVIDERS and field not in self.output_fields:
+				self.output_fields.append(field)
+				added = True
+		if self.sort_field not in self.output_fields:
+			self.sort_field = self.output_fields[0]
+		self.widths = {}
+		self.rows = None
+		return 'refresh' if added else None
+
+	def handle_key(self, key):
+		if self.prompt is not None:
+			return self._prompt_key(key)
+		if key == 'q':
+			return 'quit'
+		if key in TOP_SORT_KEYS:
+			return self._set_sort(TOP_SORT_KEYS[key])
+		if key == 'l':
+			next_index = TOP_LATENCY_FIELDS.index(self.sort_field) + 1 if self.sort_field in TOP_LATENCY_FIELDS else 0
+			return self._set_sort(TOP_LATENCY_FIELDS[next_index % len(TOP_LATENCY_FIELDS)])
+		if key in ('<', '>') and self.sort_field in self.output_fields:
+			index = self.output_fields.index(self.sort_field) + (1 if key == '>' else -1)
+			return self._set_sort(self.output_fields[index % len(self.output_fields)])
+		if key in ('/', 'c'):
+			self.prompt = key
+			self.prompt_text = ','.join(self.filter_patterns) if key == '/' else ''
+			return None
+		if key == 'e':
+			missing = [field for field in IOSTAT_OUTPUT_FIELDS if field not in self.output_fields]
+			return self._toggle_fields(missing or IOSTAT_OUTPUT_FIELDS)
+		if key in ('+', '-'):
+			self.interval = min(60.0, self.interval * 2) if key == '+' else max(0.1, self.interval / 2)
+			return 'refresh'
+		if key in ('?', 'h'):
+			self.show_help = not self.show_help
+			return None
+		if key == ' ':
+			return 'refresh'
+		page = 10
+		moves = {'KEY_DOWN': 1, 'j': 1, 'KEY_UP': -1, 'k': -1, 'KEY_NPAGE': page, 'KEY_PPAGE': -page, 'KEY_HOME': -10 ** 9, 'KEY_END': 10 ** 9}
+		if key in moves:
+			self.offset = max(0, self.offset + moves[key])
+		return None
+
+	def _prompt_key(self, key):
+		if key in ('\n', '\r', 'KEY_ENTER'):
+			prompt, text = self.prompt, self.prompt_text.strip()
+			self.prompt = None
+			if prompt == '/':
+				self.filter_patterns = [text] if text else []
+				self.offset = 0
+				self.rows = None
+				return None
+			wanted = []
+			for name in text.replace(' ', ',').split(','):
+				name = name.strip().upper()
+				# an exact name or an unambiguous prefix ('w_a' for W_AWAIT, but not 'w')
+				matches = [field for field in ALL_OUTPUT_FIELDS if field == name] or [field for field in ALL_OUTPUT_FIELDS if field.startswith(name)]
+				if name and len(matches) == 1:
+					wanted.append(matches[0])
+			return self._toggle_fields(wanted)
+		if key == '\x1b':
+			self.prompt = None
+		elif key in ('KEY_BACKSPACE', '\x7f', '\b'):
+			self.prompt_text = self.prompt_text[:-1]
+		elif len(key) == 1 and key.isprintable():
+			self.prompt_text += key
+		return None
+
+	def _status(self, shown):
+		if self.prompt == '/':
+			return f"filter (regex, Enter to apply, Esc to cancel): {self.prompt_text}_"
+		if self.prompt == 'c':
+			return f"toggle columns (comma-separated, e.g. util%,r_await): {self.prompt_text}_"
+		if self.show_help:
+			return TOP_HELP
+		stamp = time.strftime('%H:%M:%S', time.localtime(self.updated)) if self.updated else '--:--:--'
+		collected = f"{self.elapsed * 1000:.0f} ms" if self.elapsed is not None else '-'
+		return (f"statblk {stamp}  {shown}/{len(self.records)} rows  sort {self.sort_field} {'desc' if self.descending else 'asc'}"
+			f"  filter {','.join(self.filter_patterns) or '-'}  every {self.interval:g} s  collect {collected}  ? help")
+
+	def frame(self, width, height):
+		"""(lines, kinds) filling a width x height screen: status, header, then the visible rows.
+
+		kinds name each line's role ('status', 'header' or 'row') for the attribute it is drawn with.
+		"""
+		rows = self._sorted_rows()
+		for index, field in enumerate(self.output_fields):
+			# widths only grow while the columns stay the same, so cells do not shift between ticks
+			self.widths[field] = max([self.widths.get(field, 0), len(field) + 1] + [len(row[index]) for row in rows])
+		body_height = max(0, height - 2)
+		self.offset = max(0, min(self.offset, len(rows) - body_height))
+		text_fields = [COLUMN_PROVIDERS[field].text if field in COLUMN_PROVIDERS else True for field in self.output_fields]
+		def _line(cells):
+			parts = []
+			for cell, field, text in zip(cells, self.output_fields, text_fields):
+				width_ = self.widths[field]
+				parts.append(cell.ljust(width_) if text else cell.rjust(width_))
+			return ' '.join(parts)
+		header = [field + ('*' if field == self.sort_field else '') for field in self.output_fields]
+		lines = [self._status(len(rows)), _line(header)]
+		lines += [_line(row) for row in rows[self.offset:self.offset + body_height]]
+		lines += [''] * (height - len(lines))
+		kinds = ['status', 'header'] + ['row'] * (len(lines) - 2)
+		return [line[:width].ljust(width) for line in lines[:height]], kinds[:height]
+
+
+CAPTURE_FORMAT = 1
+CAPTURE_SYSFS_FILES = ('dev', 'size', 'stat', 'partition', 'removable', 'ro', 'dm/name', 'dm/uuid',
+	'queue/hw_sector_size', 'queue/logical_block_size', 'queue/physical_block_size', 'queue/discard_max_bytes',
+	'queue/rotational', 'queue/scheduler', 'queue/nr_requests', 'queue/read_ahead_kb')
+CAPTURE_DEVICE_FILES = ('model', 'serial', 'wwid', 'vendor')
+CAPTURE_LINK_DIRS = ('/dev/disk/by-uuid', '/dev/disk/by-label', '/dev/mapper')
+CAPTURE_SECONDS = 3.0
+CAPTURE_INTERVAL = 0.5
+
+class SnapshotWriter:
+	"""Files and symlinks of a capture archive keyed by host path, read through the root prefix."""
+	def __init__(self):
+		self.entries = {}
+
+	def add_file(self, path, data):
+		self.entries[path] = ('file', data)
+
+	def copy_file(self, path):
+		try:
+			with open(host_path(path), 'rb') as f:
+				# sysfs reports 4096 for every attribute, so the size comes from the read
+				self.add_file(path, f.read())
+			return True
+		except Exception:
+			return False
+
+	def copy_link(self, path):
+		try:
+			target = os.readlink(host_path(path))
+		except Exception:
+			return False
+		if os.path.isabs(target):
+			target = os.path.relpath(target, os.path.dirname(path))
+		self.entries[path] = ('link', target)
+		return True
+
+	def write(self, archive_path, mtime=None):
+		import io
+		import tarfile
+		mtime = time.time() if mtime is None else mtime
+		with tarfile.open(archive_path, 'w:xz') as archive:
+			for path in sorted(self.entries):
+				kind, payload = self.entries[path]
+				info = tarfile.TarInfo(path.lstrip('/'))
+				info.mtime = mtime
+				if kind == 'link':
+					info.type = tarfile.SYMTYPE
+					info.linkname = payload
+					archive.addfile(info)
 				else:
-					device_properties['SIZE'] = multiCMD.format_bytes(size_bytes, use_1024_bytes=use_1024, to_str=True) + 'B'
-				output_list.append([device_properties[output_field] for output_field in output_fields])
+					info.size = len(payload)
+					info.mode = 0o644
+					archive.addfile(info, io.BytesIO(payload))
+
+def capture_snapshot(archive_path, duration=CAPTURE_SECONDS, interval=CAPTURE_INTERVAL, timeout=2, statvfs_prober=None):
+	"""Write the block layer of this host (or of the root prefix) to an xz-compressed tar archive.
+
+	The archive holds root/ (sysfs attributes, /proc/diskstats, mountinfo, the
+	by-uuid/by-label/mapper links and udev database entries) and statblk/
+	(manifest, lsblk and smartctl outputs, statvfs results and duration seconds
+	of /proc/diskstats samples taken every interval seconds). Returns the manifest.
+	"""
+	import json
+	import socket
+	snapshot = SnapshotWriter()
+	block_devices = []
+	try:
+		entries = sorted(os.listdir(host_path('/sys/class/block')))
+	except Exception as e:
+		debug_exc('capture /sys/class/block', e)
+		entries = []
+	for entry in entries:
+		class_path = f'/sys/class/block/{entry}'
+		if snapshot.copy_link(class_path):
+			sysfs_dir = strip_root(os.path.realpath(host_path(class_path)))
 		else:
-			if formated_only and device_name not in fstype_dict:
-				continue
-			device_properties['FSTYPE'] = fstype_dict.get(device_name, '')
-			if IS_DARWIN:
-				size_bytes = size_dict.get(device_name, macos_info.get(device_name, {}).get('SIZE_BYTES', 0))
+			sysfs_dir = class_path
+		for name in CAPTURE_SYSFS_FILES:
+			snapshot.copy_file(f'{sysfs_dir}/{name}')
+		if snapshot.copy_link(f'{sysfs_dir}/device'):
+			device_dir = strip_root(os.path.realpath(host_path(f'{sysfs_dir}/device')))
+			for name in CAPTURE_DEVICE_FILES:
+				snapshot.copy_file(f'{device_dir}/{name}')
+			temp_input = find_hwmon_temp_input(os.path.realpath(host_path(sysfs_dir)))
+			if temp_input:
+				snapshot.copy_file(strip_root(os.path.realpath(temp_input)))
+		for relation in ('slaves', 'holders'):
+			try:
+				for related in os.listdir(host_path(f'{sysfs_dir}/{relation}')):
+					snapshot.copy_link(f'{sysfs_dir}/{relation}/{related}')
+			except Exception:
+				pass
+		devnum = read_text(host_path(f'{sysfs_dir}/dev'))
+		if devnum:
+			snapshot.copy_file(f'{UDEV_DATA_DIR}/b{devnum}')
+		# replay trusts sysfs for device nodes, an empty placeholder is enough
+		snapshot.add_file(f'/dev/{entry}', b'')
+		block_devices.append(f'/dev/{entry}')
+	for link_dir in CAPTURE_LINK_DIRS:
+		try:
+			for entry in os.listdir(host_path(link_dir)):
+				snapshot.copy_link(f'{link_dir}/{entry}')
+		except Exception:
+			pass
+	snapshot.copy_file('/proc/self/mountinfo')
+	commands = {}
+	lsblk_pairs = False
+	if probe_commands_available() and not IS_DARWIN:
+		lsblk_pairs = lsblk_supports_pairs()
+		lsblk_cmd = 'lsblk -b -n -p -o NAME,SIZE,FSTYPE,UUID,LABEL -P' if lsblk_pairs else 'lsblk -brnp -o NAME,SIZE,FSTYPE,UUID,LABEL'
+		tasks = {'lsblk': run_probe_command('lsblk', lsblk_cmd, timeout=timeout)}
+		if smartctl_available():
+			for parent_name in sorted({get_partition_parent_name(device) for device in block_devices} - {None}):
+				key = f'smartctl -H {parent_name}'
+				tasks[key] = run_probe_command(key, f'{SMARTCTL_PATH} -H {parent_name}', timeout=timeout)
+				key = f'smartctl --json -H -A {parent_name}'
+				tasks[key] = run_probe_command(key, f'{SMARTCTL_PATH} --json -H -A {parent_name}', timeout=timeout)
+		for key, task in tasks.items():
+			task.thread.join(timeout)
+			if task.returncode is not None:
+				commands[key] = {'returncode': task.returncode, 'stdout': list(task.stdout)}
+	if statvfs_prober is None:
+		statvfs_prober = StatvfsProber()
+	mountpoints = sorted({entry.MOUNTPOINT for entries in parseMount().values() for entry in entries})
+	statvfs = {mountpoint: list(usage) for mountpoint, usage in statvfs_prober.probe_many(mountpoints).items() if usage is not None}
+	samples = []
+	reader = DiskStatsReader()
+	try:
+		count = int(duration / interval + 1e-9) + 1 if interval > 0 else 1
+		start = time.monotonic()
+		for index in range(count):
+			if index:
+				time.sleep(max(0.0, start + index * interval - time.monotonic()))
+			offset = time.monotonic() - start
+			member = f'/statblk/samples/{index:05d}'
+			snapshot.add_file(member, reader.read_raw())
+			samples.append([round(offset, 6), member.lstrip('/')])
+	except Exception as e:
+		debug_exc('capture diskstats', e)
+	finally:
+		reader.close()
+	if samples:
+		snapshot.add_file('/proc/diskstats', snapshot.entries['/' + samples[0][1]][1])
+	else:
+		snapshot.copy_file('/proc/diskstats')
+	manifest = {
+		'format': CAPTURE_FORMAT,
+		'version': version,
+		'host': socket.gethostname(),
+		'time': time.time(),
+		'platform': sys.platform,
+		'lsblk_pairs': lsblk_pairs,
+		'samples': samples,
+	}
+	# host tree under root/, capture metadata under statblk/
+	snapshot.entries = {('/root' + path if not path.startswith('/statblk/') else path): value for path, value in snapshot.entries.items()}
+	snapshot.add_file('/statblk/manifest.json', json.dumps(manifest, indent=1).encode())
+	snapshot.add_file('/statblk/commands.json', json.dumps(commands).encode())
+	snapshot.add_file('/statblk/statvfs.json', json.dumps(statvfs).encode())
+	snapshot.write(archive_path, mtime=manifest['time'])
+	return manifest
+
+def check_snapshot_members(members):
+	"""Reject archive members that would land (or link) outside the extraction directory."""
+	links = set()
+	for member in members:
+		name = os.path.normpath(member.name)
+		if os.path.isabs(name) or name == '..' or name.startswith('..' + os.path.sep):
+			raise ValueError(f'unsafe path in capture archive: {member.name}')
+		if not (member.isfile() or member.isdir() or member.issym()):
+			raise ValueError(f'unsupported member in capture archive: {member.name}')
+		parent = os.path.dirname(name)
+		while parent:
+			if parent in links:
+				raise ValueError(f'capture archive member below a symlink: {member.name}')
+			parent = os.path.dirname(parent)
+		if member.issym():
+			target = os.path.normpath(os.path.join(os.path.dirname(name), member.linkname))
+			if os.path.isabs(member.linkname) or target == '..' or target.startswith('..' + os.path.sep):
+				raise ValueError(f'capture archive link escapes the archive: {member.name}')
+			links.add(name)
+
+class CapturedCommand:
+	"""Finished stand-in for a multiCMD task, replaying a captured command output."""
+	def __init__(self, returncode=None, stdout=()):
+		self.returncode = returncode
+		self.stdout = list(stdout)
+		self.stderr = []
+		self.thread = self
+
+	def join(self, timeout=None):
+		pass
+
+class ReplaySession:
+	"""A capture archive extracted to a temporary directory; see start_replay()."""
+	def __init__(self, archive_path):
+		import json
+		import tarfile
+		import tempfile
+		self.tempdir = tempfile.mkdtemp(prefix='statblk-replay-')
+		try:
+			with tarfile.open(archive_path, 'r:*') as archive:
+				members = archive.getmembers()
+				check_snapshot_members(members)
+				if hasattr(tarfile, 'data_filter'):
+					archive.extractall(self.tempdir, members=members, filter='data')
+				else:
+					archive.extractall(self.tempdir, members=members)
+			meta_dir = os.path.join(self.tempdir, 'statblk')
+			with open(os.path.join(meta_dir, 'manifest.json'), 'r') as f:
+				self.manifest = json.load(f)
+			with open(os.path.join(meta_dir, 'commands.json'), 'r') as f:
+				self.commands = json.load(f)
+			with open(os.path.join(meta_dir, 'statvfs.json'), 'r') as f:
+				self.statvfs = {mountpoint: tuple(usage) for mountpoint, usage in json.load(f).items()}
+			self.root = os.path.join(self.tempdir, 'root')
+			self.samples = []
+			for offset, member in self.manifest.get('samples', []):
+				with open(os.path.join(self.tempdir, member), 'rb') as f:
+					self.samples.append((float(offset), f.read()))
+			if not self.samples:
+				with open(os.path.join(self.root, 'proc', 'diskstats'), 'rb') as f:
+					self.samples.append((0.0, f.read()))
+		except Exception:
+			shutil.rmtree(self.tempdir, ignore_errors=True)
+			raise
+		self.lsblk_pairs = bool(self.manifest.get('lsblk_pairs'))
+		self.has_smart = any(key.startswith('smartctl ') for key in self.commands)
+		self.has_smart_json = any(key.startswith('smartctl --json ') for key in self.commands)
+		self.position = 0
+
+	def command(self, key):
+		return CapturedCommand(**self.commands.get(key, {}))
+
+	def clock(self):
+		return self.samples[self.position][0]
+
+	def read_diskstats(self):
+		return parse_diskstats(self.samples[self.position][1])
+
+	def advance(self):
+		"""Step to the next counter sample; returns the captured gap in seconds, None at the end."""
+		if self.position + 1 >= len(self.samples):
+			return None
+		self.position += 1
+		return self.samples[self.position][0] - self.samples[self.position - 1][0]
+
+	def close(self):
+		shutil.rmtree(self.tempdir, ignore_errors=True)
+
+def start_replay(archive_path):
+	"""Serve probes from a capture_snapshot() archive until stop_replay()."""
+	global _REPLAY
+	stop_replay()
+	session = ReplaySession(archive_path)
+	set_root(session.root)
+	_REPLAY = session
+	return session
+
+def stop_replay():
+	global _REPLAY
+	session = _REPLAY
+	if session is None:
+		return
+	_REPLAY = None
+	set_root('')
+	session.close()
+
+def run_history_query(args):
+	"""--query: rates and peaks per device from the --history file."""
+	import json
+	if not args.history:
+		print("--query needs --history FILE", file=sys.stderr)
+		sys.exit(1)
+	try:
+		since = parse_history_time(args.since) if args.since else None
+		until = parse_history_time(args.until) if args.until else None
+		step = parse_duration(args.step) if args.step else None
+		records = query_history(args.history, since=since, until=until, step=step,
+							filter_patterns=args.filter_patterns, invert_match=args.invert_match)
+	except (OSError, ValueError) as e:
+		print(f"Cannot query history file {args.history}: {e}", file=sys.stderr)
+		sys.exit(1)
+	if args.ndjson:
+		for record in records:
+			print(json.dumps(ndjson_object(record, HISTORY_OUTPUT_FIELDS[2:], FROM=record.FROM, TO=record.TO), separators=(',', ':')))
+		sys.stdout.flush()
+		return
+	rows = history_rows(records, print_bytes=args.bytes, use_1024=not args.si, full=args.full)
+	if args.json:
+		print(json.dumps(rows, indent=1), flush=True)
+	else:
+		print(multiCMD.pretty_format_table(rows, full=args.full), flush=True)
+
+def run_fleet(args):
+	"""--hosts: query every host each refresh; NDJSON streams rows as hosts answer."""
+	import json
+	if args.tree:
+		print("--tree is not available with --hosts", file=sys.stderr)
+		sys.exit(1)
+	try:
+		hosts = parse_host_list(args.hosts)
+	except (OSError, ValueError) as e:
+		print(f"Cannot read --hosts: {e}", file=sys.stderr)
+		sys.exit(1)
+	output_fields = resolve_output_fields(args.output, args.exclude, rollup=args.rollup)
+	if not hosts or not output_fields:
+		print("No hosts or no valid output fields specified.", file=sys.stderr)
+		sys.exit(1)
+	remote_args = fleet_remote_args(output_fields, args.filter_patterns, rollup=args.rollup, timeout=args.timeout,
+								**{option: getattr(args, option) for option in FLEET_FLAG_OPTIONS})
+	scheduler = WatchScheduler(args.print_period)
+	while True:
+		scheduler.start_tick()
+		results = []
+		for result in iter_fleet(hosts, remote_args, output_fields, transport=args.transport, remote_command=args.remote_command,
+								parallel=args.parallel, host_timeout=args.host_timeout):
+			if result.error:
+				print(f"{result.host}: {result.error}", file=sys.stderr, flush=True)
+			if args.ndjson:
+				for record in result.records:
+					sys.stdout.write(json.dumps(ndjson_object(record, output_fields, time=time.time(), host=result.host), separators=(',', ':')))
+					sys.stdout.write('\n')
+				sys.stdout.flush()
 			else:
-				size_bytes = size_dict.get(device_name, read_size(os.path.join('/sys/class/block', os.path.basename(device_name))))
-			if size_bytes == 0 and not show_zero_size_devices:
-				continue
-			if print_bytes:
-				device_properties['SIZE'] = str(size_bytes)
+				results.append(result)
+		if not args.ndjson:
+			rows = fleet_rows(results, output_fields, hosts=hosts, print_bytes=args.bytes, use_1024=not args.si, full=args.full)
+			if args.json:
+				print(json.dumps(rows, indent=1), flush=True)
 			else:
-				device_properties['SIZE'] = multiCMD.format_bytes(size_bytes, use_1024_bytes=use_1024, to_str=True) + 'B'
-			output_list.append([device_properties[output_field] for output_field in output_fields])
-		multiCMD.join_threads(timeout=timeout)
-	if not match_devname_only:
-		if filter_patterns:
-			pattern = compile_filter_pattern(filter_patterns)
-			filtered_output_list = [output_list[0]]  # include header
-			for row in output_list[1:]:
-				match = any(pattern.search(field) for field in row)
-				if (match and not invert_match) or (not match and invert_match):
-					filtered_output_list.append(row)
-			output_list = filtered_output_list
-		elif invert_match:
-			# if no patterns but invert_match is set, return only header
-			output_list = [output_list[0]]
-	return output_list
+				print(multiCMD.pretty_format_table(rows, full=args.full), flush=True)
+		if args.print_period <= 0:
+			break
+		scheduler.finish_tick()
+		try:
+			time.sleep(scheduler.remaining())
+		except KeyboardInterrupt:
+			break
 
+def run_top(args, history=None):
+	"""--top: full-screen view redrawn in place; a collector thread samples while keys act on the last snapshot."""
+	import curses
+	if args.tree or args.rollup or args.json or args.ndjson:
+		print("--top cannot be combined with --tree, --rollup, --json or --ndjson", file=sys.stderr)
+		sys.exit(1)
+	if not (sys.stdin.isatty() and sys.stdout.isatty()):
+		print("--top needs a terminal", file=sys.stderr)
+		sys.exit(1)
+	output_fields = resolve_output_fields(args.output, args.exclude)
+	if not output_fields:
+		print("No valid output fields specified.", file=sys.stderr)
+		sys.exit(1)
+	sort_field = args.sort.upper()
+	if sort_field not in COLUMN_PROVIDERS:
+		print(f"Unknown --sort column {args.sort}; available: {','.join(ALL_OUTPUT_FIELDS)}", file=sys.stderr)
+		sys.exit(1)
+	view = TopView(output_fields, sort_field=sort_field, filter_patterns=args.filter_patterns,
+				interval=args.print_period or TOP_INTERVAL, print_bytes=args.bytes, use_1024=not args.si, full=args.full)
+	enable_uevent_monitor()
+	if args.sample_interval > 0:
+		start_high_frequency_sampler(args.sample_interval, view.interval)
+	lock = threading.Lock()
+	wake = threading.Event()
+	stop = threading.Event()
+	snapshot = []
+	def _collector():
+		tptDict = {}
+		while not stop.is_set():
+			started = time.monotonic()
+			try:
+				records = list(collect(mounted_only=args.mounted_only, best_only=args.best_only,
+							formated_only=args.formated_only, show_zero_size_devices=args.show_zero_size_devices,
+							pseudo=args.pseudo, tptDict=tptDict, active_only=args.active_only,
+							output_fields=view.fields_to_collect(), filter_patterns=args.filter_patterns if args.match_devname_only else None,
+							invert_match=args.invert_match, match_devname_only=args.match_devname_only,
+							timeout=args.timeout, full=args.full))
+				if history is not None:
+					history.append(read_block_stats(()))
+			except Exception as e:
+				debug_exc('top collection', e)
+				records = None
+			elapsed = time.monotonic() - started
+			if records is not None:
+				with lock:
+					snapshot[:] = [(records, elapsed)]
+			wake.wait(max(0.0, view.interval - elapsed))
+			wake.clear()
+	def _screen(screen):
+		try:
+			curses.curs_set(0)
+		except curses.error:
+			pass
+		screen.timeout(50)
+		attrs = {'status': curses.A_REVERSE, 'header': curses.A_BOLD, 'row': curses.A_NORMAL}
+		painter = ScreenPainter(screen)
+		dirty = True
+		while True:
+			with lock:
+				fresh = snapshot[:]
+				snapshot[:] = []
+			if fresh:
+				view.set_records(*fresh[0])
+				dirty = True
+			if dirty:
+				height, width = screen.getmaxyx()
+				lines, kinds = view.frame(width, height)
+				painter.paint(lines, [attrs[kind] for kind in kinds])
+				screen.refresh()
+				dirty = False
+			try:
+				key = screen.get_wch()
+			except curses.error:
+				continue
+			if key == curses.KEY_RESIZE:
+				painter.invalidate()
+				screen.clear()
+				dirty = True
+				continue
+			if isinstance(key, int):
+				key = curses.keyname(key).decode('ascii', 'replace')
+			action = view.handle_key(key)
+			if action == 'quit':
+				return
+			if action == 'refresh':
+				wake.set()
+			dirty = True
+	collector = threading.Thread(target=_collector, name='statblk-top', daemon=True)
+	collector.start()
+	try:
+		curses.wrapper(_screen)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		stop.set()
+		wake.set()
 
 def main():
+	import argparse
+	save_multicmd_cache()
 	parser = argparse.ArgumentParser(description="Gather disk and partition info for block devices.")
 	parser.add_argument('-j','--json', help="Produce JSON output", action="store_true")
+	parser.add_argument('--ndjson', help="Stream one compact JSON object per row with raw values, timestamp and hostname (flushed every refresh)", action="store_true")
 	parser.add_argument('-b','--bytes', help="Print the SIZE column in bytes rather than in a human-readable format", action="store_true")
 	parser.add_argument('-H','--si', help="Use powers of 1000 not 1024 for SIZE column", action="store_true")
 	parser.add_argument('-F','-fo','--formated_only', help="Show only formated filesystems", action="store_true")
@@ -854,51 +4782,238 @@ def main():
 	parser.add_argument('-A','-ao','--active_only', help="Show only active devices (positive read/write activity)", action="store_true")
 	parser.add_argument('-R','--full', help="Show full device information, do not collapse drive info when length > console length", action="store_true")
 	parser.add_argument('-P','--pseudo', help="Include pseudo file systems as well (tmpfs / nfs / cifs etc.)", action="store_true")
-	parser.add_argument('-o','--output', help="Specify which output columns to print.Use comma to separate columns. default: all available", default="all", type=str)
+	parser.add_argument('-o','--output', help=f"Specify which output columns to print.Use comma to separate columns, 'all' for every column. Available: {','.join(ALL_OUTPUT_FIELDS)}. default: {','.join(DEFAULT_OUTPUT_FIELDS)}".replace('%', '%%'), default="default", type=str)
 	parser.add_argument('-x','--exclude', help="Specify which output columns to exclude.Use comma to separate columns. default: none", default="", type=str)
 	parser.add_argument('-t','--timeout', help="Set command timeout in seconds (default: 2)", default=2, type=int)
 	parser.add_argument('--sudo', help="Run commands as root with sudo. Needed for querying SMART info.", action="store_true")
+	parser.add_argument('--statvfs_timeout', help=f"Per-mount deadline in seconds for filesystem usage queries; slower mounts show TIMEOUT (default: {STATVFS_DEADLINE:g})", default=STATVFS_DEADLINE, type=float)
+	parser.add_argument('--smart_ttl', help=f"Reuse SMART results for this many seconds (default: {SMART_CACHE_TTL}, 0 to disable)", default=SMART_CACHE_TTL, type=int)
+	parser.add_argument('--smart_cache', help="Persist SMART results in this file so one-shot runs can reuse them", default=None, type=str)
 	parser.add_argument('--show_zero_size_devices', help="Show devices with zero size", action="store_true")
+	parser.add_argument('-T','--tree', help="Show devices as a tree: partitions under their disk, dm / md / LVM devices under the devices they are built on", action="store_true")
+	parser.add_argument('--rollup', help="One row per physical disk ('disk', with the volumes on it in HOLDERS) or per topmost dm / md volume ('lv', with its disks and their summed throughput)", choices=['disk', 'lv'], default=None)
 	parser.add_argument('-D','--match_devname_only', help="Change filter pattern to match just the device names instead of the full line", action="store_true")
 	parser.add_argument('-v','--invert_match', help="Invert the filter match", action="store_true")
+	parser.add_argument('--profile', help="Print per-phase wall time, call counts and the slowest devices/mounts of every refresh to stderr (with running percentiles in watch mode)", action="store_true")
+	parser.add_argument('--profile_format', help="Format of the --profile report on stderr (default: text)", choices=['text', 'json'], default='text')
 	parser.add_argument('--debug', help="Print suppressed exceptions to stderr for troubleshooting", action="store_true")
+	parser.add_argument('--root', help="Read /sys, /proc, /dev and /run below this directory instead of the live system (e.g. a tree from tests/fake_tree.py)", default='', type=str)
+	parser.add_argument('--capture', metavar='FILE', help="Write sysfs/proc/udev state, probe command outputs and counter samples to a .tar.xz archive for offline analysis, then exit", default=None, type=str)
+	parser.add_argument('--capture_seconds', help=f"Seconds of /proc/diskstats samples to record with --capture (default: {CAPTURE_SECONDS:g})", default=CAPTURE_SECONDS, type=float)
+	parser.add_argument('--capture_interval', help=f"Seconds between counter samples recorded with --capture (default: {CAPTURE_INTERVAL:g})", default=CAPTURE_INTERVAL, type=float)
+	parser.add_argument('--replay', metavar='FILE', help="Report on a --capture archive instead of the live system, one refresh per recorded counter sample", default=None, type=str)
+	parser.add_argument('--replay_realtime', help="With --replay, wait the recorded time between samples instead of replaying at full speed", action="store_true")
+	parser.add_argument('--serve', metavar='ADDR:PORT', help="Serve Prometheus metrics on http://ADDR:PORT/metrics instead of printing (e.g. :9101)", default=None, type=str)
+	parser.add_argument('--scrape_interval', help=f"Minimum seconds between collections in --serve mode; faster scrapes reuse the last snapshot (default: {SCRAPE_MIN_INTERVAL:g})", default=SCRAPE_MIN_INTERVAL, type=float)
+	parser.add_argument('--cgroups', help=f"Show per-cgroup (container) read / write throughput and IOPS for each device from cgroup v2 io.stat, busiest first; one-shot runs sample for {CGROUP_SAMPLE_SECONDS:g}s", action="store_true")
+	parser.add_argument('--daemon', help=f"Keep sampling in the background and answer --client queries on a Unix socket; print_period sets the sampling interval (default: {DAEMON_INTERVAL:g})", action="store_true")
+	parser.add_argument('--client', help="Ask a running --daemon instead of probing; output and filter options apply as usual", action="store_true")
+	parser.add_argument('--socket', help="Unix socket of --daemon / --client (default: $XDG_RUNTIME_DIR/statblk.sock or /tmp/statblk-UID/statblk.sock)", default=None, type=str)
+	parser.add_argument('--hosts', help="Run on these hosts concurrently and merge their rows with a HOST column: comma-separated, or @FILE with one host per line", default=None, type=str)
+	parser.add_argument('--transport', help=f"Command template reaching a host; {{host}} is the host and {{command}} the statblk command line (default: '{FLEET_TRANSPORT}')", default=FLEET_TRANSPORT, type=str)
+	parser.add_argument('--remote_command', help=f"statblk invocation on the hosts, {{host}} is replaced (default: {FLEET_REMOTE_COMMAND})", default=FLEET_REMOTE_COMMAND, type=str)
+	parser.add_argument('--parallel', help=f"Hosts queried at once with --hosts (default: {FLEET_PARALLEL})", default=FLEET_PARALLEL, type=int)
+	parser.add_argument('--host_timeout', help=f"Seconds each host gets to answer with --hosts (default: {FLEET_HOST_TIMEOUT:g})", default=FLEET_HOST_TIMEOUT, type=float)
+	parser.add_argument('--history', metavar='FILE', help="Append raw per-device counter samples to this fixed-size memory-mapped ring file on every refresh (also in --daemon)", default=None, type=str)
+	parser.add_argument('--history_size', help=f"Samples a new --history file keeps before overwriting the oldest; 56 bytes each (default: {HISTORY_RECORDS})", default=HISTORY_RECORDS, type=int)
+	parser.add_argument('--query', help="Report rates from the --history file instead of sampling; filter patterns select devices", action="store_true")
+	parser.add_argument('--since', help="With --query, start of the time range: epoch seconds, a duration ago (2h), HH:MM or 'YYYY-MM-DD HH:MM' (default: oldest sample)", default=None, type=str)
+	parser.add_argument('--until', help="With --query, end of the time range, same forms as --since (default: newest sample)", default=None, type=str)
+	parser.add_argument('--step', help="With --query, one row per device per interval of this length (e.g. 10m) instead of one for the whole range", default=None, type=str)
+	parser.add_argument('--top', help=f"Full-screen interactive view refreshed in place every print_period seconds (default: {TOP_INTERVAL:g}); sort, filter and toggle columns with keys, press ? for help", action="store_true")
+	parser.add_argument('--sort', help="Initial sort column of --top, largest first (default: READ)", default='READ', type=str)
 	parser.add_argument('filter_patterns', nargs='*', help="Filter pattern(s) to match (e.g., sda, nvme0n1p1, btrfs). If specified, only devices matching any of the patterns will be shown. Will prioritize print_period first thus if wanting to filter a number and do not repeat, append a 0 (zero) at the end.")
-	parser.add_argument('print_period', nargs='?', default=0, type=int, help="If specified as a non zero number, repeat the output every N seconds")
+	parser.add_argument('print_period', nargs='?', default=0, type=float, help="If specified as a non zero number, repeat the output every N seconds (fractions allowed)")
+	parser.add_argument('--sample_interval', help="In watch mode, sample counters every N seconds (e.g. 0.1) and report min/max/avg/p95/p99 throughput per refresh in the READ_* / WRITE_* columns", default=0, type=float)
 	parser.add_argument('-V', '--version', action='version', version=f"%(prog)s {version} @ {COMMIT_DATE} stat drives by pan@zopyr.us")
-	try:
-		import argcomplete
-		argcomplete.autocomplete(parser,always_complete_options='long')
-	except ImportError:
-		pass
+	# argcomplete drives completion through this variable; skip its import on normal runs
+	if '_ARGCOMPLETE' in os.environ:
+		try:
+			import argcomplete
+			argcomplete.autocomplete(parser,always_complete_options='long')
+		except ImportError:
+			pass
 	args = parser.parse_args()
 	global _DEBUG_MODE
+	global _SMART_CACHE
+	global _STATVFS_PROBER
+	global _PROFILER
 	_DEBUG_MODE = args.debug
+	if args.profile:
+		_PROFILER = PhaseProfiler()
+	_SMART_CACHE = SmartCache(ttl=args.smart_ttl, path=args.smart_cache)
+	_STATVFS_PROBER = StatvfsProber(deadline=args.statvfs_timeout)
+	if args.root:
+		set_root(args.root)
 	tptDict = {}
 	if not args.print_period:
 		if args.filter_patterns:
-			try:
-				args.print_period = int(args.filter_patterns[-1])
+			period = parse_period(args.filter_patterns[-1])
+			if period is not None:
+				args.print_period = period
 				args.filter_patterns = args.filter_patterns[:-1]
-			except Exception:
-				pass
 	multiCMD.set_sudo(args.sudo)
+	socket_path = args.socket or default_socket_path()
+	if args.query:
+		run_history_query(args)
+		return
+	history = None
+	if args.history and not (args.client or args.hosts or args.capture or args.serve or args.cgroups):
+		try:
+			history = HistoryStore(args.history, capacity=args.history_size, writable=True)
+		except (OSError, ValueError) as e:
+			print(f"Cannot open history file {args.history}: {e}", file=sys.stderr)
+			sys.exit(1)
+	if args.hosts:
+		run_fleet(args)
+		return
+	if args.top:
+		run_top(args, history=history)
+		return
+	if args.client:
+		request = {option: getattr(args, option) for option in CLIENT_OPTIONS}
+		request['format'] = 'ndjson' if args.ndjson else 'json' if args.json else 'table'
+		scheduler = WatchScheduler(args.print_period)
+		while True:
+			scheduler.start_tick()
+			try:
+				sys.stdout.write(query_daemon(request, socket_path, timeout=max(5.0, args.timeout)))
+				sys.stdout.flush()
+			except (OSError, RuntimeError) as e:
+				print(f"statblk daemon query on {socket_path} failed: {e}", file=sys.stderr)
+				sys.exit(1)
+			if args.print_period <= 0:
+				break
+			scheduler.finish_tick()
+			try:
+				time.sleep(scheduler.remaining())
+			except KeyboardInterrupt:
+				break
+		return
+	if args.capture:
+		manifest = capture_snapshot(args.capture, duration=args.capture_seconds, interval=args.capture_interval,
+							timeout=args.timeout, statvfs_prober=_STATVFS_PROBER)
+		print(f"Captured {len(manifest['samples'])} counter samples from {manifest['host']} to {args.capture}", file=sys.stderr)
+		return
+	if args.replay:
+		import atexit
+		start_replay(args.replay)
+		atexit.register(stop_replay)
+		# results describe the captured drives, never feed them into the persistent cache
+		_SMART_CACHE = SmartCache(ttl=0)
+	if args.serve:
+		enable_uevent_monitor()
+		exporter = MetricsExporter(min_interval=args.scrape_interval,
+							mounted_only=args.mounted_only, best_only=args.best_only,
+							formated_only=args.formated_only, show_zero_size_devices=args.show_zero_size_devices,
+							pseudo=args.pseudo,filter_patterns=args.filter_patterns,invert_match=args.invert_match,
+							match_devname_only=args.match_devname_only,timeout=args.timeout)
+		serve_metrics(args.serve, exporter)
+		return
+	if args.cgroups:
+		scanner = CgroupIOScanner()
+		if not scanner.available():
+			print(f"No cgroup v2 hierarchy at {scanner.root}; per-cgroup I/O needs the unified cgroup mount.", file=sys.stderr)
+			sys.exit(1)
+		scanner.scan()
+		scheduler = WatchScheduler(args.print_period or CGROUP_SAMPLE_SECONDS)
+		try:
+			time.sleep(args.print_period or CGROUP_SAMPLE_SECONDS)
+			while True:
+				scheduler.start_tick()
+				rows = cgroup_io_rows(scanner.scan(), print_bytes=args.bytes, use_1024=not args.si, full=args.full,
+									filter_patterns=args.filter_patterns, invert_match=args.invert_match)
+				if args.json:
+					import json
+					print(json.dumps(rows, indent=1), flush=True)
+				else:
+					print(multiCMD.pretty_format_table(rows, full=args.full), flush=True)
+				if args.print_period <= 0:
+					break
+				scheduler.finish_tick()
+				time.sleep(scheduler.remaining())
+		except KeyboardInterrupt:
+			pass
+		return
+	if args.daemon:
+		enable_uevent_monitor()
+		interval = args.print_period or DAEMON_INTERVAL
+		if args.sample_interval > 0:
+			start_high_frequency_sampler(args.sample_interval, interval)
+		try:
+			serve_daemon(socket_path, StatblkDaemon(interval=interval, timeout=args.timeout, history=history))
+		except OSError as e:
+			print(f"Cannot start statblk daemon: {e}", file=sys.stderr)
+			sys.exit(1)
+		return
+	if args.print_period > 0:
+		enable_uevent_monitor()
+		if args.sample_interval > 0:
+			start_high_frequency_sampler(args.sample_interval, args.print_period)
+			if args.output == "default":
+				args.output = ','.join(DEFAULT_OUTPUT_FIELDS + ['READ_MAX', 'READ_P99', 'WRITE_MAX', 'WRITE_P99'])
+	scheduler = WatchScheduler(args.print_period)
 	while True:
-		results = get_drives_info(print_bytes = args.bytes, use_1024 = not args.si, 
-							mounted_only=args.mounted_only, best_only=args.best_only, 
+		scheduler.start_tick()
+		if _PROFILER is not None:
+			_PROFILER.begin()
+		if args.ndjson:
+			output_fields = resolve_output_fields(args.output, args.exclude, rollup=args.rollup)
+			if not output_fields:
+				print("No valid output fields specified.", file=sys.stderr)
+				break
+			write_ndjson(iter_drives_info(print_bytes = args.bytes, use_1024 = not args.si,
+							mounted_only=args.mounted_only, best_only=args.best_only,
 							formated_only=args.formated_only, show_zero_size_devices=args.show_zero_size_devices,
 							pseudo=args.pseudo,tptDict=tptDict,full=args.full,active_only=args.active_only,
-							output=args.output,exclude=args.exclude,
+							output_fields=output_fields,
 							filter_patterns=args.filter_patterns,invert_match=args.invert_match,match_devname_only=args.match_devname_only,
-							timeout=args.timeout,debug=args.debug,
-							)
-		if args.json:
-			import json
-			print(json.dumps(results, indent=1),flush=True)
+							timeout=args.timeout,rollup=args.rollup,
+							), output_fields)
 		else:
-			print(multiCMD.pretty_format_table(results,full=args.full),flush=True)
-		if args.print_period > 0:
+			results = get_drives_info(print_bytes = args.bytes, use_1024 = not args.si, 
+								mounted_only=args.mounted_only, best_only=args.best_only, 
+								formated_only=args.formated_only, show_zero_size_devices=args.show_zero_size_devices,
+								pseudo=args.pseudo,tptDict=tptDict,full=args.full,active_only=args.active_only,
+								output=args.output,exclude=args.exclude,
+								filter_patterns=args.filter_patterns,invert_match=args.invert_match,match_devname_only=args.match_devname_only,
+								timeout=args.timeout,debug=args.debug,tree=args.tree,rollup=args.rollup,
+								)
+			with profile_phase('render'):
+				if args.json:
+					import json
+					rendered = json.dumps(results, indent=1)
+				else:
+					rendered = multiCMD.pretty_format_table(results,full=args.full)
+			with profile_phase('write'):
+				print(rendered,flush=True)
+		if history is not None:
+			with profile_phase('history'):
+				history.append(read_block_stats(()))
+		if _PROFILER is not None:
+			profile_report = _PROFILER.end()
+			if args.profile_format == 'json':
+				import json
+				print(json.dumps(profile_report), file=sys.stderr, flush=True)
+			else:
+				print(format_profile_report(profile_report), file=sys.stderr, flush=True)
+		if _REPLAY is not None:
+			gap = _REPLAY.advance()
+			if gap is None:
+				break
+			try:
+				if args.replay_realtime:
+					time.sleep(gap)
+				args.active_only = True
+			except KeyboardInterrupt:
+				break
+		elif args.print_period > 0:
+			report = scheduler.finish_tick()
+			# overruns always, every tick only with --profile; stderr keeps the watch output unchanged
+			if report.skipped or args.profile:
+				print(format_tick_report(report, args.print_period), file=sys.stderr, flush=True)
 			try:
-				time.sleep(args.print_period)
+				time.sleep(scheduler.remaining())
 				args.active_only = True
 			except KeyboardInterrupt:
 				break
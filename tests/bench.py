@@ -0,0 +1,142 @@
+"""Scaling and startup benchmarks for statblk.
+
+Run from the repository root::
+
+    python -m tests.bench              # 10, 1000 and 10000 devices
+    python -m tests.bench 50 500       # custom sizes
+    python -m tests.bench startup      # import time against the startup budget
+"""
+import os
+import sys
+import time
+
+import statblk
+from tests.fake_tree import build_fake_tree, fake_tree_layout
+
+def _read_syscall_counters():
+	"""Read/write syscall counts of this process from /proc/self/io (None where unavailable)."""
+	try:
+		with open('/proc/self/io', 'r') as f:
+			values = dict(line.split(':', 1) for line in f if ':' in line)
+		return int(values['syscr']) + int(values['syscw'])
+	except Exception:
+		return None
+
+_BENCH_OPENS = [0]
+
+def _bench_audit_hook(event, args):
+	if event in ('open', 'os.listdir', 'os.scandir'):
+		_BENCH_OPENS[0] += 1
+
+def _measure(func, repeat=1):
+	"""Return (wall seconds, read/write syscalls, opens+listdirs) per call of func()."""
+	syscalls_before = _read_syscall_counters()
+	opens_before = _BENCH_OPENS[0]
+	start_time = time.perf_counter()
+	for _ in range(repeat):
+		func()
+	wall = (time.perf_counter() - start_time) / repeat
+	syscalls_after = _read_syscall_counters()
+	syscalls = (syscalls_after - syscalls_before) // repeat if syscalls_before is not None and syscalls_after is not None else None
+	return wall, syscalls, (_BENCH_OPENS[0] - opens_before) // repeat
+
+def _measure_peak_memory(func):
+	import tracemalloc
+	tracemalloc.start()
+	try:
+		func()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+def run_benchmarks(sizes=(10, 1000, 10000), ticks=5, stream=None):
+	"""Time one-shot and watch-mode collection against synthetic trees of each size.
+
+	Reports wall time, read/write syscalls (from /proc/self/io), file opens and
+	directory listings (from audit hooks, Python 3.8+) and peak Python memory.
+	Returns the result rows (header first).
+	"""
+	import tempfile
+	if stream is None:
+		stream = sys.stdout
+	if hasattr(sys, 'addaudithook') and not _BENCH_OPENS[0]:
+		sys.addaudithook(_bench_audit_hook)
+	kwargs = dict(output='all', show_zero_size_devices=True, timeout=2)
+	results = [['DEVICES', 'MODE', 'WALL_MS', 'SYSCALLS_RW', 'OPENS', 'PEAK_MEM']]
+	previous_root = statblk._ROOT
+	try:
+		for size in sizes:
+			with tempfile.TemporaryDirectory(prefix='statblk-bench-') as root:
+				device_count = len(build_fake_tree(root, **fake_tree_layout(size)))
+				statblk.set_root(root)
+				wall, syscalls, opens = _measure(lambda: statblk.get_drives_info(**kwargs))
+				statblk.set_root(root)
+				peak = _measure_peak_memory(lambda: statblk.get_drives_info(**kwargs))
+				results.append([str(device_count), 'one-shot', f'{wall * 1000:.1f}', str(syscalls), str(opens), statblk.multiCMD.format_bytes(peak, to_str=True) + 'B'])
+				tptDict = {}
+				statblk.get_drives_info(tptDict=tptDict, **kwargs)
+				wall, syscalls, opens = _measure(lambda: statblk.get_drives_info(tptDict=tptDict, **kwargs), repeat=ticks)
+				peak = _measure_peak_memory(lambda: statblk.get_drives_info(tptDict=tptDict, **kwargs))
+				results.append([str(device_count), 'watch tick', f'{wall * 1000:.1f}', str(syscalls), str(opens), statblk.multiCMD.format_bytes(peak, to_str=True) + 'B'])
+				print(statblk.multiCMD.pretty_format_table(results[:1] + results[-2:]), file=stream, flush=True)
+	finally:
+		statblk.set_root(previous_root)
+	return results
+
+STARTUP_BUDGET_MS = 100.0
+
+def _median_run_ms(command, env, runs):
+	import subprocess
+	samples = []
+	for _ in range(runs):
+		start_time = time.perf_counter()
+		subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+		samples.append((time.perf_counter() - start_time) * 1000)
+	samples.sort()
+	return samples[len(samples) // 2]
+
+def run_startup_benchmark(runs=15, budget_ms=STARTUP_BUDGET_MS, stream=None):
+	"""Time `import statblk` and `statblk --version` in fresh interpreters against a startup budget.
+
+	Runs use a private bytecode and ~/.cache directory: "cold" starts with an
+	empty multiCMD bytecode cache, "warm" reuses the one a CLI run saved (root
+	never uses that cache). The budget applies to the warm import time on top
+	of a bare interpreter start. Returns True if within budget.
+	"""
+	import tempfile
+	if stream is None:
+		stream = sys.stdout
+	module_dir = os.path.dirname(os.path.abspath(statblk.__file__))
+	with tempfile.TemporaryDirectory(prefix='statblk-startup-') as tmp:
+		env = dict(os.environ)
+		env.pop('PYTHONDONTWRITEBYTECODE', None)
+		env['PYTHONPYCACHEPREFIX'] = os.path.join(tmp, 'pycache')
+		env['PYTHONPATH'] = module_dir + os.pathsep + env.get('PYTHONPATH', '')
+		import_cmd = [sys.executable, '-c', 'import statblk']
+		cold_samples = []
+		for run in range(max(1, runs // 3)):
+			cold_env = dict(env, XDG_CACHE_HOME=os.path.join(tmp, f'cold{run}'))
+			cold_samples.append(_median_run_ms(import_cmd, cold_env, 1))
+		env['XDG_CACHE_HOME'] = os.path.join(tmp, 'warm')
+		# only CLI runs write the cache; a plain import just reads it
+		_median_run_ms([sys.executable, '-m', 'statblk', '--version'], env, 1)
+		baseline = _median_run_ms([sys.executable, '-c', 'pass'], env, runs)
+		cases = [
+			('python -c pass', baseline),
+			('import (cold cache)', sorted(cold_samples)[len(cold_samples) // 2]),
+			('import', _median_run_ms(import_cmd, env, runs)),
+			('statblk --version', _median_run_ms([sys.executable, '-m', 'statblk', '--version'], env, runs)),
+		]
+	rows = [['CASE', 'MEDIAN_MS', 'OVER_PYTHON_MS']]
+	for name, median in cases:
+		rows.append([name, f'{median:.1f}', f'{median - baseline:.1f}'])
+	within_budget = cases[2][1] - baseline <= budget_ms
+	print(statblk.multiCMD.pretty_format_table(rows), file=stream)
+	print(f"warm import {cases[2][1] - baseline:.1f} ms over interpreter start, budget {budget_ms:g} ms: {'OK' if within_budget else 'OVER BUDGET'}", file=stream, flush=True)
+	return within_budget
+
+
+if __name__ == "__main__":
+	if sys.argv[1:] == ['startup']:
+		sys.exit(0 if run_startup_benchmark() else 1)
+	run_benchmarks([int(x) for x in sys.argv[1:]] or (10, 1000, 10000))
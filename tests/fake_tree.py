@@ -0,0 +1,153 @@
+"""Synthetic /sys, /proc, /dev and /run trees for statblk doctests and benchmarks.
+
+Run from the repository root::
+
+    python -m doctest tests/fake_tree.py -v
+"""
+import os
+
+def _disk_name(index):
+	"""sd-style disk name for a zero-based index.
+
+	>>> _disk_name(0), _disk_name(25), _disk_name(26), _disk_name(701)
+	('sda', 'sdz', 'sdaa', 'sdzz')
+	"""
+	letters = ''
+	index += 1
+	while index:
+		index, rem = divmod(index - 1, 26)
+		letters = chr(ord('a') + rem) + letters
+	return 'sd' + letters
+
+def build_fake_tree(root, disks=4, partitions=2, mounts=None, dm=0, loops=0, cgroups=0):
+	"""Write a synthetic /sys, /proc, /dev and /run tree below root for use with set_root().
+
+	Creates disks with partitions partitions each, dm devices stacked on the
+	first partitions, loop devices, /proc/diskstats and /proc/self/mountinfo
+	(the first mounts partitions are mounted, default: all), by-uuid/by-label
+	links, udev database entries and cgroups idle cgroup v2 pod cgroups under
+	/sys/fs/cgroup/kubepods.slice. Returns the list of device names.
+
+	>>> import tempfile
+	>>> from statblk import get_drives_info, set_root
+	>>> with tempfile.TemporaryDirectory() as tmp:
+	...     names = build_fake_tree(tmp, disks=2, partitions=1, dm=1, loops=1)
+	...     set_root(tmp)
+	...     rows = get_drives_info(output='NAME,FSTYPE,MOUNTPOINT,MODEL,LABEL', show_zero_size_devices=True)
+	...     set_root('')
+	>>> names
+	['sda', 'sda1', 'sdb', 'sdb1', 'dm-0', 'loop0']
+	>>> rows[1:4]
+	[['dm-0', '', '', 'STATBLK FAKE DISK', ''], ['loop0', '', '', '', ''], ['sda', '', '', 'STATBLK FAKE DISK', '']]
+	>>> rows[4]
+	['sda1', 'ext4', '/mnt/sda1', 'STATBLK FAKE DISK', 'fs-sda1']
+	"""
+	def _write(path, content):
+		path = os.path.join(root, path.lstrip('/'))
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(content)
+
+	def _link(path, target):
+		path = os.path.join(root, path.lstrip('/'))
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		os.symlink(os.path.relpath(os.path.join(root, target.lstrip('/')), os.path.dirname(path)), path)
+
+	names = []
+	diskstats = []
+	minor = [0]
+
+	def _block(sysfs_dir, name, sectors, partition=None, fs=True):
+		dev_minor = minor[0]
+		minor[0] += 1
+		counters = ' '.join(str((dev_minor * 7 + i) * 11) for i in range(11))
+		_write(f'{sysfs_dir}/size', f'{sectors}\n')
+		_write(f'{sysfs_dir}/dev', f'259:{dev_minor}\n')
+		_write(f'{sysfs_dir}/stat', f'{counters}\n')
+		if partition is not None:
+			_write(f'{sysfs_dir}/partition', f'{partition}\n')
+		_link(f'/sys/class/block/{name}', sysfs_dir)
+		_write(f'/dev/{name}', '')
+		diskstats.append(f'259 {dev_minor} {name} {counters} 0 0 0 0\n')
+		if fs:
+			_write(f'/run/udev/data/b259:{dev_minor}', f'E:ID_FS_TYPE=ext4\nE:ID_FS_UUID=uuid-{name}\nE:ID_FS_LABEL_ENC=fs-{name}\n')
+			_link(f'/dev/disk/by-uuid/uuid-{name}', f'/dev/{name}')
+			_link(f'/dev/disk/by-label/fs-{name}', f'/dev/{name}')
+		names.append(name)
+
+	partition_names = []
+	for disk_index in range(disks):
+		name = _disk_name(disk_index)
+		host_dir = f'/sys/devices/platform/statblk-fake/host{disk_index}'
+		disk_dir = f'{host_dir}/block/{name}'
+		_write(f'{host_dir}/device/model', 'STATBLK FAKE DISK\n')
+		_write(f'{host_dir}/device/serial', f'FAKE{disk_index:08d}\n')
+		_write(f'{host_dir}/device/hwmon/hwmon{disk_index}/temp1_input', f'{38000 + disk_index * 1000}\n')
+		_link(f'{disk_dir}/device', f'{host_dir}/device')
+		for queue_file, value in (('hw_sector_size', 512), ('logical_block_size', 512), ('physical_block_size', 4096),
+				('discard_max_bytes', 2147450880), ('rotational', 0), ('nr_requests', 256), ('read_ahead_kb', 128)):
+			_write(f'{disk_dir}/queue/{queue_file}', f'{value}\n')
+		_write(f'{disk_dir}/queue/scheduler', '[none] mq-deadline\n')
+		_block(disk_dir, name, 2 ** 21 * (partitions + 1), fs=False)
+		for partition in range(1, partitions + 1):
+			part_name = f'{name}{partition}'
+			_block(f'{disk_dir}/{part_name}', part_name, 2 ** 21, partition=partition)
+			partition_names.append((part_name, f'{disk_dir}/{part_name}'))
+	for dm_index in range(dm):
+		name = f'dm-{dm_index}'
+		dm_dir = f'/sys/devices/virtual/block/{name}'
+		_write(f'{dm_dir}/dm/name', f'vg-lv{dm_index}\n')
+		if partition_names:
+			part_name, part_dir = partition_names[dm_index % len(partition_names)]
+			_link(f'{dm_dir}/slaves/{part_name}', part_dir)
+			_link(f'{part_dir}/holders/{name}', dm_dir)
+		_block(dm_dir, name, 2 ** 20, fs=False)
+	for loop_index in range(loops):
+		name = f'loop{loop_index}'
+		_block(f'/sys/devices/virtual/block/{name}', name, 0, fs=False)
+	mountinfo = []
+	mounted = partition_names if mounts is None else partition_names[:mounts]
+	for mount_id, (part_name, _) in enumerate(mounted, start=100):
+		os.makedirs(os.path.join(root, 'mnt', part_name), exist_ok=True)
+		mountinfo.append(f'{mount_id} 1 259:0 / /mnt/{part_name} rw,relatime - ext4 /dev/{part_name} rw\n')
+	_write('/proc/diskstats', ''.join(diskstats))
+	_write('/proc/self/mountinfo', ''.join(mountinfo))
+	if cgroups:
+		idle = ''.join(f'259:{dev_minor} rbytes=0 wbytes=0 rios=0 wios=0 dbytes=0 dios=0\n' for dev_minor in range(min(minor[0], 4)))
+		_write('/sys/fs/cgroup/cgroup.controllers', 'cpu io memory pids\n')
+		_write('/sys/fs/cgroup/kubepods.slice/io.stat', idle)
+		for pod in range(cgroups):
+			_write(f'/sys/fs/cgroup/kubepods.slice/pod{pod}.slice/io.stat', idle)
+	return names
+
+def add_fake_cgroup_io(root, cgroup, devnum, read_bytes=0, write_bytes=0, reads=0, writes=0):
+	"""Add I/O to one device line of a build_fake_tree cgroup and, as the kernel does, its ancestors."""
+	added = {'rbytes': read_bytes, 'wbytes': write_bytes, 'rios': reads, 'wios': writes}
+	parts = cgroup.strip('/').split('/')
+	for depth in range(len(parts), 0, -1):
+		path = os.path.join(root, 'sys/fs/cgroup', *parts[:depth], 'io.stat')
+		stats = {}
+		with open(path, 'r', encoding='utf-8') as f:
+			for line in f:
+				fields = line.split()
+				if fields:
+					stats[fields[0]] = dict(field.split('=', 1) for field in fields[1:])
+		counters = stats.setdefault(devnum, {})
+		for key in ('rbytes', 'wbytes', 'rios', 'wios', 'dbytes', 'dios'):
+			counters[key] = str(int(counters.get(key, 0)) + added.get(key, 0))
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(''.join(key + ' ' + ' '.join(f'{name}={value}' for name, value in values.items()) + '\n' for key, values in stats.items()))
+
+def fake_tree_layout(devices):
+	"""Split a device count into build_fake_tree arguments (disks with 2 partitions, 1/8 dm, the rest loop).
+
+	The tree has exactly devices block devices (at least 3: one disk and its partitions).
+
+	>>> fake_tree_layout(1000)
+	{'disks': 250, 'partitions': 2, 'dm': 125, 'loops': 125}
+	>>> [sum(count * (3 if kind == 'disks' else 1) for kind, count in fake_tree_layout(size).items() if kind != 'partitions') for size in (3, 10, 11, 1000)]
+	[3, 10, 11, 1000]
+	"""
+	dm = devices // 8
+	disks = max(1, (devices - 2 * dm) // 3)
+	return {'disks': disks, 'partitions': 2, 'dm': dm, 'loops': max(0, devices - 3 * disks - dm)}
@@ -0,0 +1,119 @@
+"""statblk scenarios that need a device tree, run against tests/fake_tree.py fixtures.
+
+Run from the repository root::
+
+    python -m unittest -v
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import statblk
+from tests.fake_tree import build_fake_tree, add_fake_cgroup_io
+
+class FakeTreeTestCase(unittest.TestCase):
+	def use_fake_tree(self, subdir='', **layout):
+		"""Build a fake tree in a fresh temporary directory and point statblk at it; returns (tmp, root)."""
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		root = os.path.join(tmp.name, subdir) if subdir else tmp.name
+		build_fake_tree(root, **layout)
+		statblk.set_root(root)
+		self.addCleanup(statblk.set_root, '')
+		return tmp.name, root
+
+class ProbeTest(FakeTreeTestCase):
+	def test_hwmon_temperature(self):
+		self.use_fake_tree(disks=2, partitions=0)
+		self.assertEqual([statblk.read_hwmon_temperature(disk) for disk in ('/dev/sda', '/dev/sdb', '/dev/sdz')], [38, 39, None])
+
+	def test_scheduler_and_queue_of_partition_parent(self):
+		self.use_fake_tree(disks=1, partitions=1)
+		values = [(statblk.read_scheduler_column(device, None), statblk.read_queue_int(device, 'physical_block_size'))
+			for device in ('/dev/sda', '/dev/sda1')]
+		self.assertEqual(values, [('none', 4096), ('none', 4096)])
+
+class DeviceGraphTest(FakeTreeTestCase):
+	def test_stacking(self):
+		self.use_fake_tree(disks=2, partitions=1, dm=1, loops=1)
+		graph = statblk.DeviceGraph(statblk.get_blocks())
+		self.assertEqual(graph.physical_disks('/dev/dm-0'), ['/dev/sda'])
+		self.assertEqual(graph.physical_disks('/dev/sdb1'), ['/dev/sdb'])
+		self.assertEqual(graph.physical_disks('tmpfs'), [])
+		self.assertEqual(graph.top_holders('/dev/sda'), ['/dev/dm-0'])
+		self.assertEqual(graph.top_holders('/dev/dm-0'), [])
+		self.assertEqual(graph.display_name('/dev/dm-0'), 'vg-lv0')
+		self.assertTrue(graph.is_physical('/dev/loop0'))
+		self.assertTrue(graph.is_volume('/dev/dm-0'))
+		self.assertFalse(graph.is_volume('/dev/sda1'))
+
+	def test_tree_rows(self):
+		self.use_fake_tree(disks=2, partitions=2, dm=2, mounts=0)
+		output_fields = ['NAME', 'MAPPER', 'DISKS']
+		rows = statblk.tree_rows(statblk.iter_drives_info(output_fields=output_fields, show_zero_size_devices=True), output_fields)
+		self.assertEqual(rows, [
+			['sda', '', 'sda'],
+			['├─sda1', '', 'sda'],
+			['│ └─dm-0', 'vg-lv0', 'sda'],
+			['└─sda2', '', 'sda'],
+			['  └─dm-1', 'vg-lv1', 'sda'],
+			['sdb', '', 'sdb'],
+			['├─sdb1', '', 'sdb'],
+			['└─sdb2', '', 'sdb'],
+		])
+
+class CgroupIOScannerTest(FakeTreeTestCase):
+	def test_idle_subtrees_are_skipped(self):
+		_, root = self.use_fake_tree(disks=1, partitions=0, cgroups=3)
+		scanner = statblk.CgroupIOScanner()
+		self.assertEqual(scanner.scan(time_now=10.0), [])
+		self.assertEqual(scanner.scan(time_now=11.0), [])
+		self.assertEqual(scanner.files_read, 1)
+		add_fake_cgroup_io(root, 'kubepods.slice/pod1.slice', '259:0', read_bytes=2048, reads=4)
+		busy = scanner.scan(time_now=12.0)
+		self.assertEqual([(cgroup, device, rates.READ, rates.R_IOPS) for cgroup, device, rates in busy],
+			[('/kubepods.slice', '/dev/sda', 2048, 4.0), ('/kubepods.slice/pod1.slice', '/dev/sda', 2048, 4.0)])
+		self.assertEqual(scanner.files_read, 4)
+
+class DaemonTest(FakeTreeTestCase):
+	def test_answer_applies_client_options(self):
+		self.use_fake_tree(disks=2, partitions=1, mounts=1)
+		daemon = statblk.StatblkDaemon(interval=60)
+		daemon.refresh()
+		header, body = daemon.answer({'output': 'NAME,FSTYPE,MOUNTPOINT', 'mounted_only': True})
+		self.assertEqual((header['status'], header['tick']), ('ok', 1))
+		self.assertEqual([line.split() for line in body.strip().splitlines()],
+			[['NAME', '|', 'FSTYPE', '|', 'MOUNTPOINT'], ['-----+--------+-----------'], ['sda1', '|', 'ext4', '|', '/mnt/sda1']])
+
+	def test_query_over_socket(self):
+		tmp, _ = self.use_fake_tree('host', disks=1, partitions=2)
+		daemon = statblk.StatblkDaemon(interval=60)
+		daemon.refresh()
+		socket_path = os.path.join(tmp, 'statblk.sock')
+		server = statblk.make_daemon_server(socket_path, daemon)
+		self.addCleanup(server.server_close)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		self.addCleanup(server.shutdown)
+		body = statblk.query_daemon({'output': 'NAME,LABEL', 'format': 'json', 'filter_patterns': ['sda2']}, socket_path)
+		self.assertEqual(json.loads(body), [['NAME', 'LABEL'], ['sda2', 'fs-sda2']])
+
+class ReplayTest(FakeTreeTestCase):
+	def test_capture_and_replay(self):
+		tmp, _ = self.use_fake_tree('host', disks=1, partitions=1)
+		archive = os.path.join(tmp, 'snap.tar.xz')
+		manifest = statblk.capture_snapshot(archive, duration=0)
+		statblk.set_root('')
+		statblk.start_replay(archive)
+		try:
+			rows = statblk.get_drives_info(output='NAME,FSTYPE,MOUNTPOINT,MODEL', show_zero_size_devices=True)
+		finally:
+			statblk.stop_replay()
+		self.assertEqual(len(manifest['samples']), 1)
+		self.assertEqual(rows[1:], [['sda', '', '', 'STATBLK FAKE DISK'], ['sda1', 'ext4', '/mnt/sda1', 'STATBLK FAKE DISK']])
+		self.assertIsNone(statblk._REPLAY)
+		self.assertEqual(statblk._ROOT, '')
+
+if __name__ == '__main__':
+	unittest.main()